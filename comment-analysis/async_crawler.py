@@ -0,0 +1,335 @@
+"""
+股吧评论异步爬虫
+
+所有股票共用一个aiohttp会话和keep-alive连接池：全局信号量限制同时进行的请求数，
+每个主机限制连接数和每秒请求数。每只股票按页顺序爬取（一次并发预取lookahead页），
+多只股票同时进行，某只股票满足check_date_cycle或连续多页无数据后单独停止。
+评论写入评论存储（见comment_store.py），每页写入后记录爬取状态（见crawl_state.py），
+中断后再次运行从上次的页码继续，已爬满一年的股票只获取新评论。
+
+用法：
+    python async_crawler.py --all --concurrency 16 --per-host 8 --rate 10
+    python async_crawler.py --codes 601360 --fixtures fixtures/guba   # 使用本地录制的页面
+    python async_crawler.py --codes 601360 000001 --synthetic         # 使用本地合成页面
+    python async_crawler.py --codes 601360 --synthetic --proxy        # 通过本地假代理供应商分配的代理
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+from colorama import Fore
+
+from comment_store import CommentStore
+from crawl_state import CrawlState, MAX_REFRESH_PAGES
+from fake_proxy_vendor import API_KEY, API_SECRET, FakeProxyVendor
+from guba_fixture_server import GubaFixtureServer, page_filename
+from guba_common import (BASE_URL, check_date_cycle, create_proxy_pool, get_headers, save_comments,
+                         spider_out_comment)
+from proxy_pool import ProxyPool, XiangProxyVendor
+
+# 将仓库根目录加入模块搜索路径，以便导入公共模块common
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.db import get_stock_codes  # noqa: E402
+
+# 这些状态码说明服务端暂时不可用，值得重试
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# 连续多少页没有数据就停止爬取该股票
+MAX_EMPTY_PAGES = 5
+
+
+class RateLimiter:
+    """按固定间隔放行请求，rate为每秒请求数，0表示不限速"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_time = 0.0
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        # 先预约时间再等待，多个协程同时调用时依次排开
+        wait = self.next_time - now
+        self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class CrawlStats:
+    def __init__(self):
+        self.pages = 0       # 成功获取的页数
+        self.failed = 0      # 重试后仍失败的页数
+        self.retries = 0
+        self.bytes = 0
+        self.comments = 0
+        self.started = time.monotonic()
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'pages': self.pages,
+            'failed_pages': self.failed,
+            'retries': self.retries,
+            'comments': self.comments,
+            'megabytes': round(self.bytes / 1e6, 2),
+            'elapsed': round(elapsed, 1),
+            'pages_per_sec': round(self.pages / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+
+class GubaCrawler:
+    """
+    用法：
+        async with GubaCrawler(concurrency=16) as crawler:
+            results = await crawler.crawl_many(['601360', '000001'])
+    """
+
+    def __init__(self, base_url=BASE_URL, concurrency=16, per_host=8, rate=10.0, lookahead=2,
+                 stock_concurrency=None, timeout=10, max_retries=3, backoff=1.0, proxy_pool=None, state=None,
+                 comments=None):
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.rate = rate
+        self.lookahead = lookahead
+        self.stock_concurrency = stock_concurrency or concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.proxy_pool = proxy_pool
+        # 没有传入爬取状态和评论存储时自己创建，关闭爬虫时一起关闭
+        self.owns_state = state is None
+        self.state = state or CrawlState()
+        self.owns_comments = comments is None
+        self.comments = comments or CommentStore()
+        self.session = None
+        self.semaphore = None
+        self.limiters = {}
+        self.stats = CrawlStats()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        """在当前事件循环中创建会话，所有股票共用连接池"""
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host,
+                                             keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        if self.owns_state:
+            self.state.close()
+        if self.owns_comments:
+            self.comments.close()
+
+    def page_url(self, stock_code, page):
+        return f'{self.base_url}/{page_filename(stock_code, page)}'
+
+    def limiter_for(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.limiters:
+            self.limiters[host] = RateLimiter(self.rate)
+        return self.limiters[host]
+
+    async def lease_proxy(self):
+        """从代理池借出一个代理，池中暂时没有可用代理时在线程中等待，不阻塞事件循环"""
+        if self.proxy_pool is None:
+            return None
+        proxy = self.proxy_pool.lease(timeout=0)
+        if proxy is None:
+            proxy = await asyncio.to_thread(self.proxy_pool.lease, self.timeout.total)
+        return proxy
+
+    async def fetch(self, url):
+        """获取一个页面，失败时按指数退避重试，最终失败返回None"""
+        headers = get_headers()
+        headers['Host'] = urlsplit(url).netloc
+        for attempt in range(1, self.max_retries + 2):
+            proxy = None
+            ok = False
+            started = time.monotonic()
+            try:
+                # 先按主机限速再占用全局并发名额，被限速的主机不会占着名额拖慢其他主机
+                await self.limiter_for(url).acquire()
+                async with self.semaphore:
+                    proxy = await self.lease_proxy()
+                    if self.proxy_pool is not None and proxy is None:
+                        raise asyncio.TimeoutError('没有可用代理')
+                    started = time.monotonic()
+                    async with self.session.get(url, headers=headers, proxy=proxy and proxy.url) as response:
+                        if response.status == 200:
+                            text = await response.text()
+                            ok = True
+                            self.stats.pages += 1
+                            self.stats.bytes += len(text)
+                            return text
+                        if response.status not in RETRY_STATUS:
+                            print(Fore.RED + f'获取页面失败，状态码: {response.status} {url}')
+                            break
+                        error = f'状态码{response.status}'
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            finally:
+                if proxy is not None:
+                    self.proxy_pool.release(proxy, ok, time.monotonic() - started)
+            if attempt > self.max_retries:
+                print(Fore.RED + f'请求错误: {error} {url}')
+                break
+            self.stats.retries += 1
+            await asyncio.sleep(self.backoff * (2 ** (attempt - 1)) * (0.5 + random.random()))
+        self.stats.failed += 1
+        return None
+
+    async def refresh_stock(self, stock_code):
+        """已爬满一年的股票只获取比上次最新评论更新的帖子"""
+        new_rows = []
+        page = 0
+        for page in range(1, MAX_REFRESH_PAGES + 1):
+            content = await self.fetch(self.page_url(stock_code, page))
+            if not content:
+                break
+            rows, stop = self.state.refresh_page(stock_code, spider_out_comment(content, stock_code))
+            new_rows.extend(rows)
+            if stop:
+                break
+        added = self.state.finish_refresh(stock_code, self.comments, new_rows)
+        self.stats.comments += added
+        return {'stock_code': stock_code, 'status': 'refreshed', 'pages': page, 'comments': added}
+
+    async def crawl_stock(self, stock_code):
+        """按页爬取一只股票的评论直到满一年，返回结果摘要"""
+        mode, start_page = self.state.begin(stock_code, self.comments)
+        if mode == 'refresh':
+            return await self.refresh_stock(stock_code)
+
+        comments = 0
+        page = start_page
+        empty_pages = 0
+        status = 'running'
+        while status == 'running':
+            # 一次预取lookahead页，按页码顺序处理，保证写入顺序与爬取顺序一致
+            pages = list(range(page, page + self.lookahead))
+            contents = await asyncio.gather(*(self.fetch(self.page_url(stock_code, p)) for p in pages))
+            for p, content in zip(pages, contents):
+                if content is None:
+                    # 请求失败的页不记录，下次运行从这里继续
+                    status = 'failed'
+                    break
+                data = spider_out_comment(content, stock_code)
+                if not data:
+                    self.state.skip_page(stock_code, p)
+                    empty_pages += 1
+                    if empty_pages >= MAX_EMPTY_PAGES:
+                        print(Fore.YELLOW + f'股票 {stock_code} 连续{empty_pages}页无数据，停止爬取')
+                        status = 'exhausted'
+                        break
+                    continue
+                empty_pages = 0
+                # 翻页期间有新帖子时页面会整体后移，评论存储忽略已经保存过的帖子
+                added = save_comments(data, stock_code, self.comments)
+                if added is None:
+                    # 保存失败的页同样不记录，下次运行从这里继续
+                    status = 'failed'
+                    break
+                comments += len(added)
+                tail_time = self.state.record_page(stock_code, p, data)
+                if check_date_cycle(tail_time):
+                    print(Fore.GREEN + f'股票 {stock_code} 已爬取完一年数据，停止爬取')
+                    status = 'complete'
+                    break
+            page += self.lookahead
+
+        if status != 'failed':
+            self.state.mark_complete(stock_code)
+        self.stats.comments += comments
+        return {'stock_code': stock_code, 'status': status, 'mode': mode, 'pages': page - start_page,
+                'comments': comments}
+
+    async def crawl_many(self, stock_codes):
+        """同时爬取多只股票，最多stock_concurrency只同时进行，返回每只股票的结果摘要"""
+        await self.open()
+        stock_semaphore = asyncio.Semaphore(self.stock_concurrency)
+
+        async def run(stock_code):
+            async with stock_semaphore:
+                try:
+                    return await self.crawl_stock(stock_code)
+                except Exception as e:
+                    print(Fore.RED + f'爬取股票 {stock_code} 时出错: {e}')
+                    return {'stock_code': stock_code, 'status': 'failed', 'error': str(e)}
+
+        results = []
+        for next_done in asyncio.as_completed([run(code) for code in dict.fromkeys(stock_codes)]):
+            result = await next_done
+            results.append(result)
+            print(Fore.BLUE + f'[{len(results)}/{len(stock_codes)}] {result}  总体: {self.stats.summary()}')
+        return results
+
+
+async def crawl(stock_codes, args):
+    kwargs = dict(concurrency=args.concurrency, per_host=args.per_host, rate=args.rate,
+                  lookahead=args.lookahead, stock_concurrency=args.stock_concurrency)
+    if args.fixtures or args.synthetic:
+        # 使用本地页面服务，不限速；使用代理时由本地假代理供应商分配代理
+        async with GubaFixtureServer(args.fixtures, synthetic=args.synthetic) as server:
+            if not args.proxy:
+                async with GubaCrawler(server.base_url, **dict(kwargs, rate=0)) as crawler:
+                    await crawler.crawl_many(stock_codes)
+                    print(Fore.GREEN + f'爬取结束: {crawler.stats.summary()}')
+                return
+            async with FakeProxyVendor(bad=2) as vendor:
+                proxy_pool = ProxyPool(XiangProxyVendor(API_KEY, API_SECRET, api_url=vendor.api_url))
+                try:
+                    async with GubaCrawler(server.base_url, proxy_pool=proxy_pool, **dict(kwargs, rate=0)) as crawler:
+                        await crawler.crawl_many(stock_codes)
+                        print(Fore.GREEN + f'爬取结束: {crawler.stats.summary()}')
+                    print(Fore.BLUE + f'代理池: {proxy_pool.stats()}')
+                finally:
+                    # 补充线程可能正在请求本事件循环中的假供应商，在线程中等待它退出
+                    await asyncio.to_thread(proxy_pool.stop)
+        return
+
+    proxy_pool = create_proxy_pool() if args.proxy else None
+    async with GubaCrawler(proxy_pool=proxy_pool, **kwargs) as crawler:
+        await crawler.crawl_many(stock_codes)
+        print(Fore.GREEN + f'爬取结束: {crawler.stats.summary()}')
+    if proxy_pool is not None:
+        print(Fore.BLUE + f'代理池: {proxy_pool.stats()}')
+        await asyncio.to_thread(proxy_pool.stop)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='股吧评论异步爬虫')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--codes', nargs='+', help='股票代码列表')
+    group.add_argument('--all', action='store_true', help='爬取stock_info中的全部股票')
+    parser.add_argument('--concurrency', type=int, default=16, help='全局同时进行的请求数')
+    parser.add_argument('--per-host', type=int, default=8, help='每个主机的最大连接数')
+    parser.add_argument('--rate', type=float, default=10.0, help='每个主机每秒的最大请求数，0为不限速')
+    parser.add_argument('--lookahead', type=int, default=2, help='每只股票一次预取的页数')
+    parser.add_argument('--stock-concurrency', type=int, help='同时爬取的股票数，默认与--concurrency相同')
+    parser.add_argument('--proxy', action='store_true',
+                        help='通过代理池发送请求，使用本地页面时代理来自本地假代理供应商')
+    parser.add_argument('--fixtures', help='使用本地录制页面的目录')
+    parser.add_argument('--synthetic', action='store_true', help='使用本地合成页面')
+    args = parser.parse_args()
+
+    stock_codes = get_stock_codes() if args.all else args.codes
+    if not stock_codes:
+        print(Fore.RED + '没有获取到股票代码')
+    else:
+        asyncio.run(crawl(stock_codes, args))
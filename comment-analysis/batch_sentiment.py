@@ -0,0 +1,171 @@
+"""
+多进程情感分析
+
+先清洗每只股票新写入评论存储的评论，再把还没有打分的评论按爬取顺序切成若干分片，分发到进程池并行打分。
+每个工作进程在初始化时加载一次jieba词典和情感模型；每个分片完成后立即把分数写回评论存储，
+中断后重新运行时已经打过分的评论不会重新计算。
+
+用法：
+    python batch_sentiment.py                       # 全部股票，只为没有打分的评论打分
+    python batch_sentiment.py --codes 601360 000001 --workers 4
+    python batch_sentiment.py --rescore             # 清除已有分数，全部重新打分
+    python batch_sentiment.py --incremental         # 每日更新：在当前进程中为新评论打分并更新情感趋势
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from clean_comments import clean_comments
+from comment_store import CHUNK_SIZE, CommentStore
+from emotionRating import get_analyzer, process_comments
+from sentiment_trend import generate_sentiment_trend
+
+# 将仓库根目录加入模块搜索路径，以便导入公共模块common
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.db import get_stock_codes  # noqa: E402
+
+
+# ---------- 工作进程 ----------
+
+def init_worker():
+    """工作进程初始化：加载jieba词典和情感模型"""
+    get_analyzer()
+
+
+def score_shard(titles):
+    """在工作进程中为一个分片打分，返回(分数数组, 耗时)"""
+    start = time.perf_counter()
+    scores = get_analyzer().score_many(titles)
+    return scores, time.perf_counter() - start
+
+
+# ---------- 调度 ----------
+
+def iter_shards(stock_codes, chunk_size, store, rescore, states, on_ready):
+    """逐只股票清洗新评论并生成待打分的分片(股票代码, 帖子ID列表, 标题列表)"""
+    for stock_code in stock_codes:
+        clean_comments(stock_code, store)
+        if rescore:
+            store.reset_sentiment(stock_code)
+        state = states[stock_code] = {'pending': 0, 'scored': 0, 'submitted': False, 'failed': False}
+        for chunk in store.iter_pending(stock_code, 'sentiment', chunk_size):
+            state['pending'] += 1
+            yield stock_code, chunk['post_id'].tolist(), chunk['title'].tolist()
+        state['submitted'] = True
+        if not state['pending']:
+            on_ready(stock_code)
+
+
+def run_batch(stock_codes, workers, chunk_size=CHUNK_SIZE, rescore=False):
+    """并行为股票列表中还没有打分的评论打分，返回{股票代码: 打分条数}，有分片失败的股票为None"""
+    stock_codes = list(dict.fromkeys(stock_codes))
+    print(f"共{len(stock_codes)}只股票，{workers}个进程，每个分片{chunk_size}条评论")
+
+    store = CommentStore()
+    states = {}
+    results = {}
+    start_time = time.perf_counter()
+    scored = 0            # 本次运行打分的评论数
+    shard_seconds = 0.0   # 各分片耗时之和
+
+    def finish(stock_code):
+        state = states.pop(stock_code)
+        results[stock_code] = None if state['failed'] else state['scored']
+        elapsed = time.perf_counter() - start_time
+        rate = scored / elapsed if elapsed > 0 else 0.0
+        print(f"[{len(results)}/{len(stock_codes)}] 股票{stock_code}完成，打分{state['scored']}条评论，"
+              f"总体{rate:.0f}条/秒")
+
+    shards = iter_shards(stock_codes, chunk_size, store, rescore, states, finish)
+    in_flight = {}
+    exhausted = False
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            while True:
+                # 限制同时提交的分片数，避免把所有股票的评论一次读入内存
+                while not exhausted and len(in_flight) < workers * 2:
+                    try:
+                        stock_code, post_ids, titles = next(shards)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    in_flight[executor.submit(score_shard, titles)] = (stock_code, post_ids)
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stock_code, post_ids = in_flight.pop(future)
+                    state = states[stock_code]
+                    state['pending'] -= 1
+                    try:
+                        scores, seconds = future.result()
+                        store.set_sentiment(stock_code, post_ids, scores)
+                        state['scored'] += len(scores)
+                        scored += len(scores)
+                        shard_seconds += seconds
+                    except Exception as e:
+                        # 已完成的分片已经写回评论存储，下次运行只重算失败的分片
+                        print(f"股票{stock_code}的一个分片（{len(post_ids)}条评论）打分失败: {e}")
+                        state['failed'] = True
+                    if state['submitted'] and not state['pending']:
+                        finish(stock_code)
+    finally:
+        store.close()
+    report_throughput(results, scored, shard_seconds, time.perf_counter() - start_time)
+    return results
+
+
+def run_incremental(stock_codes):
+    """
+    增量模式：清洗并为新评论打分，只更新受影响日期的日均情感
+
+    每天新增的评论很少，在当前进程中依次处理即可
+    """
+    store = CommentStore()
+    start_time = time.perf_counter()
+    try:
+        for stock_code in dict.fromkeys(stock_codes):
+            expired = clean_comments(stock_code, store)
+            affected = process_comments(stock_code, incremental=True, store=store) or []
+            dates = sorted(set(expired) | set(affected))
+            if dates:
+                generate_sentiment_trend(stock_code, dates, store)
+    finally:
+        store.close()
+    print(f"增量情感分析结束，{len(stock_codes)}只股票耗时{time.perf_counter() - start_time:.1f}秒")
+
+
+def report_throughput(results, scored, shard_seconds, elapsed):
+    """输出总体吞吐量"""
+    failed = [code for code, rows in results.items() if rows is None]
+    print(f"情感分析结束：完成{len(results) - len(failed)}只股票，失败{len(failed)}只")
+    if scored and elapsed > 0:
+        print(f"本次打分{scored}条评论，总耗时{elapsed:.1f}秒，吞吐量{scored / elapsed:.0f}条/秒，"
+              f"并行加速{shard_seconds / elapsed:.2f}倍")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多进程情感分析')
+    parser.add_argument('--codes', nargs='+', help='股票代码列表，默认stock_info中的全部股票')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='工作进程数')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='每个分片的评论数')
+    parser.add_argument('--rescore', action='store_true', help='清除已有分数，全部重新打分')
+    parser.add_argument('--incremental', action='store_true',
+                        help='在当前进程中为新评论打分，并更新受影响日期的情感趋势')
+    args = parser.parse_args()
+
+    stock_codes = args.codes or get_stock_codes()
+    if not stock_codes:
+        print("没有获取到股票代码")
+        return
+    if args.incremental:
+        run_incremental(stock_codes)
+    else:
+        run_batch(stock_codes, args.workers, args.chunk_size, args.rescore)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,129 +1,76 @@
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
-import re
 import os
+import sys
+from comment_store import CommentStore
 
-def extract_month_day(date_str):
-    """从日期字符串中提取月和日"""
-    match = re.match(r'(\d{2})-(\d{2})', date_str)
-    if not match:
-        return None
-    return tuple(map(int, match.groups()))
+# 将仓库根目录加入模块搜索路径，以便导入公共模块common
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.db import get_stock_codes  # noqa: E402
+from common.comment_dates import infer_dates  # noqa: E402
 
-def create_date(month_day, year):
-    """根据月日和年份创建日期"""
-    try:
-        return datetime(year, month_day[0], month_day[1])
-    except ValueError:
-        return None
+def infer_segment(store, stock_code, segment):
+    """推断一段连续的未清洗评论的时间，前面有已清洗的评论时以它为起点继续推断年份"""
+    update_time = segment['update_time'].to_numpy(dtype=object)
+    anchor = store.anchor(stock_code, int(segment['seq'].iloc[0]))
+    if anchor is None:
+        return infer_dates(update_time)
+    anchor_update_time, anchor_time = anchor
+    return infer_dates(np.concatenate(([anchor_update_time], update_time)), pd.Timestamp(anchor_time))[1:]
+
+def clean_comments(stock_code, store=None):
+    """
+    清洗指定股票新写入评论存储的评论,只保留一年内的数据
 
-def clean_comments(stock_code):
-    """清洗指定股票的评论数据,只保留一年内的数据"""
-    # 确保data目录存在
-    data_dir = os.path.join(os.path.dirname(__file__), 'data')
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
-    
-    # 构建输入输出文件路径
-    input_file = os.path.join(data_dir, f'comments_{stock_code}.csv')
-    output_file = os.path.join(data_dir, f'comments_{stock_code}_clean.csv')
-    
-    if not os.path.exists(input_file):
-        print(f"找不到股票{stock_code}的评论文件")
-        return
-        
+    返回因为超出一年而被剔除的已打分评论的日期，这些日期的日均情感需要重新计算
+    """
+    own_store = store is None
+    store = store or CommentStore()
     try:
-        # 读取CSV文件
-        df = pd.read_csv(input_file, encoding='utf-8')
-        
-        # 删除空的评论
-        df = df.dropna(subset=['title'])
-        
-        # 获取当前年份
-        current_year = datetime.now().year
-        
-        # 存储处理后的数据
-        valid_rows = []
-        dates = []
-        
-        # 记录第一条评论的月日
-        first_month_day = None
-        # 记录已经处理的行数
-        processed_rows = 0
-        # 设置检测循环的最小行数(经验值)
-        MIN_ROWS_FOR_CYCLE = 1000
-        
-        # 获取第一行的月日作为最新日期
-        if not df.empty:
-            first_month_day = extract_month_day(df.iloc[0]['update_time'])
-            if first_month_day:
-                first_date = create_date(first_month_day, current_year)
-                if first_date:
-                    dates.append(first_date)
-                    valid_rows.append(df.iloc[0])
-        
-        # 处理剩余行
-        for idx, row in df.iloc[1:].iterrows():
-            month_day = extract_month_day(row['update_time'])
-            if not month_day:
-                continue
-                
-            processed_rows += 1
-            
-            # 如果处理的行数超过最小值且遇到相同的月日，说明发生了循环
-            if processed_rows > MIN_ROWS_FOR_CYCLE and month_day == first_month_day:
-                break
-                
-            date = create_date(month_day, current_year)
-            if date:
-                dates.append(date)
-                valid_rows.append(row)
-        
-        # 创建新的DataFrame，保持原始顺序
-        clean_df = pd.DataFrame(valid_rows)
-        
-        # 保存结果
-        clean_df.to_csv(output_file, index=False, encoding='utf-8')
-        
+        cleaned = kept = 0
+        for chunk in store.iter_pending(stock_code, 'clean'):
+            # 刷新插在最前面的评论和续爬追加在末尾的评论之间隔着已清洗的评论，分段推断
+            breaks = np.flatnonzero(np.diff(chunk['seq'].to_numpy()) > 1) + 1
+            for rows in np.split(np.arange(len(chunk)), breaks):
+                segment = chunk.iloc[rows]
+                dates = infer_segment(store, stock_code, segment)
+
+                # 删除空的评论和无法解析时间的评论
+                valid = segment['title'].notna().to_numpy() & ~pd.isna(dates)
+                times = pd.DatetimeIndex(dates).strftime('%Y-%m-%d %H:%M:%S')
+                store.set_clean(stock_code, segment['post_id'], times, valid)
+                cleaned += len(segment)
+                kept += int(valid.sum())
+
+        # 从最新一条评论往前只保留一年的数据，最新评论前移后更早的评论也一并剔除
+        expired = []
+        newest = store.newest_time(stock_code)
+        if newest is not None:
+            cutoff = pd.Timestamp(newest).normalize() - pd.DateOffset(years=1)
+            expired = store.expire(stock_code, (cutoff + pd.Timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S'))
+
         print(f"股票{stock_code}处理完成")
-        print(f"原始数据行数: {len(df)}")
-        print(f"清洗后数据行数: {len(clean_df)}")
-        if dates:
-            print(f"数据时间范围: {min(dates).strftime('%Y-%m-%d')} 到 {max(dates).strftime('%Y-%m-%d')}")
-            print(f"处理的行数: {processed_rows}")
-            
-    except Exception as e:
-        print(f"处理股票{stock_code}时出错: {e}")
+        print(f"新清洗评论数: {cleaned}，保留: {kept}")
+        if newest is not None:
+            print(f"最新评论时间: {newest}，超出一年的已打分评论涉及{len(expired)}天")
+        return expired
 
-def get_stock_codes():
-    """从数据库获取股票代码列表"""
-    from sqlalchemy import create_engine, text
-    
-    db_config = {
-        'user': 'root',
-        'password': '123456',
-        'host': '127.0.0.1',
-        'database': 'stocks'
-    }
-    
-    engine = create_engine(
-        f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}")
-    
-    try:
-        with engine.connect() as connection:
-            result = connection.execute(text("SELECT stock_code FROM stock_info"))
-            return [row[0] for row in result]
     except Exception as e:
-        print(f"获取股票代码失败: {e}")
+        print(f"处理股票{stock_code}时出错: {e}")
         return []
     finally:
-        engine.dispose()
+        if own_store:
+            store.close()
 
 if __name__ == '__main__':
     stock_codes = get_stock_codes()
     if not stock_codes:
         print("没有获取到股票代码")
         exit(1)
-        
-    for stock_code in stock_codes:
-        clean_comments(stock_code) 
\ No newline at end of file
+
+    store = CommentStore()
+    try:
+        for stock_code in stock_codes:
+            clean_comments(stock_code, store)
+    finally:
+        store.close()
@@ -0,0 +1,292 @@
+"""
+评论存储
+
+每只股票的评论保存在SQLite（WAL）的同一张表中，以(股票代码, 帖子ID)为主键，重复写入同一个帖子不会产生
+重复记录；没有帖子ID的评论用标题和更新时间的哈希作为ID（旧CSV导入的评论都是这样），之后爬到同一个帖子的
+真实ID时就地改用真实ID，不产生重复记录。再次爬到的帖子标题或更新时间有变化时更新这一行，并清除处理结果
+重新进入各处理阶段。清洗结果（推断年份后的时间、是否保留）和情感分数
+是同一行上的列，取代原来comments_{code}.csv → comments_{code}_clean.csv → emotionRating_{code}.csv三份拷贝。
+
+seq记录爬取顺序，越小越新：全量和续爬的页追加在末尾，刷新得到的新帖子插在最前面。
+每个处理阶段只按seq顺序分块读取自己还没有处理的行：
+    clean      kept为NULL的行，写入comment_time和kept
+    sentiment  kept = 1且scored_at为NULL的行，写入sentiment和scored_at
+数据库路径可以通过环境变量SCAS_COMMENT_STORE覆盖。
+
+用法：
+    python comment_store.py --import-csv data          # 导入旧的comments_{code}.csv
+    python comment_store.py --export 601360 --output emotionRating_601360.csv   # 导出情感分析结果
+"""
+import argparse
+import glob
+import hashlib
+import os
+import re
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'comments.sqlite')
+CHUNK_SIZE = 20000
+# SQLite一条语句中参数个数的上限较低，按批查询
+_IN_BATCH = 500
+
+STAGES = {
+    'clean': "kept IS NULL",
+    'sentiment': "kept = 1 AND scored_at IS NULL",
+}
+
+
+def comment_key(row):
+    """帖子ID，没有帖子ID时用标题和更新时间的哈希"""
+    if row.get('post_id'):
+        return str(row['post_id'])
+    text = f"{row.get('title')}\x00{row.get('update_time')}"
+    return 'h' + hashlib.md5(text.encode('utf-8')).hexdigest()[:16]
+
+
+def _none_if_nan(values):
+    return [None if pd.isna(v) else v for v in values]
+
+
+class CommentStore:
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('SCAS_COMMENT_STORE', DEFAULT_PATH)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # 异步爬虫在事件循环线程中使用，同步爬虫和各处理阶段在主线程中使用
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS comments (
+                stock_code TEXT NOT NULL,
+                post_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                title TEXT,
+                update_time TEXT,
+                comment_time TEXT,
+                kept INTEGER,
+                sentiment REAL,
+                scored_at REAL,
+                PRIMARY KEY (stock_code, post_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS comments_seq ON comments (stock_code, seq);
+            CREATE TABLE IF NOT EXISTS stale_dates (
+                stock_code TEXT NOT NULL,
+                comment_date TEXT NOT NULL,
+                PRIMARY KEY (stock_code, comment_date)
+            ) WITHOUT ROWID;
+        """)
+        self.conn.commit()
+
+    # ---------- 写入 ----------
+
+    def _existing(self, stock_code, keys):
+        """已有记录的{帖子ID: (标题, 更新时间)}"""
+        existing = {}
+        for i in range(0, len(keys), _IN_BATCH):
+            batch = keys[i:i + _IN_BATCH]
+            placeholders = ','.join('?' * len(batch))
+            existing.update((key, (title, update_time)) for key, title, update_time in self.conn.execute(
+                f"SELECT post_id, title, update_time FROM comments WHERE stock_code = ? AND post_id IN ({placeholders})",
+                [stock_code] + batch))
+        return existing
+
+    def insert(self, stock_code, rows, prepend=False):
+        """
+        按爬取顺序写入一批评论，返回实际新增的记录
+
+        已有的帖子没有变化时忽略；标题或更新时间有变化时按新的位置重新排序并清除处理结果，不计入新增。
+        带帖子ID的记录先按标题和更新时间的哈希查找导入的旧记录，找到时把旧记录的ID改为帖子ID。
+        prepend为True时新记录排在已有记录之前（刷新得到的更新的帖子）
+        """
+        keys = [comment_key(row) for row in rows]
+        legacy = {key: comment_key({'title': row.get('title'), 'update_time': row.get('update_time')})
+                  for key, row in zip(keys, rows) if row.get('post_id')}
+        existing = self._existing(stock_code, list(dict.fromkeys(keys + list(legacy.values()))))
+
+        renamed, changed, new_rows, write = [], [], [], []
+        seen = set()
+        for key, row in zip(keys, rows):
+            # 同一批中重复的帖子只取第一次出现（更新的）
+            if key in seen:
+                continue
+            seen.add(key)
+            if key not in existing and legacy.get(key) in existing:
+                existing[key] = existing.pop(legacy[key])
+                renamed.append((key, stock_code, legacy[key]))
+            values = (row.get('title'), row.get('update_time'))
+            if key in existing:
+                if existing[key] == values:
+                    continue
+                changed.append(key)
+            else:
+                new_rows.append(row)
+            write.append((key, values))
+        if not renamed and not write:
+            return []
+
+        with self.conn:
+            self.conn.executemany("UPDATE comments SET post_id = ? WHERE stock_code = ? AND post_id = ?", renamed)
+            # 有变化的帖子已打分时，原来日期的日均情感需要重新计算
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO stale_dates (stock_code, comment_date) "
+                "SELECT stock_code, substr(comment_time, 1, 10) FROM comments "
+                "WHERE stock_code = ? AND post_id = ? AND kept = 1 AND scored_at IS NOT NULL",
+                [(stock_code, key) for key in changed])
+            low, high = self.conn.execute(
+                "SELECT MIN(seq), MAX(seq) FROM comments WHERE stock_code = ?", (stock_code,)).fetchone()
+            if low is None:
+                start = 0
+            elif prepend:
+                start = low - len(write)
+            else:
+                start = high + 1
+            self.conn.executemany(
+                "INSERT INTO comments (stock_code, post_id, seq, title, update_time) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(stock_code, post_id) DO UPDATE SET seq = excluded.seq, title = excluded.title, "
+                "update_time = excluded.update_time, comment_time = NULL, kept = NULL, sentiment = NULL, "
+                "scored_at = NULL",
+                [(stock_code, key, start + i, title, update_time)
+                 for i, (key, (title, update_time)) in enumerate(write)])
+        return new_rows
+
+    def import_csv(self, stock_code, path):
+        """导入旧的评论CSV文件（文件顺序即爬取顺序），返回新增的记录数"""
+        df = pd.read_csv(path, encoding='utf-8', usecols=['title', 'update_time'], dtype=str)
+        rows = [{'title': t, 'update_time': u} for t, u in zip(_none_if_nan(df['title']),
+                                                                 _none_if_nan(df['update_time']))]
+        return len(self.insert(stock_code, rows))
+
+    # ---------- 读取 ----------
+
+    def count(self, stock_code):
+        return self.conn.execute("SELECT COUNT(*) FROM comments WHERE stock_code = ?", (stock_code,)).fetchone()[0]
+
+    def crawl_rows(self, stock_code):
+        """按爬取顺序返回全部评论的标题和更新时间，没有爬取记录的旧数据用于确定时间范围"""
+        return [{'title': title, 'update_time': update_time} for title, update_time in self.conn.execute(
+            "SELECT title, update_time FROM comments WHERE stock_code = ? ORDER BY seq", (stock_code,))]
+
+    def iter_pending(self, stock_code, stage, chunk_size=CHUNK_SIZE):
+        """按爬取顺序分块返回某个阶段还没有处理的行（DataFrame）"""
+        condition = STAGES[stage]
+        last_seq = None
+        while True:
+            chunk = pd.read_sql_query(
+                "SELECT post_id, seq, title, update_time, comment_time FROM comments "
+                f"WHERE stock_code = ? AND {condition} AND seq > ? ORDER BY seq LIMIT ?",
+                self.conn, params=(stock_code, last_seq if last_seq is not None else -2 ** 62, chunk_size))
+            if chunk.empty:
+                return
+            yield chunk
+            last_seq = int(chunk['seq'].iloc[-1])
+
+    def anchor(self, stock_code, seq):
+        """seq之前最近一条已推断出时间的评论，返回(update_time, comment_time)，没有时返回None"""
+        return self.conn.execute(
+            "SELECT update_time, comment_time FROM comments "
+            "WHERE stock_code = ? AND seq < ? AND comment_time IS NOT NULL ORDER BY seq DESC LIMIT 1",
+            (stock_code, seq)).fetchone()
+
+    def newest_time(self, stock_code):
+        return self.conn.execute(
+            "SELECT MAX(comment_time) FROM comments WHERE stock_code = ?", (stock_code,)).fetchone()[0]
+
+    def load(self, stock_code, kept_only=True):
+        """按爬取顺序读取一只股票的评论和处理结果"""
+        condition = " AND kept = 1" if kept_only else ""
+        return pd.read_sql_query(
+            "SELECT post_id, title, update_time, comment_time, kept, sentiment FROM comments "
+            f"WHERE stock_code = ?{condition} ORDER BY seq", self.conn, params=(stock_code,))
+
+    def daily_sentiment(self, stock_code, dates=None):
+        """按日期汇总保留评论的情感分数，返回comment_date、mean、count三列；dates为日期字符串列表时只汇总这些日期"""
+        query = ("SELECT substr(comment_time, 1, 10) AS comment_date, AVG(sentiment) AS mean, COUNT(*) AS count "
+                 "FROM comments WHERE stock_code = ? AND kept = 1 AND sentiment IS NOT NULL")
+        params = [stock_code]
+        if dates is not None:
+            dates = list(dates)
+            if not dates:
+                return pd.DataFrame(columns=['comment_date', 'mean', 'count'])
+            query += f" AND substr(comment_time, 1, 10) IN ({','.join('?' * len(dates))})"
+            params += dates
+        query += " GROUP BY comment_date ORDER BY comment_date"
+        return pd.read_sql_query(query, self.conn, params=params)
+
+    # ---------- 各阶段的结果 ----------
+
+    def set_clean(self, stock_code, post_ids, comment_times, kept):
+        """写入清洗结果，comment_times为时间字符串（无法解析的为空）"""
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE comments SET comment_time = ?, kept = ? WHERE stock_code = ? AND post_id = ?",
+                zip(_none_if_nan(comment_times), np.asarray(kept, dtype=np.int64).tolist(),
+                    [stock_code] * len(post_ids), list(post_ids)))
+
+    def expire(self, stock_code, min_time):
+        """
+        把早于min_time的已保留评论标记为剔除（最新评论前移后超出一年的部分）
+
+        返回这些评论中已打分的日期，以及重新爬取后有变化的已打分评论原来的日期，这些日期的日均情感需要重新计算
+        """
+        with self.conn:
+            dates = {d for (d,) in self.conn.execute(
+                "SELECT DISTINCT substr(comment_time, 1, 10) FROM comments "
+                "WHERE stock_code = ? AND kept = 1 AND comment_time < ? AND scored_at IS NOT NULL",
+                (stock_code, min_time))}
+            self.conn.execute("UPDATE comments SET kept = 0 WHERE stock_code = ? AND kept = 1 AND comment_time < ?",
+                              (stock_code, min_time))
+            dates.update(d for (d,) in self.conn.execute(
+                "SELECT comment_date FROM stale_dates WHERE stock_code = ?", (stock_code,)))
+            self.conn.execute("DELETE FROM stale_dates WHERE stock_code = ?", (stock_code,))
+        return sorted(dates)
+
+    def set_sentiment(self, stock_code, post_ids, scores):
+        """写入情感分数，无法打分的记为NULL，同样不会再次处理"""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE comments SET sentiment = ?, scored_at = ? WHERE stock_code = ? AND post_id = ?",
+                zip(_none_if_nan(np.asarray(scores, dtype=np.float64).tolist()), [now] * len(post_ids),
+                    [stock_code] * len(post_ids), list(post_ids)))
+
+    def reset_sentiment(self, stock_code):
+        """清除一只股票的情感分数，下次全部重新打分"""
+        with self.conn:
+            self.conn.execute("UPDATE comments SET sentiment = NULL, scored_at = NULL WHERE stock_code = ?",
+                              (stock_code,))
+
+    def export_csv(self, stock_code, path):
+        """导出为原来emotionRating_{code}.csv的格式，供仍然读取CSV的脚本使用"""
+        df = self.load(stock_code).dropna(subset=['sentiment'])
+        df[['title', 'update_time', 'sentiment']].to_csv(path, index=False, encoding='utf-8')
+        return len(df)
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='评论存储工具')
+    parser.add_argument('--path', help='数据库路径，默认读取SCAS_COMMENT_STORE环境变量')
+    parser.add_argument('--import-csv', metavar='DATA_DIR', help='导入目录中旧的comments_{code}.csv')
+    parser.add_argument('--export', metavar='CODE', help='导出指定股票的情感分析结果')
+    parser.add_argument('--output', help='导出文件路径，默认为emotionRating_{code}.csv')
+    args = parser.parse_args()
+
+    store = CommentStore(args.path)
+    try:
+        if args.import_csv:
+            for path in sorted(glob.glob(os.path.join(args.import_csv, 'comments_*.csv'))):
+                match = re.match(r'^comments_(\d+)\.csv$', os.path.basename(path))
+                if match:
+                    added = store.import_csv(match.group(1), path)
+                    print(f"{os.path.basename(path)}: 新增{added}条评论")
+        if args.export:
+            output = args.output or f'emotionRating_{args.export}.csv'
+            print(f"导出{store.export_csv(args.export, output)}条评论到{output}")
+    finally:
+        store.close()
@@ -0,0 +1,171 @@
+"""
+评论爬取状态
+
+SQLite中按股票记录已爬取到的页码、最新和最早评论的时间，以及是否已经爬满一年。
+爬虫据此决定本次的爬取方式：
+    full     没有记录：从第1页开始全量爬取
+    resume   上次没有爬完（中途崩溃或中断）：从上次最后一页的下一页继续，追加到评论存储末尾
+最早评论的时间随每一页增量更新：只推断新的一页，以上一页最后一条评论为起点继续推断年份，
+是否已经爬满一年只看这个时间，不需要重新读取和推断全部已爬取的评论。
+    refresh  已经爬满一年：从第1页开始只取比记录中最新评论更新的帖子，排在评论存储最前面
+评论本身保存在评论存储中（见comment_store.py）。哪些帖子已经保存过由评论存储按帖子ID和更新时间判断：
+翻页期间页面后移时重复出现的帖子被忽略，收到新回复（更新时间变化）的旧帖子按新的位置更新。
+数据库路径可以通过环境变量SCAS_CRAWL_STATE覆盖。
+"""
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# 将仓库根目录加入模块搜索路径，以便导入公共模块common
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.comment_dates import infer_dates  # noqa: E402
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'crawl_state.sqlite')
+# 没有爬取记录的股票在评论存储中至少有这么多条评论才当作已经爬完（从CSV导入的旧数据）
+LEGACY_MIN_ROWS = 10
+# 刷新模式最多爬取的页数
+MAX_REFRESH_PAGES = 50
+
+
+def time_range(rows, anchor_time=None):
+    """
+    按爬取顺序推断年份后，返回最新和最早评论的时间字符串
+
+    anchor_time为这些评论之前（更新）的最后一条评论的时间时，以它为起点继续推断年份
+    """
+    update_time = [row['update_time'] for row in rows]
+    if anchor_time is None:
+        dates = infer_dates(update_time)
+    else:
+        anchor = pd.Timestamp(anchor_time)
+        dates = infer_dates([anchor.strftime('%m-%d %H:%M')] + update_time, anchor)[1:]
+    dates = dates[~pd.isna(dates)]
+    if len(dates) == 0:
+        return None, None
+    return str(pd.Timestamp(dates[0])), str(pd.Timestamp(dates[-1]))
+
+
+class CrawlState:
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('SCAS_CRAWL_STATE', DEFAULT_PATH)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # 异步爬虫在事件循环线程中使用，同步爬虫在主线程中使用
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS stocks (
+                stock_code TEXT PRIMARY KEY,
+                last_page INTEGER NOT NULL DEFAULT 0,
+                head_time TEXT,
+                tail_time TEXT,
+                complete INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL
+            );
+        """)
+        self.conn.commit()
+
+    def get(self, stock_code):
+        row = self.conn.execute(
+            "SELECT last_page, head_time, tail_time, complete FROM stocks WHERE stock_code = ?",
+            (stock_code,)).fetchone()
+        if row is None:
+            return None
+        return {'last_page': row[0], 'head_time': row[1], 'tail_time': row[2], 'complete': bool(row[3])}
+
+    def reset(self, stock_code):
+        with self.conn:
+            self.conn.execute("DELETE FROM stocks WHERE stock_code = ?", (stock_code,))
+
+    def begin(self, stock_code, comments):
+        """
+        决定本次的爬取方式，返回(mode, 起始页)
+
+        comments为评论存储。没有爬取记录但评论存储中已有足够评论的股票当作已经爬完，进入refresh模式
+        """
+        state = self.get(stock_code)
+        if state is None:
+            if comments.count(stock_code) >= LEGACY_MIN_ROWS:
+                head_time, tail_time = time_range(comments.crawl_rows(stock_code))
+                with self.conn:
+                    self.conn.execute(
+                        "INSERT INTO stocks (stock_code, head_time, tail_time, complete, updated_at) "
+                        "VALUES (?, ?, ?, 1, ?)", (stock_code, head_time, tail_time, time.time()))
+                return 'refresh', 1
+            # 评论存储按帖子ID去重，不完整的旧数据不需要删除，从第1页重新爬取即可
+            return 'full', 1
+        if state['complete']:
+            return 'refresh', 1
+        return 'resume', state['last_page'] + 1
+
+    def record_page(self, stock_code, page, rows):
+        """
+        全量或续爬时，一页写入评论存储后记录页码和时间范围，返回目前最早评论的时间
+
+        只推断这一页的时间，以记录中最早的评论为起点；最新评论的时间在第一页时确定
+        """
+        state = self.get(stock_code) or {'head_time': None, 'tail_time': None}
+        head_time, tail_time = time_range(rows, state['tail_time'])
+        head_time = state['head_time'] or head_time
+        tail_time = tail_time or state['tail_time']
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO stocks (stock_code, last_page, head_time, tail_time, updated_at) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(stock_code) DO UPDATE SET last_page = excluded.last_page, "
+                "head_time = excluded.head_time, tail_time = excluded.tail_time, updated_at = excluded.updated_at",
+                (stock_code, page, head_time, tail_time, time.time()))
+        return tail_time
+
+    def skip_page(self, stock_code, page):
+        """没有数据的页也记录页码，续爬时不再重复请求"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO stocks (stock_code, last_page, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(stock_code) DO UPDATE SET last_page = excluded.last_page, "
+                "updated_at = excluded.updated_at",
+                (stock_code, page, time.time()))
+
+    def mark_complete(self, stock_code):
+        with self.conn:
+            self.conn.execute("UPDATE stocks SET complete = 1, updated_at = ? WHERE stock_code = ?",
+                              (time.time(), stock_code))
+
+    def refresh_page(self, stock_code, page_rows):
+        """
+        刷新模式下处理一页，返回(时间晚于记录中最新评论的帖子, 是否停止)
+
+        这些帖子是新帖子或者收到新回复的旧帖子，由评论存储区分。列表页按最后回复时间从新到旧排列，
+        收到新回复的旧帖子会排在新帖子前面，所以只有这一页已经翻到最新评论的时间才停止
+        """
+        state = self.get(stock_code)
+        if not page_rows or not state or not state['head_time']:
+            # 空页说明已经翻到底；没有记录最新评论时间时无法判断，只刷新第1页
+            return list(page_rows), True
+        # 推断不出年份的记录保留
+        dates = infer_dates([row['update_time'] for row in page_rows])
+        keep = ~(dates <= np.datetime64(state['head_time']))
+        newer = [row for row, k in zip(page_rows, keep) if k]
+        return newer, len(newer) < len(page_rows)
+
+    def finish_refresh(self, stock_code, comments, rows):
+        """
+        把刷新得到的帖子写入评论存储并更新最新评论时间，返回新增的评论数
+
+        新帖子和收到新回复的旧帖子都排在评论存储最前面；刷新期间页面后移时，同一个帖子可能在相邻两页都出现，
+        评论存储按帖子ID去重
+        """
+        added = comments.insert(stock_code, rows, prepend=True)
+        head_time, _ = time_range(rows)
+        if head_time:
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE stocks SET head_time = MAX(COALESCE(head_time, ''), ?), updated_at = ? "
+                    "WHERE stock_code = ?", (head_time, time.time(), stock_code))
+        return len(added)
+
+    def close(self):
+        self.conn.close()
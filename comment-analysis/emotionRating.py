@@ -1,77 +1,54 @@
-import pandas as pd
-from snownlp import SnowNLP
-import os
-from sqlalchemy import create_engine, text
-from datetime import datetime
 from stock_sentiment import StockSentiment
+from comment_store import CommentStore
+
+_analyzer = None
+
+def get_analyzer():
+    """进程内共享的情感分析器，模型只加载一次"""
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = StockSentiment()
+    return _analyzer
 
 def analyze_sentiment(text):
     """使用改进的情感分析方法"""
-    analyzer = StockSentiment()
-    return analyzer.analyze(text)
+    return get_analyzer().analyze(text)
 
-def process_comments(stock_code):
-    """处理指定股票的评论数据"""
-    # 确保data目录存在
-    data_dir = os.path.join(os.path.dirname(__file__), 'data')
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
+def score_pending(stock_code, store):
+    """按爬取顺序分块为已清洗、还没有打分的评论打分，返回(打分条数, 涉及的日期)"""
+    scored = 0
+    affected = set()
+    for chunk in store.iter_pending(stock_code, 'sentiment'):
+        # 批量进行情感分析，重复的评论只计算一次
+        scores = get_analyzer().score_many(chunk['title'].tolist())
+        store.set_sentiment(stock_code, chunk['post_id'], scores)
+        scored += len(chunk)
+        affected.update(chunk['comment_time'].dropna().str[:10])
+    return scored, affected
+
+def process_comments(stock_code, incremental=False, store=None):
+    """
+    处理指定股票的评论数据
     
-    # 读取评论文件
-    file_path = os.path.join(data_dir, f'comments_{stock_code}_clean.csv')
-    if not os.path.exists(file_path):
-        print(f"找不到股票{stock_code}的评论文件")
-        return
-        
+    incremental为True时只为新评论打分，返回日均情感需要更新的日期列表；全量打分时清除已有分数后全部重新打分，返回None
+    """
+    own_store = store is None
+    store = store or CommentStore()
     try:
-        # 读取CSV文件，处理可能的编码问题
-        data = pd.read_csv(file_path, encoding='utf-8')
-        
-        # 删除空的评论
-        data = data.dropna(subset=['title'])
-        
-        # 对每句评论进行情感分析
-        data['sentiment'] = data['title'].apply(analyze_sentiment)
-        
-        # 删除情感分析结果为空的行
-        data = data.dropna(subset=['sentiment'])
+        if not incremental:
+            store.reset_sentiment(stock_code)
+        scored, affected = score_pending(stock_code, store)
         
-        # 保存情感分析结果到CSV文件
-        output_file = os.path.join(data_dir, f'emotionRating_{stock_code}.csv')
-        data[['title', 'update_time', 'sentiment']].to_csv(output_file, index=False, encoding='utf-8')
-        
-        print(f"股票{stock_code}的情感分析完成")
+        print(f"股票{stock_code}的情感分析完成，新打分{scored}条评论，影响{len(affected)}天")
+        return sorted(affected) if incremental else None
         
     except Exception as e:
         print(f"处理股票{stock_code}时出错: {e}")
-
-def get_stock_codes():
-    """从数据库获取股票代码列表"""
-    db_config = {
-        'user': 'root',
-        'password': '123456',
-        'host': '127.0.0.1',
-        'database': 'stocks'
-    }
-    
-    engine = create_engine(
-        f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}")
-    
-    try:
-        with engine.connect() as connection:
-            result = connection.execute(text("SELECT stock_code FROM stock_info"))
-            return [row[0] for row in result]
-    except Exception as e:
-        print(f"获取股票代码失败: {e}")
-        return []
     finally:
-        engine.dispose()
+        if own_store:
+            store.close()
 
 if __name__ == '__main__':
-    stock_codes = get_stock_codes()
-    if not stock_codes:
-        print("没有获取到股票代码")
-        exit(1)
-        
-    for stock_code in stock_codes:
-        process_comments(stock_code)
+    # 全部股票使用多进程并行打分，见batch_sentiment.py
+    from batch_sentiment import main
+    main()
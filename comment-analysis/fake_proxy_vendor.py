@@ -0,0 +1,141 @@
+"""
+本地假代理供应商
+
+提供与小象代理相同格式的取代理API（/ip/get），并在本地启动若干个HTTP转发代理供其分配，
+用于在不消耗真实代理额度的情况下测试proxy_pool和爬虫。API同样限制两次调用的最小间隔，
+调用过快时返回错误；可以指定一部分代理为坏代理（总是返回502）或者给代理加上延迟。
+
+用法：
+    python fake_proxy_vendor.py --port 8766 --proxies 8 --bad 2
+    python async_crawler.py --codes 601360 --synthetic --proxy    # 爬虫通过假代理访问本地页面
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import aiohttp
+from aiohttp import web
+
+API_KEY = 'test'
+API_SECRET = 'test'
+
+
+class FakeProxyVendor:
+    def __init__(self, host='127.0.0.1', port=0, proxies=8, bad=0, latency=0.0, min_interval=10.0,
+                 app_key=API_KEY, app_secret=API_SECRET):
+        self.host = host
+        self.port = port
+        self.proxy_count = proxies
+        self.bad = bad                    # 坏代理的数量
+        self.latency = latency            # 代理转发的最大附加延迟（秒），每个代理固定一个随机值
+        self.min_interval = min_interval  # API两次调用的最小间隔（秒）
+        self.app_key = app_key
+        self.app_secret = app_secret
+        self.proxy_ports = []
+        self.bad_ports = set()
+        self.port_latency = {}
+        self.next_index = 0
+        self.last_call = None
+        self.api_calls = 0
+        self.forwarded = 0
+        self.session = None
+        self.api_runner = None
+        self.proxy_runner = None
+
+    @property
+    def api_url(self):
+        return f"http://{self.host}:{self.port}/ip/get"
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    async def start(self):
+        self.session = aiohttp.ClientSession()
+
+        api = web.Application()
+        api.router.add_get('/ip/get', self.handle_api)
+        self.api_runner = web.AppRunner(api)
+        await self.api_runner.setup()
+        site = web.TCPSite(self.api_runner, self.host, self.port)
+        await site.start()
+        # port=0时由系统分配端口
+        self.port = site._server.sockets[0].getsockname()[1]
+
+        # 所有代理共用一个应用，按本地端口区分
+        proxy_app = web.Application()
+        proxy_app.router.add_route('*', '/{tail:.*}', self.handle_proxy)
+        self.proxy_runner = web.AppRunner(proxy_app)
+        await self.proxy_runner.setup()
+        for _ in range(self.proxy_count):
+            proxy_site = web.TCPSite(self.proxy_runner, self.host, 0)
+            await proxy_site.start()
+            port = proxy_site._server.sockets[0].getsockname()[1]
+            self.proxy_ports.append(port)
+            self.port_latency[port] = random.uniform(0, self.latency)
+        self.bad_ports = set(random.sample(self.proxy_ports, min(self.bad, len(self.proxy_ports))))
+
+    async def stop(self):
+        for runner in (self.api_runner, self.proxy_runner):
+            if runner is not None:
+                await runner.cleanup()
+        self.api_runner = self.proxy_runner = None
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def handle_api(self, request):
+        self.api_calls += 1
+        params = request.query
+        if params.get('appKey') != self.app_key or params.get('appSecret') != self.app_secret:
+            return web.json_response({'code': 401, 'msg': '账号或密码错误', 'data': []})
+        now = time.monotonic()
+        if self.last_call is not None and now - self.last_call < self.min_interval:
+            return web.json_response({'code': 429, 'msg': '调用过于频繁', 'data': []})
+        self.last_call = now
+
+        cnt = max(1, int(params.get('cnt', 1)))
+        data = []
+        for _ in range(min(cnt, len(self.proxy_ports))):
+            # 按顺序轮流分配代理
+            port = self.proxy_ports[self.next_index % len(self.proxy_ports)]
+            self.next_index += 1
+            data.append({'ip': self.host, 'port': port})
+        return web.json_response({'code': 200, 'msg': '', 'data': data})
+
+    async def handle_proxy(self, request):
+        port = request.transport.get_extra_info('sockname')[1]
+        if port in self.bad_ports:
+            return web.Response(status=502, text='bad proxy')
+        if self.port_latency.get(port):
+            await asyncio.sleep(self.port_latency[port])
+        # 通过代理的请求行是完整URL，request.url即目标地址
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in ('proxy-authorization', 'host')}
+        async with self.session.request(request.method, str(request.url), headers=headers,
+                                        data=await request.read()) as upstream:
+            body = await upstream.read()
+            self.forwarded += 1
+            return web.Response(status=upstream.status, body=body,
+                                headers={'Content-Type': upstream.headers.get('Content-Type', 'text/html')})
+
+
+async def serve(args):
+    vendor = FakeProxyVendor(args.host, args.port, args.proxies, args.bad, args.latency, args.min_interval)
+    async with vendor:
+        print(f"假代理供应商已启动: {vendor.api_url}，代理端口: {vendor.proxy_ports}，坏代理: {sorted(vendor.bad_ports)}")
+        await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地假代理供应商')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--proxies', type=int, default=8, help='启动的代理数')
+    parser.add_argument('--bad', type=int, default=0, help='其中坏代理的数量')
+    parser.add_argument('--latency', type=float, default=0.0, help='代理的最大附加延迟（秒）')
+    parser.add_argument('--min-interval', type=float, default=10.0, help='API两次调用的最小间隔（秒）')
+    asyncio.run(serve(parser.parse_args()))
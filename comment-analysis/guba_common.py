@@ -0,0 +1,121 @@
+"""
+股吧爬虫的公共部分
+
+请求头、列表页解析、写入评论存储、判断是否已爬满一年，以及按配置创建代理池，
+同步爬虫（test.py、crawl_601360.py）和异步爬虫（async_crawler.py）共用。
+导入本模块没有副作用：不创建目录，也不创建代理池。
+代理账号可以通过环境变量SCAS_PROXY_APP_KEY和SCAS_PROXY_APP_SECRET覆盖。
+"""
+import os
+import random
+import sys
+from datetime import datetime
+
+import pandas as pd
+from colorama import Fore
+from fake_useragent import UserAgent
+
+from proxy_pool import ProxyPool, XiangProxyVendor
+
+# 将仓库根目录加入模块搜索路径，以便导入公共模块common
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.guba_parser import parse_list_page  # noqa: E402
+
+BASE_URL = 'https://guba.eastmoney.com'
+# 携趣代理的账号
+PROXY_APP_KEY = os.environ.get('SCAS_PROXY_APP_KEY', '1188405502527557632')
+PROXY_APP_SECRET = os.environ.get('SCAS_PROXY_APP_SECRET', 'iqInXHaO')
+
+
+def create_proxy_pool(**kwargs):
+    """创建携趣代理的代理池，第一次借出代理时启动后台补充线程"""
+    return ProxyPool(XiangProxyVendor(app_key=PROXY_APP_KEY, app_secret=PROXY_APP_SECRET), **kwargs)
+
+
+def get_random_user_agent():
+    """随机获取用户代理"""
+    try:
+        ua = UserAgent()
+        return ua.random
+    except Exception as e:
+        print(Fore.RED + f"Error creating UserAgent: {e}")
+        return 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+
+def get_headers():
+    """构造请求头"""
+    user_agent = get_random_user_agent()
+
+    accepts = [
+        'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+        'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+        'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'
+    ]
+
+    languages = [
+        'zh-CN,zh;q=0.9,en;q=0.8',
+        'zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7',
+        'en-US,en;q=0.9,zh-CN;q=0.8'
+    ]
+
+    return {
+        'User-Agent': user_agent,
+        'Accept': random.choice(accepts),
+        'Accept-Language': random.choice(languages),
+        'Accept-Encoding': 'gzip, deflate, br',
+        'Connection': 'keep-alive',
+        'Host': 'guba.eastmoney.com',
+        'Referer': 'https://guba.eastmoney.com/',
+        'DNT': '1',
+        'Upgrade-Insecure-Requests': '1'
+    }
+
+
+def page_url(stock_code, page, base_url=BASE_URL):
+    """列表页的URL，第1页没有页码"""
+    return f'{base_url}/list,{stock_code}_{page}.html' if page != 1 else f'{base_url}/list,{stock_code}.html'
+
+
+def spider_out_comment(content, stock_code):
+    """ 解析HTML内容提取所需数据 """
+    data = []
+    for post in parse_list_page(content):
+        # 只保存与当前股票相关的评论
+        if post.stock_code == stock_code:
+            data.append({
+                'post_id': post.post_id,
+                'title': post.title,
+                'update_time': post.update_time
+            })
+    return data
+
+
+def save_comments(data, stock_code, comments):
+    """ 保存数据到评论存储，返回新增的记录，失败时返回None；已经保存过的帖子没有变化时忽略，有新回复时更新 """
+    try:
+        added = comments.insert(stock_code, data)
+        print(Fore.GREEN + f'成功保存{len(added)}条新数据到评论存储。')
+        return added
+
+    except Exception as e:
+        print(Fore.RED + f'保存评论失败: {e}')
+        return None
+
+
+def check_date_cycle(tail_time):
+    """检查已爬取的最早一条评论（tail_time，见CrawlState.record_page）是否已经到一年前"""
+    if tail_time is None:
+        return False
+
+    # 获取当前日期
+    current_date = datetime.now().date()
+    target_date = (pd.Timestamp(current_date) - pd.DateOffset(years=1)).date()
+    last_date = pd.Timestamp(tail_time).date()
+
+    # 打印调试信息
+    print(Fore.BLUE + f"当前日期: {current_date}")
+    print(Fore.BLUE + f"目标日期: {target_date}")
+    print(Fore.BLUE + f"最后记录日期: {last_date}")
+
+    # 如果最后一条记录的日期早于或等于目标日期，说明已经获取到足够的数据
+    return last_date <= target_date
@@ -0,0 +1,191 @@
+"""
+本地股吧列表页服务
+
+按股吧的URL格式（/list,{code}.html 和 /list,{code}_{page}.html）提供录制好的页面，
+用于在不访问东方财富的情况下测试爬虫（test_async_crawler.py）。目录中没有对应页面时可以按股吧的
+页面结构生成合成页面，帖子时间从现在开始按固定间隔往前排，翻到足够多页后会跨过一年。
+合成页面还可以模拟之后某一天的列表：新帖子和收到新回复的旧帖子排在最前面，用于测试刷新。
+
+用法：
+    python guba_fixture_server.py --pages-dir fixtures/guba --port 8765       # 提供录制的页面
+    python guba_fixture_server.py --synthetic --port 8765                     # 提供合成页面
+    python guba_fixture_server.py --record 601360 --pages 5 --pages-dir fixtures/guba   # 录制真实页面
+"""
+import argparse
+import asyncio
+import html
+import os
+import random
+import re
+
+import aiohttp
+import pandas as pd
+from aiohttp import web
+
+ROWS_PER_PAGE = 80
+# 排在最前面的帖子（新帖子和收到新回复的旧帖子）之间的时间间隔（分钟）
+HEAD_MINUTES = 10
+_PAGE_PATTERN = re.compile(r'^list,(\d+)(?:_(\d+))?\.html$')
+
+
+def page_filename(stock_code, page):
+    return f'list,{stock_code}.html' if page == 1 else f'list,{stock_code}_{page}.html'
+
+
+def post_id(stock_code, k):
+    """合成页面中第k条帖子的ID，新帖子的k为负数"""
+    return 1000000000 + int(stock_code) % 100000 * 10000 + k
+
+
+def _post_at(index, minutes_per_post, now, head_posts):
+    """列表中第index条帖子，返回(k, 时间)"""
+    if index < len(head_posts):
+        return head_posts[index], now + pd.Timedelta(minutes=(len(head_posts) - index) * HEAD_MINUTES)
+    # 其余的旧帖子保持原来的顺序，跳过已经排到前面的
+    k = index - len(head_posts)
+    for moved in sorted(h for h in head_posts if h >= 0):
+        if moved <= k:
+            k += 1
+    return k, now - pd.Timedelta(minutes=k * minutes_per_post)
+
+
+def build_page(stock_code, page, rows=ROWS_PER_PAGE, minutes_per_post=480, max_pages=None, now=None,
+               head_posts=()):
+    """
+    按股吧列表页的结构生成一页帖子，第k条帖子（从0开始）的时间为now往前k * minutes_per_post分钟
+
+    head_posts按顺序给出排在最前面的帖子，时间晚于now：负数-j为第j个新帖子，非负数k为收到新回复的第k条旧帖子
+    """
+    now = (now or pd.Timestamp.now()).floor('min')
+    items = []
+    if max_pages is None or page <= max_pages:
+        for i in range(rows):
+            k, update_time = _post_at((page - 1) * rows + i, minutes_per_post, now, head_posts)
+            pid = post_id(stock_code, k)
+            items.append(
+                '<tr class="listitem">'
+                f'<td><div class="read">{random.randint(10, 99999)}</div></td>'
+                f'<td><div class="reply">{random.randint(0, 999)}</div></td>'
+                f'<td><div class="title"><a href="/news,{stock_code},{pid}.html" '
+                f'title="帖子{k}">{html.escape(f"合成帖子{k} 利好 上涨")}</a></div></td>'
+                f'<td><div class="author"><a href="//i.eastmoney.com/{pid % 997}">用户{pid % 997}</a></div></td>'
+                f'<td><div class="update">{update_time:%m-%d %H:%M}</div></td>'
+                '</tr>'
+            )
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>股吧</title></head><body>'
+        '<div class="listbox"><ul><li class="defaultlist"><table class="default_list">'
+        '<thead><tr><th>阅读</th><th>评论</th><th>标题</th><th>作者</th><th>最后更新</th></tr></thead>'
+        f'<tbody class="listbody">{"".join(items)}</tbody></table></li></ul></div>'
+        f'<a class="page-next" href="/{page_filename(stock_code, page + 1)}">下一页</a>'
+        '</body></html>'
+    )
+
+
+class GubaFixtureServer:
+    def __init__(self, pages_dir=None, host='127.0.0.1', port=0, delay=0.0, synthetic=False,
+                 max_pages=None, fail_rate=0.0, fail_from=None, now=None, head_posts=()):
+        self.pages_dir = pages_dir
+        self.host = host
+        self.port = port
+        self.delay = delay          # 每个请求的处理时间（秒）
+        self.synthetic = synthetic  # 没有录制页面时是否生成合成页面
+        self.max_pages = max_pages  # 合成页面的总页数，超过后返回空列表
+        self.fail_rate = fail_rate  # 返回503的概率
+        self.fail_from = fail_from  # 从这一页开始固定返回503，用于测试续爬
+        self.now = now              # 合成页面的当前时间，默认为请求时的时间
+        self.head_posts = list(head_posts)  # 合成页面排在最前面的帖子，见build_page
+        self.request_count = 0
+        self.served = []            # 成功返回的(股票代码, 页码)
+        self.runner = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/{name}', self.handle_page)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        # port=0时由系统分配端口
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle_page(self, request):
+        self.request_count += 1
+        match = _PAGE_PATTERN.match(request.match_info['name'])
+        if not match:
+            return web.Response(status=404)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        stock_code, page = match.group(1), int(match.group(2) or 1)
+        if random.random() < self.fail_rate or (self.fail_from is not None and page >= self.fail_from):
+            return web.Response(status=503, text='busy')
+
+        if self.pages_dir:
+            path = os.path.join(self.pages_dir, page_filename(stock_code, page))
+            if os.path.exists(path):
+                self.served.append((stock_code, page))
+                with open(path, 'r', encoding='utf-8') as f:
+                    return web.Response(text=f.read(), content_type='text/html')
+        if self.synthetic:
+            self.served.append((stock_code, page))
+            page_html = build_page(stock_code, page, max_pages=self.max_pages, now=self.now,
+                                   head_posts=self.head_posts)
+            return web.Response(text=page_html, content_type='text/html')
+        return web.Response(status=404)
+
+
+async def record(stock_code, pages, pages_dir, base_url='https://guba.eastmoney.com'):
+    """从股吧下载前pages页保存到pages_dir，作为测试用的录制页面"""
+    os.makedirs(pages_dir, exist_ok=True)
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+    async with aiohttp.ClientSession(headers=headers) as session:
+        for page in range(1, pages + 1):
+            name = page_filename(stock_code, page)
+            async with session.get(f'{base_url}/{name}') as response:
+                response.raise_for_status()
+                text = await response.text()
+            with open(os.path.join(pages_dir, name), 'w', encoding='utf-8') as f:
+                f.write(text)
+            print(f"已保存 {name}")
+            await asyncio.sleep(1)
+
+
+async def serve(args):
+    server = GubaFixtureServer(args.pages_dir, args.host, args.port, args.delay, args.synthetic, args.max_pages)
+    async with server:
+        print(f"本地股吧页面服务已启动: {server.base_url}")
+        await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地股吧列表页服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--pages-dir', help='录制页面所在目录')
+    parser.add_argument('--synthetic', action='store_true', help='没有录制页面时生成合成页面')
+    parser.add_argument('--max-pages', type=int, help='合成页面的总页数')
+    parser.add_argument('--delay', type=float, default=0.0, help='每个请求的处理时间（秒）')
+    parser.add_argument('--record', metavar='CODE', help='录制指定股票的真实页面到--pages-dir')
+    parser.add_argument('--pages', type=int, default=5, help='录制的页数')
+    args = parser.parse_args()
+
+    if args.record:
+        asyncio.run(record(args.record, args.pages, args.pages_dir or 'fixtures'))
+    else:
+        asyncio.run(serve(args))
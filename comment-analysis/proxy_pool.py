@@ -1,76 +1,242 @@
+"""
+代理池
+
+后台线程按令牌桶的速率（小象代理的API每10秒只能调用一次）从供应商获取代理，把池子补充到目标数量；
+并发的爬虫线程或协程通过lease借出代理、release归还，归还时报告请求是否成功和耗时。
+每个代理用EWMA记录成功率和延迟，借出时优先选择得分最高的代理，连续失败或成功率过低的代理被剔除，
+剔除后后台线程会自动补充。
+
+用法：
+    pool = ProxyPool(XiangProxyVendor(app_key, app_secret), target_size=8)
+    proxy = pool.lease(timeout=30)
+    start = time.monotonic()
+    ok = requests.get(url, proxies=proxy.proxies, timeout=10).status_code == 200
+    pool.release(proxy, ok, time.monotonic() - start)
+
+本地测试使用fake_proxy_vendor.py提供的假供应商API：
+    XiangProxyVendor('test', 'test', api_url=vendor.api_url)
+"""
 import requests
+import threading
 import time
-import json
-from datetime import datetime
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class XiangProxyPool:
-    def __init__(self, app_key, app_secret):
+API_URL = "https://api.xiaoxiangdaili.com/ip/get"
+# 供应商API两次调用之间的最小间隔（秒）
+API_INTERVAL = 10.0
+
+
+class XiangProxyVendor:
+    """小象代理API，一次调用获取cnt个代理地址"""
+
+    def __init__(self, app_key, app_secret, api_url=API_URL, timeout=5):
         self.app_key = app_key
         self.app_secret = app_secret
-        self.api_url = "https://api.xiaoxiangdaili.com/ip/get"
-        self.current_proxy = None
-        self.last_fetch_time = None
-        
-    def _fetch_proxy(self):
-        """从API获取新的代理IP"""
-        try:
-            params = {
-                'appKey': self.app_key,
-                'appSecret': self.app_secret,
-                'cnt': 1,
-                'wt': 'json'
-            }
-            
-            response = requests.get(self.api_url, params=params)
-            data = response.json()
-            
-            if data['code'] != 200:
-                logger.error(f"获取代理失败: {data['msg']}")
-                return None
-                
-            proxy_info = data['data'][0]
-            proxy = f"{proxy_info['ip']}:{proxy_info['port']}"
-            logger.info(f"成功获取新代理: {proxy}")
-            return proxy
-            
-        except Exception as e:
-            logger.error(f"获取代理时发生错误: {e}")
-            return None
-            
-    def get_proxy(self):
-        """获取代理，遵守调用频率限制"""
-        current_time = datetime.now()
-        
-        # 如果是首次获取或者距离上次获取超过10秒
-        if (self.last_fetch_time is None or 
-            (current_time - self.last_fetch_time).total_seconds() >= 10):
-            
-            new_proxy = self._fetch_proxy()
-            if new_proxy:
-                self.current_proxy = new_proxy
-                self.last_fetch_time = current_time
-                
+        self.api_url = api_url
+        self.timeout = timeout
+
+    def fetch(self, cnt=1):
+        """返回"ip:port"列表，失败时抛出异常"""
+        params = {
+            'appKey': self.app_key,
+            'appSecret': self.app_secret,
+            'cnt': cnt,
+            'wt': 'json'
+        }
+        response = requests.get(self.api_url, params=params, timeout=self.timeout)
+        data = response.json()
+        if data['code'] != 200:
+            raise RuntimeError(f"获取代理失败: {data.get('msg')}")
+        return [f"{item['ip']}:{item['port']}" for item in data['data']]
+
+    def proxy_url(self, address):
+        return f'http://{self.app_key}:{self.app_secret}@{address}'
+
+
+class TokenBucket:
+    """令牌桶：每秒补充rate个令牌，最多积攒capacity个"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """取一个令牌，成功返回0，否则返回还需等待的秒数"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+
+class Proxy:
+    """池中的一个代理及其健康统计"""
+
+    def __init__(self, address, url):
+        self.address = address
+        self.url = url
+        self.success = 1.0    # 成功率EWMA，新代理按成功计，借出时会被优先尝试
+        self.latency = None   # 成功请求的延迟EWMA（秒）
+        self.failures = 0     # 连续失败次数
+        self.requests = 0
+        self.leases = 0       # 当前借出次数
+        self.created = time.monotonic()
+
+    @property
+    def proxies(self):
+        """requests使用的代理参数"""
+        return {'http': self.url, 'https': self.url}
+
+    def score(self):
+        return self.success / (1.0 + (self.latency or 0.0))
+
+    def summary(self):
         return {
-            'http': f'http://{self.app_key}:{self.app_secret}@{self.current_proxy}',
-            'https': f'http://{self.app_key}:{self.app_secret}@{self.current_proxy}'
-        } if self.current_proxy else None
-        
-    def mark_failed(self):
-        """标记当前代理失败"""
-        current_time = datetime.now()
-        
-        # 如果距离上次获取超过10秒，则获取新代理
-        if (self.last_fetch_time is None or 
-            (current_time - self.last_fetch_time).total_seconds() >= 10):
-            
-            new_proxy = self._fetch_proxy()
-            if new_proxy:
-                self.current_proxy = new_proxy
-                self.last_fetch_time = current_time
-                return self.get_proxy()
-        
-        return None 
\ No newline at end of file
+            'address': self.address,
+            'success': round(self.success, 3),
+            'latency': round(self.latency, 3) if self.latency is not None else None,
+            'requests': self.requests,
+            'leases': self.leases,
+        }
+
+
+class ProxyPool:
+    def __init__(self, vendor, target_size=8, max_leases=4, alpha=0.2, min_success=0.5, min_requests=5,
+                 max_failures=3, max_age=None, api_interval=API_INTERVAL):
+        self.vendor = vendor
+        self.target_size = target_size
+        self.max_leases = max_leases      # 一个代理同时借给多少个请求
+        self.alpha = alpha                # EWMA平滑系数
+        self.min_success = min_success    # 请求数达到min_requests后成功率低于此值即剔除
+        self.min_requests = min_requests
+        self.max_failures = max_failures  # 连续失败次数达到此值即剔除
+        self.max_age = max_age            # 代理的有效期（秒），None为不过期
+        self.bucket = TokenBucket(1.0 / api_interval)
+        self.proxies = {}
+        self.cond = threading.Condition()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.counters = {'fetched': 0, 'evicted': 0, 'expired': 0, 'api_calls': 0, 'api_errors': 0}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self):
+        """启动后台补充线程，lease时也会自动启动"""
+        with self.cond:
+            if self.thread is None:
+                self.stopped.clear()
+                self.thread = threading.Thread(target=self._prefetch_loop, name='proxy-prefetch', daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        with self.cond:
+            self.cond.notify_all()
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            thread.join()
+
+    # ---------- 后台补充 ----------
+
+    def _prefetch_loop(self):
+        while not self.stopped.is_set():
+            with self.cond:
+                self._expire()
+                if len(self.proxies) >= self.target_size:
+                    # 池子已满，等待剔除或过期后再补充
+                    self.cond.wait(timeout=1.0)
+                    continue
+                need = self.target_size - len(self.proxies)
+
+            wait = self.bucket.try_acquire()
+            if wait:
+                self.stopped.wait(wait)
+                continue
+            try:
+                self.counters['api_calls'] += 1
+                addresses = self.vendor.fetch(need)
+            except Exception as e:
+                self.counters['api_errors'] += 1
+                logger.error(f"获取代理时发生错误: {e}")
+                continue
+            with self.cond:
+                for address in addresses:
+                    if address not in self.proxies:
+                        self.proxies[address] = Proxy(address, self.vendor.proxy_url(address))
+                        self.counters['fetched'] += 1
+                self.cond.notify_all()
+            logger.info(f"获取{len(addresses)}个新代理，池中共{len(self.proxies)}个")
+
+    def _expire(self):
+        if self.max_age is None:
+            return
+        now = time.monotonic()
+        for proxy in list(self.proxies.values()):
+            if now - proxy.created > self.max_age:
+                del self.proxies[proxy.address]
+                self.counters['expired'] += 1
+
+    # ---------- 借出与归还 ----------
+
+    def lease(self, timeout=None):
+        """借出得分最高且未达到借出上限的代理，timeout秒内没有可用代理时返回None"""
+        self.start()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while True:
+                self._expire()
+                candidates = [p for p in self.proxies.values() if p.leases < self.max_leases]
+                if candidates:
+                    proxy = max(candidates, key=Proxy.score)
+                    proxy.leases += 1
+                    return proxy
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+
+    def release(self, proxy, ok, latency=None):
+        """归还代理并更新健康统计，不健康的代理从池中剔除"""
+        with self.cond:
+            proxy.leases -= 1
+            proxy.requests += 1
+            proxy.success += self.alpha * ((1.0 if ok else 0.0) - proxy.success)
+            if ok:
+                proxy.failures = 0
+                if latency is not None:
+                    proxy.latency = latency if proxy.latency is None else \
+                        proxy.latency + self.alpha * (latency - proxy.latency)
+            else:
+                proxy.failures += 1
+                if self._unhealthy(proxy):
+                    self._evict(proxy)
+            self.cond.notify_all()
+
+    def _unhealthy(self, proxy):
+        return (proxy.failures >= self.max_failures
+                or (proxy.requests >= self.min_requests and proxy.success < self.min_success))
+
+    def _evict(self, proxy):
+        # 同一个代理可能被多个请求同时判定失败，只剔除一次
+        if self.proxies.pop(proxy.address, None) is not None:
+            self.counters['evicted'] += 1
+            logger.info(f"剔除代理 {proxy.address}: {proxy.summary()}")
+
+    def stats(self):
+        with self.cond:
+            return dict(self.counters, size=len(self.proxies),
+                        proxies=[p.summary() for p in sorted(self.proxies.values(), key=Proxy.score, reverse=True)])
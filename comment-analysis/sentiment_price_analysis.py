@@ -1,12 +1,19 @@
 import pandas as pd
 import numpy as np
-from sqlalchemy import create_engine, Table, MetaData, Column, String, Float, Date, DateTime, Integer, text
+from sqlalchemy import Table, MetaData, Column, String, Float, Date, DateTime, Integer, text
 from datetime import datetime
 import os
 import matplotlib.pyplot as plt
 from scipy import stats
 from scipy.stats import pearsonr
 import logging
+import sys
+from comment_store import CommentStore
+
+# 将仓库根目录加入模块搜索路径，以便导入公共模块common
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.db import get_engine, get_stock_codes  # noqa: E402
+from common.kline_store import KlineStore  # noqa: E402
 
 # 设置日志
 def setup_logger():
@@ -30,15 +37,7 @@ def setup_logger():
 
 def create_analysis_table():
     """创建情感-股价关系分析表"""
-    db_config = {
-        'user': 'root',
-        'password': '123456',
-        'host': '127.0.0.1',
-        'database': 'stocks'
-    }
-    
-    engine = create_engine(
-        f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}")
+    engine = get_engine()
     
     metadata = MetaData()
     
@@ -61,44 +60,24 @@ def create_analysis_table():
     except Exception as e:
         logger.error(f"创建数据表时出错: {e}", exc_info=True)
         return False
-    finally:
-        engine.dispose()
-
-def get_stock_codes():
-    """从数据库获取股票代码列表"""
-    db_config = {
-        'user': 'root',
-        'password': '123456',
-        'host': '127.0.0.1',
-        'database': 'stocks'
-    }
-    
-    engine = create_engine(
-        f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}")
-    
-    try:
-        with engine.connect() as connection:
-            result = connection.execute(text("SELECT stock_code FROM stock_info"))
-            return [row[0] for row in result]
-    except Exception as e:
-        logger.error(f"获取股票代码失败: {e}", exc_info=True)
-        return []
-    finally:
-        engine.dispose()
 
-def get_kline_data(stock_code, engine):
-    """从数据库获取K线数据"""
+def get_kline_data(stock_code):
+    """获取K线数据，优先读取K线列式存储，没有数据时从数据库读取"""
     try:
-        query = text("""
-            SELECT 
-                date_time as date,
-                close_price
-            FROM stock_kline 
-            WHERE stock_code = :code
-            ORDER BY date_time
-        """)
-        
-        df = pd.read_sql(query, engine, params={'code': stock_code})
+        df = KlineStore().read_df(stock_code, columns=['date_time', 'close_price'])
+        if df is not None:
+            df = df.rename(columns={'date_time': 'date'})
+        else:
+            query = text("""
+                SELECT 
+                    date_time as date,
+                    close_price
+                FROM stock_kline 
+                WHERE stock_code = :code
+                ORDER BY date_time
+            """)
+            
+            df = pd.read_sql(query, get_engine(), params={'code': stock_code})
         df['date'] = pd.to_datetime(df['date']).dt.date
         
         # 计算价格变化百分比
@@ -112,57 +91,31 @@ def get_kline_data(stock_code, engine):
 
 def analyze_sentiment_price_relation(stock_code, logger):
     """分析特定股票的情感与股价关系"""
-    # 读取情感数据
-    sentiment_file = os.path.join(os.path.dirname(__file__), 'data', f'emotionRating_{stock_code}.csv')
-    if not os.path.exists(sentiment_file):
-        logger.error(f"找不到股票{stock_code}的情感数据文件: {sentiment_file}")
+    # 从评论存储读取按日汇总的情感数据
+    store = CommentStore()
+    try:
+        daily_sentiment = store.daily_sentiment(stock_code)
+    finally:
+        store.close()
+    if daily_sentiment.empty:
+        logger.error(f"找不到股票{stock_code}的情感数据")
         return
     
-    # 创建数据库连接
-    db_config = {
-        'user': 'root',
-        'password': '123456',
-        'host': '127.0.0.1',
-        'database': 'stocks'
-    }
-    
-    engine = create_engine(
-        f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}")
-    
     try:
         # 读取数据
-        sentiment_df = pd.read_csv(sentiment_file)
-        kline_df = get_kline_data(stock_code, engine)
+        kline_df = get_kline_data(stock_code)
         
         if kline_df is None or kline_df.empty:
             logger.error(f"无法获取股票{stock_code}的K线数据")
             return
         
         logger.info(f"股票{stock_code}数据读取成功:")
-        logger.info(f"- 情感数据: {len(sentiment_df)}条")
+        logger.info(f"- 情感数据: {int(daily_sentiment['count'].sum())}条")
         logger.info(f"- K线数据: {len(kline_df)}条")
         
-        # 处理日期格式
-        def get_date_with_year(date_str):
-            try:
-                date_parts = date_str.split(' ')[0]
-                month, day = map(int, date_parts.split('-'))
-                current_year = datetime.now().year
-                current_month = datetime.now().month
-                current_day = datetime.now().day
-                year = current_year - 1 if (month >= current_month and day > current_day) else current_year
-                return pd.to_datetime(f'{year}-{date_str}', format='%Y-%m-%d %H:%M').date()
-            except Exception as e:
-                logger.error(f"日期转换错误: {date_str}, 错误: {e}")
-                return None
-        
-        sentiment_df['date'] = sentiment_df['update_time'].apply(get_date_with_year)
-        
-        # 计算每日平均情感值
-        daily_sentiment = sentiment_df.groupby('date').agg({
-            'sentiment': ['mean', 'count']
-        }).reset_index()
+        # 每日平均情感值
         daily_sentiment.columns = ['date', 'sentiment_avg', 'sentiment_count']
+        daily_sentiment['date'] = pd.to_datetime(daily_sentiment['date']).dt.date
         
         # 对情感值进行排序，确保按日期顺序计算变化
         daily_sentiment = daily_sentiment.sort_values('date')
@@ -207,8 +160,6 @@ def analyze_sentiment_price_relation(stock_code, logger):
         
     except Exception as e:
         logger.error(f"分析过程出错: {e}", exc_info=True)
-    finally:
-        engine.dispose()
 
 def generate_correlation_summary(correlation, p_value):
     """生成相关性分析总结"""
@@ -229,15 +180,7 @@ def generate_correlation_summary(correlation, p_value):
 
 def save_analysis_results(stock_code, analysis_df, correlation, is_significant, correlation_summary, logger):
     """保存分析结果到数据库"""
-    db_config = {
-        'user': 'root',
-        'password': '123456',
-        'host': '127.0.0.1',
-        'database': 'stocks'
-    }
-    
-    engine = create_engine(
-        f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}")
+    engine = get_engine()
     
     try:
         # 删除旧数据
@@ -278,8 +221,6 @@ def save_analysis_results(stock_code, analysis_df, correlation, is_significant,
                 
     except Exception as e:
         logger.error(f"保存分析结果时出错: {e}", exc_info=True)
-    finally:
-        engine.dispose()
 
 def plot_correlation(df, stock_code, correlation, logger):
     """绘制情感-股价关系图"""
@@ -1,115 +1,70 @@
 import pandas as pd
-from sqlalchemy import create_engine, Table, MetaData, insert, delete, text
+from sqlalchemy import insert, delete
 from datetime import datetime
 import os
+import sys
+from comment_store import CommentStore
 
-def generate_sentiment_trend(stock_code):
-    """生成指定股票的情感趋势数据"""
-    # 确保data目录存在
-    data_dir = os.path.join(os.path.dirname(__file__), 'data')
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
-    
-    # 读取情感分析结果
-    file_path = os.path.join(data_dir, f'emotionRating_{stock_code}.csv')
-    if not os.path.exists(file_path):
-        print(f"找不到股票{stock_code}的情感分析文件")
-        return
-        
-    df = pd.read_csv(file_path)
-    
-    # 转换评论时间格式，根据1月11日判断年份
-    def get_date_with_year(date_str):
-        try:
-            # 处理格式如 "12-26 02:31"
-            date_parts = date_str.split(' ')[0]  # 先分割日期和时间
-            month, day = map(int, date_parts.split('-'))  # 分别获取月和日
-            
-            # 根据1月11日判断年份
-            if month == 1 and day <= 11:
-                year = 2025
-            else:
-                year = 2024
-            
-            return pd.to_datetime(f'{year}-{date_str}', format='%Y-%m-%d %H:%M')
-        except Exception as e:
-            print(f"日期转换错误: {date_str}, 错误: {e}")
-            return None
-    
-    df['comment_date'] = df['update_time'].apply(get_date_with_year)
-    
-    # 过滤掉无效日期
-    df = df.dropna(subset=['comment_date'])
-    
-    # 按日期分组计算平均情感值
-    daily_sentiment = df.groupby(df['comment_date'].dt.date)['sentiment'].agg(['mean', 'count']).reset_index()
-    
-    # 保存到数据库
-    save_to_database(daily_sentiment, stock_code)
+# 将仓库根目录加入模块搜索路径，以便导入公共模块common
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.db import get_engine, get_table, get_stock_codes  # noqa: E402
 
-def save_to_database(sentiment_data, stock_code):
-    """保存情感趋势数据到数据库"""
-    db_config = {
-        'user': 'root',
-        'password': '123456',
-        'host': '127.0.0.1',
-        'database': 'stocks'
-    }
-    
-    engine = create_engine(
-        f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}")
-    
-    metadata = MetaData()
-    metadata.reflect(bind=engine)
+def generate_sentiment_trend(stock_code, dates=None, store=None):
+    """
+    生成指定股票的情感趋势数据
     
+    dates为'YYYY-MM-DD'字符串列表时只重新计算并替换这些日期的数据（增量打分后使用）
+    """
+    own_store = store is None
+    store = store or CommentStore()
     try:
-        sentiment_trend_table = Table('sentiment_trend', metadata, autoload_with=engine)
+        if store.count(stock_code) == 0:
+            print(f"找不到股票{stock_code}的评论")
+            return
+        if dates is not None and not dates:
+            return
         
-        # 删除该股票的旧数据
-        with engine.begin() as connection:
-            connection.execute(
-                delete(sentiment_trend_table).where(sentiment_trend_table.c.stock_code == stock_code)
-            )
+        # 在评论存储中按日期分组计算平均情感值，只统计清洗后保留的评论
+        daily_sentiment = store.daily_sentiment(stock_code, dates)
+        daily_sentiment['comment_date'] = pd.to_datetime(daily_sentiment['comment_date']).dt.date
+        if dates is not None:
+            dates = pd.to_datetime(pd.Series(dates)).dt.date.tolist()
         
-        # 插入新数据
-        current_time = datetime.now()
-        with engine.begin() as connection:
-            for _, row in sentiment_data.iterrows():
-                stmt = insert(sentiment_trend_table).values(
-                    stock_code=stock_code,
-                    date=row['comment_date'],
-                    sentiment_avg=float(row['mean']),
-                    comment_count=int(row['count']),
-                    update_time=current_time
-                )
-                connection.execute(stmt)
-                
-    except Exception as e:
-        print(f"数据库操作错误: {e}")
+        # 保存到数据库
+        save_to_database(daily_sentiment, stock_code, dates)
     finally:
-        engine.dispose()
+        if own_store:
+            store.close()
 
-def get_stock_codes():
-    """从数据库获取股票代码列表"""
-    db_config = {
-        'user': 'root',
-        'password': '123456',
-        'host': '127.0.0.1',
-        'database': 'stocks'
-    }
-    
-    engine = create_engine(
-        f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}")
-    
+def save_to_database(sentiment_data, stock_code, dates=None):
+    """保存情感趋势数据到数据库，传入dates时只替换这些日期的数据"""
     try:
-        with engine.connect() as connection:
-            result = connection.execute(text("SELECT stock_code FROM stock_info"))
-            return [row[0] for row in result]
+        sentiment_trend_table = get_table('sentiment_trend')
+        current_time = datetime.now()
+        
+        # 在同一个事务中删除该股票的旧数据并批量插入新数据
+        with get_engine().begin() as connection:
+            condition = sentiment_trend_table.c.stock_code == stock_code
+            if dates is not None:
+                # 没有剩余评论的日期也一并删除
+                condition = condition & sentiment_trend_table.c.date.in_(dates)
+            connection.execute(delete(sentiment_trend_table).where(condition))
+            records = [
+                {
+                    'stock_code': stock_code,
+                    'date': comment_date,
+                    'sentiment_avg': float(mean),
+                    'comment_count': int(count),
+                    'update_time': current_time
+                }
+                for comment_date, mean, count in zip(
+                    sentiment_data['comment_date'], sentiment_data['mean'], sentiment_data['count'])
+            ]
+            if records:
+                connection.execute(insert(sentiment_trend_table), records)
+                
     except Exception as e:
-        print(f"获取股票代码失败: {e}")
-        return []
-    finally:
-        engine.dispose()
+        print(f"数据库操作错误: {e}")
 
 if __name__ == '__main__':
     stock_codes = get_stock_codes()
@@ -117,5 +72,9 @@ if __name__ == '__main__':
         print("没有获取到股票代码")
         exit(1)
         
-    for stock_code in stock_codes:
-        generate_sentiment_trend(stock_code) 
\ No newline at end of file
+    store = CommentStore()
+    try:
+        for stock_code in stock_codes:
+            generate_sentiment_trend(stock_code, store=store)
+    finally:
+        store.close() 
\ No newline at end of file
@@ -1,9 +1,25 @@
-from snownlp import SnowNLP, sentiment
+from snownlp import sentiment
 import jieba
+import numpy as np
+import os
 import re
 
+# 自定义训练的模型，snownlp在Python 3下实际读取的是stock_sentiment.marshal.3
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stock_sentiment.marshal')
+# 清理后文本的分数缓存上限，股吧标题重复很多
+CACHE_SIZE = 200000
+
+_CLEAN_PATTERN = re.compile(r'[^\u4e00-\u9fa5a-zA-Z0-9]')
+_NUMBER_PATTERN = re.compile(r'\d')
+
 class StockSentiment:
-    def __init__(self):
+    """
+    股票评论情感分析
+
+    一个实例只加载一次模型和jieba词典，应在进程内复用；每条文本只分词一次，
+    相同的清理后文本只计算一次。批量打分使用score_many
+    """
+    def __init__(self, model_path=MODEL_PATH, cache_size=CACHE_SIZE):
         # 加载股票特定的情感词典
         self.stock_sentiment_dict = {
             # 积极词
@@ -35,11 +51,16 @@ class StockSentiment:
             '弱势': -1.2
         }
         
-        # 加载自定义训练的模型
-        sentiment.load('stock_sentiment.marshal')
+        # 加载自定义训练的模型，使用独立的分类器，不修改snownlp的全局模型
+        self.classifier = sentiment.Sentiment()
+        self.classifier.load(model_path)
+        jieba.initialize()
         
         # 添加最小评论长度限制
         self.min_length = 2
+        
+        self.cache_size = cache_size
+        self.cache = {}
     
     def clean_text(self, text):
         """清理文本"""
@@ -47,8 +68,7 @@ class StockSentiment:
             return ""
             
         # 移除特殊字符但保留中文
-        text = re.sub(r'[^\u4e00-\u9fa5a-zA-Z0-9]', '', text)
-        return text
+        return _CLEAN_PATTERN.sub('', text)
     
     def is_valid_comment(self, text):
         """检查评论是否有效"""
@@ -61,57 +81,55 @@ class StockSentiment:
             return False
         return True
     
-    def extract_features(self, text):
-        """提取特征"""
-        features = {
-            'has_number': bool(re.search(r'\d+', text)),  # 是否包含数字
-            'length': len(text),  # 评论长度
-            'sentiment_words': sum(1 for word in jieba.cut(text) if word in self.stock_sentiment_dict)  # 情感词数量
-        }
-        return features
+    def score_cleaned(self, cleaned_text):
+        """计算清理后文本的情感分数"""
+        # 检查评论是否有效
+        if not self.is_valid_comment(cleaned_text):
+            return 0.5  # 对于无效评论返回中性分数
+        
+        # 只分词一次，同时用于短评论判断和词典调整
+        words = jieba.lcut(cleaned_text)
+        weights = [self.stock_sentiment_dict[word] for word in words if word in self.stock_sentiment_dict]
+        
+        # 如果评论太短且没有情感词，返回中性分数
+        if len(words) < 2 and not weights:
+            return 0.5
+        
+        # 基础情感分数
+        try:
+            base_score = self.classifier.classify(cleaned_text)
+        except Exception:
+            # 如果 SnowNLP 分析失败，使用词典进行简单分析
+            base_score = 0.5
+        
+        # 结合基础分数和调整值
+        final_score = max(0, min(1, base_score + sum(weights) * 0.1))
+        
+        # 根据特征微调
+        if base_score > 0.5 and _NUMBER_PATTERN.search(cleaned_text):
+            final_score *= 1.1  # 包含数字的正面评论可能更可信
+        return min(1.0, final_score)  # 确保不超过1.0
     
     def analyze(self, text):
-        """分析评论情感"""
-        try:
-            # 清理文本
+        """分析一条评论的情感"""
+        return float(self.score_many([text])[0])
+    
+    def score_many(self, texts):
+        """批量分析评论情感，返回与texts等长的float64数组"""
+        scores = np.empty(len(texts), dtype=np.float64)
+        cache = self.cache
+        for i, text in enumerate(texts):
             cleaned_text = self.clean_text(text)
-            
-            # 检查评论是否有效
-            if not self.is_valid_comment(cleaned_text):
-                return 0.5  # 对于无效评论返回中性分数
-            
-            # 基础情感分数
-            try:
-                base_score = SnowNLP(cleaned_text).sentiments
-            except:
-                # 如果 SnowNLP 分析失败，使用词典进行简单分析
-                base_score = 0.5
-            
-            # 提取特征
-            features = self.extract_features(cleaned_text)
-            
-            # 根据特定词典调整分数
-            adjustment = 0
-            words = list(jieba.cut(cleaned_text))
-            
-            # 如果评论太短且没有情感词，返回中性分数
-            if len(words) < 2 and not any(word in self.stock_sentiment_dict for word in words):
-                return 0.5
-                
-            for word in words:
-                if word in self.stock_sentiment_dict:
-                    adjustment += self.stock_sentiment_dict[word]
-            
-            # 结合基础分数和调整值
-            final_score = max(0, min(1, base_score + adjustment * 0.1))
-            
-            # 根据特征微调
-            if features['has_number'] and base_score > 0.5:
-                final_score *= 1.1  # 包含数字的正面评论可能更可信
-            final_score = min(1.0, final_score)  # 确保不超过1.0
-            
-            return final_score
-            
-        except Exception as e:
-            print(f"分析评论出错: {text}, 错误: {e}")
-            return 0.5  # 发生错误时返回中性分数 
\ No newline at end of file
+            score = cache.get(cleaned_text)
+            if score is None:
+                try:
+                    score = self.score_cleaned(cleaned_text)
+                except Exception as e:
+                    print(f"分析评论出错: {text}, 错误: {e}")
+                    score = 0.5  # 发生错误时返回中性分数
+                if len(cache) >= self.cache_size:
+                    # 淘汰最早加入的一条
+                    del cache[next(iter(cache))]
+                cache[cleaned_text] = score
+            scores[i] = score
+        return scores
@@ -0,0 +1,196 @@
+"""
+异步爬虫的测试，使用guba_fixture_server.py中的本地合成页面，不访问东方财富
+
+用法：
+    python -m unittest test_async_crawler.py
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import pandas as pd
+
+from async_crawler import GubaCrawler
+from comment_store import CommentStore
+from crawl_state import CrawlState
+from guba_common import spider_out_comment
+from guba_fixture_server import HEAD_MINUTES, ROWS_PER_PAGE, GubaFixtureServer, build_page, post_id
+
+STOCK_CODE = '601360'
+# 两次运行之间合成页面的时间不变；留出一天，刷新时排在前面的帖子也不晚于现在
+NOW = pd.Timestamp.now().floor('min') - pd.Timedelta(days=1)
+
+
+class SpiderOutCommentTest(unittest.TestCase):
+    def test_parses_synthetic_page(self):
+        content = build_page(STOCK_CODE, 2)
+        rows = spider_out_comment(content, STOCK_CODE)
+        self.assertEqual(len(rows), ROWS_PER_PAGE)
+        self.assertEqual(len({row['post_id'] for row in rows}), ROWS_PER_PAGE)
+        self.assertEqual(rows[0]['title'], f'合成帖子{ROWS_PER_PAGE} 利好 上涨')
+        self.assertRegex(rows[0]['update_time'], r'^\d{2}-\d{2} \d{2}:\d{2}$')
+
+    def test_skips_other_stocks(self):
+        self.assertEqual(spider_out_comment(build_page(STOCK_CODE, 1), '000001'), [])
+
+    def test_empty_page(self):
+        self.assertEqual(spider_out_comment(build_page(STOCK_CODE, 3, max_pages=2), STOCK_CODE), [])
+
+
+class GubaCrawlerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.state = CrawlState(os.path.join(self.tmp, 'crawl_state.sqlite'))
+        self.comments = CommentStore(os.path.join(self.tmp, 'comments.sqlite'))
+
+    def tearDown(self):
+        self.state.close()
+        self.comments.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def crawler(self, server, **kwargs):
+        kwargs.setdefault('rate', 0)
+        kwargs.setdefault('backoff', 0.01)
+        return GubaCrawler(server.base_url, state=self.state, comments=self.comments, **kwargs)
+
+    async def crawl(self, server, **kwargs):
+        async with self.crawler(server, **kwargs) as crawler:
+            [result] = await crawler.crawl_many([STOCK_CODE])
+        return result
+
+    def assert_complete(self):
+        state = self.state.get(STOCK_CODE)
+        self.assertTrue(state['complete'])
+        # 每一页的帖子都只写入一次
+        self.assertEqual(self.comments.count(STOCK_CODE), state['last_page'] * ROWS_PER_PAGE)
+
+    async def test_full_crawl_stops_after_one_year(self):
+        async with GubaFixtureServer(synthetic=True) as server:
+            result = await self.crawl(server)
+        self.assertEqual(result['status'], 'complete')
+        self.assertEqual(result['mode'], 'full')
+        self.assert_complete()
+        self.assertEqual(result['comments'], self.comments.count(STOCK_CODE))
+
+    async def test_stops_after_empty_pages(self):
+        async with GubaFixtureServer(synthetic=True, max_pages=2) as server:
+            result = await self.crawl(server, lookahead=1)
+        self.assertEqual(result['status'], 'exhausted')
+        self.assertTrue(self.state.get(STOCK_CODE)['complete'])
+        self.assertEqual(self.comments.count(STOCK_CODE), 2 * ROWS_PER_PAGE)
+
+    async def test_resumes_from_failed_page(self):
+        async with GubaFixtureServer(synthetic=True, fail_from=4) as server:
+            result = await self.crawl(server, lookahead=1, max_retries=1)
+        self.assertEqual(result['status'], 'failed')
+        state = self.state.get(STOCK_CODE)
+        self.assertFalse(state['complete'])
+        self.assertEqual(state['last_page'], 3)
+        self.assertEqual(self.comments.count(STOCK_CODE), 3 * ROWS_PER_PAGE)
+
+        async with GubaFixtureServer(synthetic=True) as server:
+            result = await self.crawl(server)
+        self.assertEqual(result['status'], 'complete')
+        self.assertEqual(result['mode'], 'resume')
+        # 已经写入的页不再请求
+        self.assertEqual(min(page for _, page in server.served), 4)
+        self.assert_complete()
+
+    async def test_refresh_after_complete(self):
+        async with GubaFixtureServer(synthetic=True, now=NOW) as server:
+            await self.crawl(server)
+        count = self.comments.count(STOCK_CODE)
+
+        async with GubaFixtureServer(synthetic=True, now=NOW) as server:
+            result = await self.crawl(server)
+        self.assertEqual(result['status'], 'refreshed')
+        self.assertEqual(result['comments'], 0)
+        # 第1页已经翻到最新评论的时间就停止翻页
+        self.assertEqual(server.served, [(STOCK_CODE, 1)])
+        self.assertEqual(self.comments.count(STOCK_CODE), count)
+
+    async def refresh(self, head_posts):
+        """
+        全量爬取并处理完全部评论后，在排在最前面的帖子为head_posts的列表上刷新，返回(结果, 请求过的页, 新增评论数)
+        """
+        async with GubaFixtureServer(synthetic=True, now=NOW) as server:
+            await self.crawl(server)
+        count = self.comments.count(STOCK_CODE)
+        # 模拟清洗和打分阶段已经处理过全部评论
+        with self.comments.conn:
+            self.comments.conn.execute("UPDATE comments SET comment_time = '2025-01-02 10:00:00', kept = 1, "
+                                       "sentiment = 0.5, scored_at = 1")
+        async with GubaFixtureServer(synthetic=True, now=NOW, head_posts=head_posts) as server:
+            result = await self.crawl(server)
+        self.assertEqual(result['status'], 'refreshed')
+        return result, [page for _, page in server.served], self.comments.count(STOCK_CODE) - count
+
+    async def test_refresh_new_posts_across_pages(self):
+        # 100个新帖子跨越第1、2页，中间夹着3个收到新回复的旧帖子
+        head_posts = [-j for j in range(1, 101)]
+        for position, k in ((10, 3), (40, 40), (70, 150)):
+            head_posts.insert(position, k)
+        result, pages, added = await self.refresh(head_posts)
+        self.assertEqual(result['comments'], 100)
+        self.assertEqual(added, 100)
+        # 第2页后半部分是已有的帖子，不再往后翻
+        self.assertEqual(pages, [1, 2])
+        self.assertEqual(self.state.get(STOCK_CODE)['head_time'],
+                         str(NOW + pd.Timedelta(minutes=len(head_posts) * HEAD_MINUTES)))
+        self.assert_head_posts(head_posts)
+
+    def assert_head_posts(self, head_posts):
+        """刷新后的帖子按列表顺序排在评论存储最前面，收到新回复的旧帖子更新了时间并重新进入各处理阶段"""
+        front = self.comments.conn.execute(
+            "SELECT post_id, update_time, kept FROM comments WHERE stock_code = ? ORDER BY seq LIMIT ?",
+            (STOCK_CODE, len(head_posts))).fetchall()
+        self.assertEqual([row[0] for row in front], [str(post_id(STOCK_CODE, k)) for k in head_posts])
+        for i, (_, update_time, kept) in enumerate(front):
+            expected = NOW + pd.Timedelta(minutes=(len(head_posts) - i) * HEAD_MINUTES)
+            self.assertEqual(update_time, f'{expected:%m-%d %H:%M}')
+            self.assertIsNone(kept)
+        pending = self.comments.conn.execute(
+            "SELECT COUNT(*) FROM comments WHERE stock_code = ? AND kept IS NULL", (STOCK_CODE,)).fetchone()[0]
+        self.assertEqual(pending, len(head_posts))
+        # 旧帖子原来的日期需要重新计算日均情感
+        self.assertEqual(self.comments.expire(STOCK_CODE, '2000-01-01 00:00:00'), ['2025-01-02'])
+
+    async def test_refresh_past_page_of_replied_posts(self):
+        # 第1页全是收到新回复的旧帖子，新帖子都在第2页
+        head_posts = list(range(10, 10 + ROWS_PER_PAGE)) + [-j for j in range(1, 21)]
+        result, pages, added = await self.refresh(head_posts)
+        self.assertEqual(result['comments'], 20)
+        self.assertEqual(added, 20)
+        self.assertEqual(pages, [1, 2])
+        self.assert_head_posts(head_posts)
+
+    async def test_retries_failed_request(self):
+        async with GubaFixtureServer(synthetic=True, fail_from=1) as server:
+            async with self.crawler(server, max_retries=2) as crawler:
+                content = await crawler.fetch(crawler.page_url(STOCK_CODE, 1))
+        self.assertIsNone(content)
+        self.assertEqual(server.request_count, 3)
+        self.assertEqual(crawler.stats.retries, 2)
+        self.assertEqual(crawler.stats.failed, 1)
+
+    async def test_throttled_host_does_not_block_other_hosts(self):
+        async with GubaFixtureServer(synthetic=True) as slow, GubaFixtureServer(synthetic=True) as fast:
+            # 只有一个全局并发名额，每个主机每秒2个请求
+            async with self.crawler(slow, concurrency=1, rate=2) as crawler:
+                started = time.monotonic()
+
+                async def fetch(server):
+                    await crawler.fetch(f'{server.base_url}/list,{STOCK_CODE}.html')
+                    return time.monotonic() - started
+
+                elapsed = await asyncio.gather(*(fetch(slow) for _ in range(3)), fetch(fast))
+        # 第一个主机的后两个请求要等0.5秒和1秒，第二个主机的请求不需要等它们
+        self.assertGreater(elapsed[2], 0.9)
+        self.assertLess(elapsed[3], 0.3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+评论存储写入的测试：旧CSV导入的哈希ID与真实帖子ID的对应，以及再次爬到有变化的帖子
+
+用法：
+    python -m unittest test_comment_store.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from comment_store import CommentStore, comment_key
+
+STOCK_CODE = '601360'
+
+
+class CommentStoreInsertTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = CommentStore(os.path.join(self.tmp, 'comments.sqlite'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def rows(self):
+        return list(self.store.conn.execute(
+            "SELECT post_id, seq, title, update_time, kept, scored_at FROM comments "
+            "WHERE stock_code = ? ORDER BY seq", (STOCK_CODE,)))
+
+    def score_all(self):
+        """模拟清洗和打分阶段已经处理过全部评论"""
+        with self.store.conn:
+            self.store.conn.execute("UPDATE comments SET comment_time = '2025-01-02 10:00:00', kept = 1, "
+                                    "sentiment = 0.5, scored_at = 1")
+
+    def test_real_post_id_replaces_legacy_key(self):
+        legacy = [{'title': '利好', 'update_time': '01-02 10:00'}, {'title': '利空', 'update_time': '01-01 09:00'}]
+        self.assertEqual(len(self.store.insert(STOCK_CODE, legacy)), 2)
+        self.score_all()
+
+        crawled = [dict(row, post_id=f'p{i}') for i, row in enumerate(legacy)]
+        self.assertEqual(self.store.insert(STOCK_CODE, crawled), [])
+        # 旧记录改用真实ID，位置和处理结果不变
+        self.assertEqual(self.rows(), [('p0', 0, '利好', '01-02 10:00', 1, 1.0),
+                                       ('p1', 1, '利空', '01-01 09:00', 1, 1.0)])
+        self.assertNotIn(comment_key(legacy[0]), [row[0] for row in self.rows()])
+
+    def test_changed_post_is_moved_and_reprocessed(self):
+        self.store.insert(STOCK_CODE, [{'post_id': 'p0', 'title': '利好', 'update_time': '01-02 10:00'},
+                                       {'post_id': 'p1', 'title': '利空', 'update_time': '01-01 09:00'}])
+        self.score_all()
+
+        # p1有新回复，更新时间变化后排到最前面
+        added = self.store.insert(STOCK_CODE, [{'post_id': 'p1', 'title': '利空', 'update_time': '01-03 08:00'},
+                                               {'post_id': 'p0', 'title': '利好', 'update_time': '01-02 10:00'}],
+                                  prepend=True)
+        self.assertEqual(added, [])
+        self.assertEqual(self.rows(), [('p1', -1, '利空', '01-03 08:00', None, None),
+                                       ('p0', 0, '利好', '01-02 10:00', 1, 1.0)])
+        # 原来的日期需要重新计算日均情感，只返回一次
+        self.assertEqual(self.store.expire(STOCK_CODE, '2000-01-01 00:00:00'), ['2025-01-02'])
+        self.assertEqual(self.store.expire(STOCK_CODE, '2000-01-01 00:00:00'), [])
+
+    def test_duplicates_in_one_batch_are_written_once(self):
+        row = {'post_id': 'p0', 'title': '利好', 'update_time': '01-02 10:00'}
+        self.assertEqual(len(self.store.insert(STOCK_CODE, [row, dict(row)])), 1)
+        self.assertEqual(self.store.count(STOCK_CODE), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
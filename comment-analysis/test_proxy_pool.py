@@ -0,0 +1,144 @@
+"""
+代理池的测试，使用fake_proxy_vendor.py中的本地假供应商和guba_fixture_server.py中的本地页面，不消耗真实代理额度
+
+代理池的lease会阻塞，补充线程通过requests调用供应商API，而假供应商运行在测试的事件循环里，
+所以测试中借出代理都放到线程里执行。
+
+用法：
+    python -m unittest test_proxy_pool.py
+"""
+import asyncio
+import time
+import unittest
+
+import aiohttp
+
+from fake_proxy_vendor import API_KEY, API_SECRET, FakeProxyVendor
+from guba_fixture_server import GubaFixtureServer
+from proxy_pool import ProxyPool, XiangProxyVendor
+
+STOCK_CODE = '601360'
+
+
+def port_of(proxy):
+    return int(proxy.address.rsplit(':', 1)[1])
+
+
+class ProxyPoolTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.pool = None
+        self.session = aiohttp.ClientSession()
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        if self.pool is not None:
+            await asyncio.to_thread(self.pool.stop)
+
+    def create_pool(self, vendor, **kwargs):
+        self.pool = ProxyPool(XiangProxyVendor(API_KEY, API_SECRET, api_url=vendor.api_url), **kwargs)
+        return self.pool
+
+    async def lease(self, timeout=5):
+        return await asyncio.to_thread(self.pool.lease, timeout)
+
+    async def lease_all(self, count):
+        """借出count个代理，每个代理只借出一次时即为池中的全部代理"""
+        proxies = [await self.lease() for _ in range(count)]
+        self.assertNotIn(None, proxies)
+        return proxies
+
+    async def request(self, proxy, url):
+        """通过代理请求url并归还代理，返回是否成功"""
+        start = time.monotonic()
+        async with self.session.get(url, proxy=proxy.url) as response:
+            await response.read()
+            ok = response.status == 200
+        self.pool.release(proxy, ok, time.monotonic() - start)
+        return ok
+
+    async def test_fills_pool_from_vendor(self):
+        async with FakeProxyVendor(proxies=4, min_interval=0) as vendor:
+            pool = self.create_pool(vendor, target_size=4, max_leases=1, api_interval=60)
+            proxies = await self.lease_all(4)
+        self.assertEqual(sorted(port_of(p) for p in proxies), sorted(vendor.proxy_ports))
+        self.assertTrue(all(p.url.startswith(f'http://{API_KEY}:{API_SECRET}@') for p in proxies))
+        # 令牌桶一开始只有一个令牌，一次调用取满整个池子
+        self.assertEqual(vendor.api_calls, 1)
+        self.assertEqual(pool.stats()['fetched'], 4)
+
+    async def test_requests_pass_through_proxy(self):
+        async with GubaFixtureServer(synthetic=True) as server, FakeProxyVendor(proxies=2) as vendor:
+            self.create_pool(vendor, target_size=2, api_interval=60)
+            proxy = await self.lease()
+            self.assertTrue(await self.request(proxy, f'{server.base_url}/list,{STOCK_CODE}.html'))
+        self.assertEqual(vendor.forwarded, 1)
+        self.assertEqual(server.served, [(STOCK_CODE, 1)])
+        [summary] = [p for p in self.pool.stats()['proxies'] if p['address'] == proxy.address]
+        self.assertEqual(summary['requests'], 1)
+        self.assertIsNotNone(summary['latency'])
+
+    async def test_bans_proxy_after_consecutive_failures(self):
+        async with GubaFixtureServer(synthetic=True) as server, FakeProxyVendor(proxies=4, bad=2) as vendor:
+            # 补充间隔足够长，测试期间被剔除的代理不会补回来
+            pool = self.create_pool(vendor, target_size=4, max_leases=1, max_failures=2, api_interval=60)
+            url = f'{server.base_url}/list,{STOCK_CODE}.html'
+            for _ in range(2):
+                for proxy in await self.lease_all(4):
+                    self.assertEqual(await self.request(proxy, url), port_of(proxy) not in vendor.bad_ports)
+        stats = pool.stats()
+        self.assertEqual(stats['evicted'], 2)
+        self.assertEqual(stats['size'], 2)
+        good_ports = set(vendor.proxy_ports) - vendor.bad_ports
+        self.assertEqual({port_of(p) for p in pool.proxies.values()}, good_ports)
+
+    async def test_bans_proxy_with_low_success_rate(self):
+        async with FakeProxyVendor(proxies=1) as vendor:
+            pool = self.create_pool(vendor, target_size=1, alpha=0.5, min_success=0.5, min_requests=4,
+                                    max_failures=3, api_interval=60)
+            # 连续失败不超过2次，但第4个请求后成功率为0.3125，低于0.5
+            for ok in (False, False, True, False):
+                proxy = await self.lease()
+                self.assertIn(proxy.address, pool.proxies)
+                pool.release(proxy, ok)
+        self.assertNotIn(proxy.address, pool.proxies)
+        self.assertEqual(pool.stats()['evicted'], 1)
+
+    async def test_lease_limit_per_proxy(self):
+        async with FakeProxyVendor(proxies=1) as vendor:
+            pool = self.create_pool(vendor, target_size=1, max_leases=2, api_interval=60)
+            first, second = await self.lease(), await self.lease()
+            self.assertIs(first, second)
+            # 唯一的代理已经借出两次，第三次借出等到超时
+            self.assertIsNone(await self.lease(timeout=0.2))
+            pool.release(first, True)
+            self.assertIs(await self.lease(timeout=0.2), first)
+
+    async def test_expired_proxies_are_replaced(self):
+        async with FakeProxyVendor(proxies=4, min_interval=0) as vendor:
+            pool = self.create_pool(vendor, target_size=2, max_leases=1, max_age=0.5, api_interval=0.1)
+            old = await self.lease_all(2)
+            for proxy in old:
+                pool.release(proxy, True)
+            await asyncio.sleep(0.7)
+            new = await self.lease_all(2)
+        # 假供应商按顺序轮流分配，过期后补充的是另外两个代理
+        self.assertEqual({port_of(p) for p in old}, set(vendor.proxy_ports[:2]))
+        self.assertEqual({port_of(p) for p in new}, set(vendor.proxy_ports[2:]))
+        self.assertGreaterEqual(pool.stats()['expired'], 2)
+
+    async def test_respects_vendor_rate_limit(self):
+        async with FakeProxyVendor(proxies=8, min_interval=0.15) as vendor:
+            # 每个代理失败一次就剔除，迫使代理池反复调用供应商API
+            pool = self.create_pool(vendor, target_size=1, max_failures=1, api_interval=0.2)
+            for _ in range(3):
+                pool.release(await self.lease(), False)
+            await self.lease()
+        stats = pool.stats()
+        self.assertEqual(stats['evicted'], 3)
+        self.assertEqual(stats['api_errors'], 0)
+        self.assertEqual(vendor.api_calls, stats['api_calls'])
+        self.assertGreaterEqual(vendor.api_calls, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,15 @@
-import pandas as pd
 import jieba
 from collections import Counter
 import re
-from sqlalchemy import create_engine, Table, MetaData, insert, delete, text
+from sqlalchemy import insert, delete
 from datetime import datetime
 import os
+import sys
+from comment_store import CommentStore
+
+# 将仓库根目录加入模块搜索路径，以便导入公共模块common
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.db import get_engine, get_table, get_stock_codes  # noqa: E402
 
 def clean_text(text):
     """清理文本"""
@@ -26,18 +31,15 @@ def load_stop_words():
 
 def generate_word_frequency(stock_code):
     """生成指定股票的词频统计"""
-    # 确保data目录存在
-    data_dir = os.path.join(os.path.dirname(__file__), 'data')
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
-    
-    # 读取评论文件
-    file_path = os.path.join(data_dir, f'comments_{stock_code}.csv')
-    if not os.path.exists(file_path):
-        print(f"找不到股票{stock_code}的评论文件")
+    # 从评论存储读取全部评论
+    store = CommentStore()
+    try:
+        df = store.load(stock_code, kept_only=False)
+    finally:
+        store.close()
+    if df.empty:
+        print(f"找不到股票{stock_code}的评论")
         return
-        
-    df = pd.read_csv(file_path)
     
     # 加载停用词
     stop_words = load_stop_words()
@@ -62,66 +64,24 @@ def generate_word_frequency(stock_code):
 
 def save_to_database(word_freq, stock_code):
     """保存词频数据到数据库"""
-    db_config = {
-        'user': 'root',
-        'password': '123456',
-        'host': '127.0.0.1',
-        'database': 'stocks'
-    }
-    
-    engine = create_engine(
-        f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}")
-    
-    metadata = MetaData()
-    metadata.reflect(bind=engine)
-    
     try:
-        word_frequency_table = Table('word_frequency', metadata, autoload_with=engine)
+        word_frequency_table = get_table('word_frequency')
+        current_time = datetime.now()
         
-        # 删除该股票的旧数据
-        with engine.begin() as connection:
+        # 在同一个事务中删除该股票的旧数据并批量插入新数据
+        with get_engine().begin() as connection:
             connection.execute(
                 delete(word_frequency_table).where(word_frequency_table.c.stock_code == stock_code)
             )
-        
-        # 插入新数据
-        current_time = datetime.now()
-        with engine.begin() as connection:
-            for word, freq in word_freq.items():
-                stmt = insert(word_frequency_table).values(
-                    stock_code=stock_code,
-                    word=word,
-                    frequency=freq,
-                    update_time=current_time
-                )
-                connection.execute(stmt)
+            records = [
+                {'stock_code': stock_code, 'word': word, 'frequency': freq, 'update_time': current_time}
+                for word, freq in word_freq.items()
+            ]
+            if records:
+                connection.execute(insert(word_frequency_table), records)
                 
     except Exception as e:
         print(f"数据库操作错误: {e}")
-    finally:
-        engine.dispose()
-
-def get_stock_codes():
-    """从数据库获取股票代码列表"""
-    db_config = {
-        'user': 'root',
-        'password': '123456',
-        'host': '127.0.0.1',
-        'database': 'stocks'
-    }
-    
-    engine = create_engine(
-        f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}")
-    
-    try:
-        with engine.connect() as connection:
-            result = connection.execute(text("SELECT stock_code FROM stock_info"))
-            return [row[0] for row in result]
-    except Exception as e:
-        print(f"获取股票代码失败: {e}")
-        return []
-    finally:
-        engine.dispose()
 
 if __name__ == '__main__':
     stock_codes = get_stock_codes()
@@ -0,0 +1,117 @@
+import time
+
+from sqlalchemy import insert, delete, select, bindparam, and_, UniqueConstraint
+from sqlalchemy.dialects import mysql, sqlite
+
+# 单条语句的占位符上限（MySQL为65535，留出余量）
+MAX_PARAMS_PER_STATEMENT = 30000
+# 每批写入的默认行数
+DEFAULT_BATCH_SIZE = 5000
+
+
+def dataframe_to_records(df, columns=None):
+    """把DataFrame转换为可直接执行的记录列表，NaN统一转换为None"""
+    if columns is not None:
+        df = df[list(columns)]
+    # 转为object类型后numpy标量会变成Python原生类型，数据库驱动可以直接处理
+    df = df.astype(object).where(df.notna(), None)
+    return df.to_dict('records')
+
+
+def _batches(records, batch_size):
+    """按批次切分记录，保证每条语句的占位符数量不超过上限"""
+    if not records:
+        return
+    n_columns = max(len(records[0]), 1)
+    size = max(1, min(batch_size, MAX_PARAMS_PER_STATEMENT // n_columns))
+    for start in range(0, len(records), size):
+        yield records[start:start + size]
+
+
+def _has_unique_key(table, key_columns):
+    """判断key_columns是否正好是表的主键或某个唯一索引"""
+    key_set = set(key_columns)
+    if {c.name for c in table.primary_key.columns} == key_set:
+        return True
+    for index in table.indexes:
+        if index.unique and {c.name for c in index.columns} == key_set:
+            return True
+    for constraint in table.constraints:
+        if isinstance(constraint, UniqueConstraint) and {c.name for c in constraint.columns} == key_set:
+            return True
+    return False
+
+
+def insert_records(connection, table, records, batch_size=DEFAULT_BATCH_SIZE):
+    """多行INSERT批量写入"""
+    for batch in _batches(records, batch_size):
+        connection.execute(insert(table).values(batch))
+
+
+def upsert_records(connection, table, records, key_columns, batch_size=DEFAULT_BATCH_SIZE):
+    """按key_columns批量插入或更新记录"""
+    if not records:
+        return
+    update_columns = [c for c in records[0] if c not in key_columns]
+    dialect = connection.dialect.name
+
+    # 有唯一键时直接使用数据库原生的upsert语句
+    if _has_unique_key(table, key_columns) and dialect in ('mysql', 'sqlite'):
+        for batch in _batches(records, batch_size):
+            if dialect == 'mysql':
+                stmt = mysql.insert(table).values(batch)
+                stmt = stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in update_columns})
+            else:
+                stmt = sqlite.insert(table).values(batch)
+                stmt = stmt.on_conflict_do_update(index_elements=list(key_columns),
+                                                  set_={c: stmt.excluded[c] for c in update_columns})
+            connection.execute(stmt)
+        return
+
+    # 没有唯一键时：一次查询出已存在的键，再分别批量插入和批量更新
+    key_cols = [table.c[k] for k in key_columns]
+    existing = {tuple(row) for row in connection.execute(select(*key_cols))}
+    new_records, old_records = [], []
+    for record in records:
+        key = tuple(record[k] for k in key_columns)
+        (old_records if key in existing else new_records).append(record)
+
+    insert_records(connection, table, new_records, batch_size)
+
+    if old_records and update_columns:
+        # 键列使用单独的参数名，避免与SET子句中的列名冲突
+        stmt = table.update().where(and_(*[table.c[k] == bindparam(f'key_{k}') for k in key_columns]))
+        params = [
+            {**{c: r[c] for c in update_columns}, **{f'key_{k}': r[k] for k in key_columns}}
+            for r in old_records
+        ]
+        for batch in _batches(params, batch_size):
+            connection.execute(stmt, batch)
+
+
+def bulk_load(engine, table, df, columns=None, key_columns=None, replace=False,
+              batch_size=DEFAULT_BATCH_SIZE):
+    """
+    把整个DataFrame写入数据表，返回(记录数, 每秒记录数)
+
+    replace=True时在同一事务内先清空表再写入，读者不会看到空表；
+    指定key_columns时按键upsert，否则直接批量插入。
+    """
+    start = time.perf_counter()
+    if key_columns:
+        # 同一批数据中的重复键只保留最后一条，与逐行更新的结果一致
+        df = df.drop_duplicates(subset=list(key_columns), keep='last')
+    records = dataframe_to_records(df, columns)
+
+    with engine.begin() as connection:
+        if replace:
+            connection.execute(delete(table))
+        if key_columns:
+            upsert_records(connection, table, records, key_columns, batch_size)
+        else:
+            insert_records(connection, table, records, batch_size)
+
+    elapsed = time.perf_counter() - start
+    rate = len(records) / elapsed if elapsed > 0 else float('inf')
+    print(f"导入'{table.name}'表: {len(records)}条记录, 耗时{elapsed:.3f}秒, {rate:.0f}条/秒")
+    return len(records), rate
@@ -0,0 +1,122 @@
+"""
+股吧评论时间的年份推断
+
+列表页上的时间只有"MM-DD HH:MM"，没有年份。评论按爬取顺序从新到旧排列：第一条评论不晚于今天，
+往后每当月日突然向后跳（例如从01-02跳到12-31），说明跨过了一个年头，年份减一。
+整列一次完成字符串拆分和整数日期构造，不逐行调用pd.to_datetime；按文件调用时结果按文件状态缓存。
+"""
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# 相邻两条评论的年内天数向后跳超过这个值才算跨年，更新时间略有乱序的帖子不会被误判
+WRAP_THRESHOLD_DAYS = 180
+# 每月1日之前的天数（按平年），下标为月份
+_DAYS_BEFORE_MONTH = np.array([0, 0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334], dtype=np.int64)
+# 非定长格式（如"1-5 9:30"或只有月日）的解析规则
+_PATTERN = r'^(\d{1,2})-(\d{1,2})(?:\s+(\d{1,2}):(\d{1,2}))?'
+_FIXED_LENGTH = len('MM-DD HH:MM')
+
+_file_cache = OrderedDict()
+_FILE_CACHE_SIZE = 64
+
+
+def _split_fixed(values):
+    """定长的"MM-DD HH:MM"直接按字符码点计算，返回(月, 日, 时, 分, 是否符合格式)"""
+    codes = values.astype(f'U{_FIXED_LENGTH}').view(np.uint32).reshape(len(values), _FIXED_LENGTH)
+    codes = codes.astype(np.int64) - ord('0')
+    digits = codes[:, [0, 1, 3, 4, 6, 7, 9, 10]]
+    ok = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    ok &= codes[:, 2] == ord('-') - ord('0')
+    ok &= codes[:, 5] == ord(' ') - ord('0')
+    ok &= codes[:, 8] == ord(':') - ord('0')
+    month = codes[:, 0] * 10 + codes[:, 1]
+    day = codes[:, 3] * 10 + codes[:, 4]
+    hour = codes[:, 6] * 10 + codes[:, 7]
+    minute = codes[:, 9] * 10 + codes[:, 10]
+    return month, day, hour, minute, ok
+
+
+def _split_other(strings):
+    """其余格式用正则拆分，缺少时分的按00:00处理"""
+    parts = strings.str.extract(_PATTERN).astype(np.float64)
+    ok = parts[0].notna().to_numpy() & parts[1].notna().to_numpy()
+    parts = parts.fillna(0).to_numpy(dtype=np.int64)
+    return parts[:, 0], parts[:, 1], parts[:, 2], parts[:, 3], ok
+
+
+def infer_dates(update_time, today=None):
+    """
+    推断一列评论时间的年份
+
+    update_time为按爬取顺序（从新到旧）排列的时间字符串，today默认为今天；
+    返回同样长度的datetime64[ns]数组，无法解析的为NaT
+    """
+    today = pd.Timestamp(today if today is not None else pd.Timestamp.now()).normalize()
+    strings = pd.Series(update_time, dtype=object).fillna('').astype(str).str.strip()
+    n = len(strings)
+    month = np.zeros(n, dtype=np.int64)
+    day = np.zeros(n, dtype=np.int64)
+    hour = np.zeros(n, dtype=np.int64)
+    minute = np.zeros(n, dtype=np.int64)
+    ok = np.zeros(n, dtype=bool)
+
+    fixed = (strings.str.len() == _FIXED_LENGTH).to_numpy()
+    if fixed.any():
+        month[fixed], day[fixed], hour[fixed], minute[fixed], ok[fixed] = _split_fixed(strings.to_numpy()[fixed])
+    other = ~ok
+    if other.any():
+        month[other], day[other], hour[other], minute[other], ok[other] = _split_other(strings[other])
+    ok &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31) & (hour <= 23) & (minute <= 59)
+
+    result = np.full(n, np.datetime64('NaT'), dtype='datetime64[ns]')
+    rows = np.flatnonzero(ok)
+    if len(rows) == 0:
+        return result
+    month, day = month[rows], day[rows]
+
+    # 年内天数向后跳变的位置就是跨年的位置，第一条评论在今天之后则属于去年
+    day_of_year = _DAYS_BEFORE_MONTH[month] + day
+    wraps = np.concatenate(([0], np.cumsum(np.diff(day_of_year) > WRAP_THRESHOLD_DAYS)))
+    today_of_year = _DAYS_BEFORE_MONTH[today.month] + today.day
+    base_year = today.year if day_of_year[0] <= today_of_year else today.year - 1
+    year = base_year - wraps
+
+    # 非闰年的2月29日按2月28日处理
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    day = np.where((month == 2) & (day == 29) & ~leap, 28, day)
+
+    month_start = (year - 1970).astype('datetime64[Y]').astype('datetime64[M]') + (month - 1)
+    first_day = month_start.astype('datetime64[D]')
+    days_in_month = ((month_start + 1).astype('datetime64[D]') - first_day).astype(np.int64)
+    valid = day <= days_in_month
+    stamps = (first_day + (day - 1)).astype('datetime64[m]') + (hour[rows] * 60 + minute[rows])
+    result[rows[valid]] = stamps[valid]
+    return result
+
+
+def comment_dates(df, path=None, column='update_time', today=None):
+    """
+    返回df中每条评论的完整时间（pd.Series，索引与df相同）
+
+    df必须保持文件中的爬取顺序；传入path时按文件路径、修改时间和大小缓存结果，
+    同一个文件被多个步骤读取时只推断一次
+    """
+    today = pd.Timestamp(today if today is not None else pd.Timestamp.now()).normalize()
+    key = None
+    if path is not None:
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, len(df), column, today)
+        cached = _file_cache.get(key)
+        if cached is not None:
+            _file_cache.move_to_end(key)
+            return pd.Series(cached, index=df.index, name=column)
+
+    values = infer_dates(df[column].to_numpy(), today)
+    if key is not None:
+        _file_cache[key] = values
+        if len(_file_cache) > _FILE_CACHE_SIZE:
+            _file_cache.popitem(last=False)
+    return pd.Series(values, index=df.index, name=column)
@@ -0,0 +1,147 @@
+"""
+公共数据库访问层
+
+每个进程只创建一个带连接池的engine，反射得到的表结构也只缓存一份。
+连接参数从环境变量读取：
+    SCAS_DB_URL            完整的SQLAlchemy连接串，设置后忽略下面的分项配置；
+                           测试时可以设为sqlite:///stocks.db或sqlite://（内存库）
+    SCAS_DB_USER / SCAS_DB_PASSWORD / SCAS_DB_HOST / SCAS_DB_PORT / SCAS_DB_NAME
+    SCAS_DB_POOL_SIZE / SCAS_DB_MAX_OVERFLOW / SCAS_DB_POOL_RECYCLE
+"""
+import os
+import threading
+
+import pandas as pd
+from sqlalchemy import create_engine, MetaData, text
+from sqlalchemy.pool import StaticPool
+
+from common.bulk_loader import bulk_load
+
+DEFAULT_DB_CONFIG = {
+    'user': 'root',
+    'password': '123456',
+    'host': '127.0.0.1',
+    'port': '3306',
+    'database': 'stocks',
+}
+
+_lock = threading.RLock()
+_engine = None
+_engine_pid = None
+_metadata = None
+
+
+def get_db_url():
+    """根据环境变量拼接数据库连接串"""
+    url = os.environ.get('SCAS_DB_URL')
+    if url:
+        return url
+    user = os.environ.get('SCAS_DB_USER', DEFAULT_DB_CONFIG['user'])
+    password = os.environ.get('SCAS_DB_PASSWORD', DEFAULT_DB_CONFIG['password'])
+    host = os.environ.get('SCAS_DB_HOST', DEFAULT_DB_CONFIG['host'])
+    port = os.environ.get('SCAS_DB_PORT', DEFAULT_DB_CONFIG['port'])
+    database = os.environ.get('SCAS_DB_NAME', DEFAULT_DB_CONFIG['database'])
+    return f"mysql+mysqlconnector://{user}:{password}@{host}:{port}/{database}"
+
+
+def _create_engine(url):
+    if url.startswith('sqlite'):
+        if url in ('sqlite://', 'sqlite:///:memory:'):
+            # 内存库只能在同一个连接里看到数据，所有线程共用一个连接
+            return create_engine(url, poolclass=StaticPool, connect_args={'check_same_thread': False})
+        return create_engine(url, connect_args={'check_same_thread': False})
+    return create_engine(
+        url,
+        pool_size=int(os.environ.get('SCAS_DB_POOL_SIZE', 5)),
+        max_overflow=int(os.environ.get('SCAS_DB_MAX_OVERFLOW', 10)),
+        pool_recycle=int(os.environ.get('SCAS_DB_POOL_RECYCLE', 3600)),
+        pool_pre_ping=True,
+    )
+
+
+def get_engine():
+    """获取进程内共享的engine，fork出的子进程会重新建立自己的连接池"""
+    global _engine, _engine_pid, _metadata
+    with _lock:
+        if _engine is not None and _engine_pid != os.getpid():
+            # 子进程不能复用父进程的连接，只丢弃连接池而不关闭父进程的连接
+            _engine.dispose(close=False)
+            _engine = None
+            _metadata = None
+        if _engine is None:
+            _engine = _create_engine(get_db_url())
+            _engine_pid = os.getpid()
+        return _engine
+
+
+def get_metadata():
+    """获取缓存的MetaData，表结构在第一次用到时才反射"""
+    global _metadata
+    # 先检查engine，fork后的子进程会在这里丢弃父进程的表结构缓存
+    get_engine()
+    with _lock:
+        if _metadata is None:
+            _metadata = MetaData()
+        return _metadata
+
+
+def get_table(table_name):
+    """获取反射好的数据表，每个进程每张表只反射一次"""
+    metadata = get_metadata()
+    with _lock:
+        if table_name not in metadata.tables:
+            metadata.reflect(bind=get_engine(), only=[table_name])
+        return metadata.tables[table_name]
+
+
+def reflect_all():
+    """一次性反射整个库的表结构"""
+    metadata = get_metadata()
+    with _lock:
+        metadata.reflect(bind=get_engine())
+    return metadata
+
+
+def dispose_engine():
+    """关闭连接池，进程退出前调用"""
+    global _engine, _metadata
+    with _lock:
+        if _engine is not None:
+            _engine.dispose()
+        _engine = None
+        _metadata = None
+
+
+def bulk_upsert(table, df, key_columns=None, columns=None, replace=False):
+    """把DataFrame批量写入数据表，table可以是表名或Table对象，返回(记录数, 每秒记录数)"""
+    if isinstance(table, str):
+        table = get_table(table)
+    return bulk_load(get_engine(), table, df, columns, key_columns=key_columns, replace=replace)
+
+
+def read_sql(query, params=None):
+    """执行查询并返回DataFrame"""
+    if isinstance(query, str):
+        query = text(query)
+    with get_engine().connect() as connection:
+        return pd.read_sql(query, connection, params=params)
+
+
+def read_sql_chunks(query, params=None, chunksize=10000):
+    """流式执行查询，逐块返回DataFrame，不会一次把整个结果集读入内存"""
+    if isinstance(query, str):
+        query = text(query)
+    with get_engine().connect().execution_options(stream_results=True) as connection:
+        for chunk in pd.read_sql(query, connection, params=params, chunksize=chunksize):
+            yield chunk
+
+
+def get_stock_codes():
+    """从数据库获取股票代码列表，失败时返回空列表"""
+    try:
+        with get_engine().connect() as connection:
+            result = connection.execute(text("SELECT stock_code FROM stock_info"))
+            return [row[0] for row in result]
+    except Exception as e:
+        print(f"获取股票代码失败: {e}")
+        return []
@@ -0,0 +1,243 @@
+"""
+日K线列式存储
+
+每只股票一个未压缩的Arrow IPC文件，按市场分区：{root}/market={0|1}/{stock_code}.arrow。
+文件内按date_time升序排列，stock_code为字典编码，日期为date32，价格和比率为float32。
+读取时使用内存映射，按列投影和日期范围切片都不需要复制数据。
+覆盖写入一只股票（复权因子变化后重新全量爬取等）时在{root}/.rewritten/{stock_code}留下标记，
+增量同步到数据库时据此删除并重新导入该股票的全部K线。
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# 默认存储目录，可以通过环境变量SCAS_KLINE_STORE覆盖
+DEFAULT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                            'moneyBomb', 'moneyBombTest', 'moneyBombTest', 'data', 'kline_store')
+
+KLINE_SCHEMA = pa.schema([
+    ('stock_code', pa.dictionary(pa.int32(), pa.string())),
+    ('date_time', pa.date32()),
+    ('open_price', pa.float32()),
+    ('close_price', pa.float32()),
+    ('high_price', pa.float32()),
+    ('low_price', pa.float32()),
+    ('volume', pa.int64()),
+    ('trade_value', pa.float64()),  # 成交额可达百亿，float32精度不够
+    ('amplitude', pa.float32()),
+    ('up_down_range', pa.float32()),
+    ('up_down_price', pa.float32()),
+    ('turnover_rate', pa.float32()),
+])
+KLINE_COLUMNS = KLINE_SCHEMA.names
+
+
+def market_of(stock_code):
+    """上海市场股票代码以'6'开头，其余按深圳市场处理"""
+    return '1' if str(stock_code).startswith('6') else '0'
+
+
+def _to_days(value):
+    """把日期类参数转换为自1970-01-01起的天数，与date32的存储值一致"""
+    return int(np.datetime64(pd.Timestamp(value).date(), 'D').astype(np.int64))
+
+
+class KlineStore:
+    def __init__(self, root=None):
+        self.root = os.path.abspath(root or os.environ.get('SCAS_KLINE_STORE', DEFAULT_ROOT))
+
+    def path_of(self, stock_code):
+        return os.path.join(self.root, f'market={market_of(stock_code)}', f'{stock_code}.arrow')
+
+    def marker_path(self, stock_code):
+        return os.path.join(self.root, '.rewritten', stock_code)
+
+    def exists(self, stock_code):
+        return os.path.exists(self.path_of(stock_code))
+
+    def stock_codes(self):
+        """列出存储中的所有股票代码"""
+        codes = []
+        if not os.path.isdir(self.root):
+            return codes
+        for market_dir in sorted(os.listdir(self.root)):
+            market_path = os.path.join(self.root, market_dir)
+            if not os.path.isdir(market_path):
+                continue
+            codes.extend(name[:-len('.arrow')] for name in sorted(os.listdir(market_path))
+                         if name.endswith('.arrow'))
+        return codes
+
+    # ---------- 写入 ----------
+
+    @staticmethod
+    def to_table(df):
+        """把K线DataFrame转换为按日期排序、去重后的Arrow表"""
+        df = df.copy()
+        df['date_time'] = pd.to_datetime(df['date_time']).dt.normalize()
+        df = df.drop_duplicates(subset='date_time', keep='last').sort_values('date_time')
+
+        arrays = []
+        for field in KLINE_SCHEMA:
+            column = df[field.name]
+            if field.name == 'stock_code':
+                arrays.append(pa.array(column.astype(str).to_numpy()).dictionary_encode())
+            elif field.name == 'date_time':
+                arrays.append(pa.array(column.to_numpy().astype('datetime64[D]')))
+            else:
+                arrays.append(pa.array(column.to_numpy(), type=field.type, from_pandas=True))
+        return pa.Table.from_arrays(arrays, schema=KLINE_SCHEMA)
+
+    def _write_table(self, stock_code, table):
+        """先写临时文件再原子替换，读者不会读到写了一半的文件"""
+        path = self.path_of(stock_code)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 以'.'开头的文件会被数据集扫描忽略
+        tmp_path = os.path.join(os.path.dirname(path), f'.{stock_code}.arrow.tmp')
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, KLINE_SCHEMA) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+
+    def write(self, stock_code, df):
+        """覆盖写入一只股票的全部K线，并标记该股票的历史已被重写"""
+        table = self.to_table(df)
+        self._write_table(stock_code, table)
+        self.mark_rewritten(stock_code)
+        return table.num_rows
+
+    def append(self, stock_code, df):
+        """追加K线，与已有数据日期重复的行以新数据为准"""
+        if not self.exists(stock_code):
+            return self.write(stock_code, df)
+        new_table = self.to_table(df)
+        if new_table.num_rows == 0:
+            return 0
+        first_new = new_table.column('date_time')[0].as_py()
+        # 保留新数据第一天之前的旧数据
+        old_table = self.read(stock_code, end=first_new, inclusive_end=False)
+        table = pa.concat_tables([old_table, new_table])
+        self._write_table(stock_code, table.unify_dictionaries().combine_chunks())
+        return new_table.num_rows
+
+    # ---------- 重写标记 ----------
+
+    def mark_rewritten(self, stock_code):
+        """标记一只股票的全部历史已被覆盖写入，标记内容为写入时间，同步期间再次重写时标记会变化"""
+        path = self.marker_path(stock_code)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(str(time.time_ns()))
+
+    def rewritten(self):
+        """返回{股票代码: 标记}，即上次同步之后被覆盖写入过的股票"""
+        marker_dir = os.path.join(self.root, '.rewritten')
+        if not os.path.isdir(marker_dir):
+            return {}
+        markers = {}
+        for stock_code in sorted(os.listdir(marker_dir)):
+            try:
+                with open(os.path.join(marker_dir, stock_code), 'r', encoding='utf-8') as f:
+                    markers[stock_code] = f.read()
+            except FileNotFoundError:
+                continue
+        return markers
+
+    def clear_rewritten(self, stock_code, marker):
+        """同步完成后清除标记，标记已经变化（同步期间又被重写）时保留"""
+        path = self.marker_path(stock_code)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                if f.read() != marker:
+                    return False
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    # ---------- 读取 ----------
+
+    def read(self, stock_code, columns=None, start=None, end=None, inclusive_end=True):
+        """
+        读取一只股票的K线，返回pyarrow.Table，股票不存在时返回None
+
+        columns为需要的列；start/end为日期范围，利用文件按日期有序直接切片。
+        """
+        path = self.path_of(stock_code)
+        if not os.path.exists(path):
+            return None
+        table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+        if start is not None or end is not None:
+            days = table.column('date_time').cast(pa.int32()).to_numpy()
+            lo = 0 if start is None else int(np.searchsorted(days, _to_days(start), side='left'))
+            side = 'right' if inclusive_end else 'left'
+            hi = len(days) if end is None else int(np.searchsorted(days, _to_days(end), side=side))
+            table = table.slice(lo, max(hi - lo, 0))
+
+        if columns is not None:
+            table = table.select(list(columns))
+        return table
+
+    def read_df(self, stock_code, columns=None, start=None, end=None):
+        """读取一只股票的K线并转换为DataFrame，date_time为datetime64类型"""
+        table = self.read(stock_code, columns=columns, start=start, end=end)
+        if table is None:
+            return None
+        df = table.to_pandas(date_as_object=False)
+        if 'stock_code' in df.columns:
+            df['stock_code'] = df['stock_code'].astype(str)
+        return df
+
+    def tail(self, stock_code, n=1):
+        """读取最后n条K线"""
+        table = self.read(stock_code)
+        if table is None:
+            return None
+        return table.slice(max(table.num_rows - n, 0))
+
+    def last_date(self, stock_code):
+        """最后一个交易日，股票不存在时返回None"""
+        table = self.tail(stock_code, 1)
+        if table is None or table.num_rows == 0:
+            return None
+        return table.column('date_time')[0].as_py()
+
+    def dataset(self):
+        """以数据集方式扫描全部股票，可按market分区和任意列下推过滤"""
+        return ds.dataset(self.root, format='ipc', schema=KLINE_SCHEMA.append(pa.field('market', pa.string())),
+                          partitioning='hive')
+
+    def scan(self, columns=None, filter=None):
+        """扫描全部股票，例如scan(['stock_code', 'close_price'], ds.field('date_time') >= date(2024, 1, 1))"""
+        return self.dataset().to_table(columns=columns, filter=filter)
+
+    # ---------- 迁移 ----------
+
+    def import_csv_dir(self, klines_dir):
+        """把旧的data/klines/*_klines.csv一次性导入存储"""
+        count = 0
+        for filename in sorted(os.listdir(klines_dir)):
+            if not filename.endswith('_klines.csv'):
+                continue
+            df = pd.read_csv(os.path.join(klines_dir, filename), dtype={'stock_code': str})
+            if df.empty:
+                continue
+            self.write(df['stock_code'].iloc[0], df)
+            count += 1
+        print(f"已导入{count}只股票的K线数据到{self.root}")
+        return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='日K线列式存储工具')
+    parser.add_argument('--root', help='存储目录，默认读取SCAS_KLINE_STORE环境变量')
+    parser.add_argument('--import-csv', metavar='KLINES_DIR', help='导入旧的K线CSV目录')
+    args = parser.parse_args()
+    if args.import_csv:
+        KlineStore(args.root).import_csv_dir(args.import_csv)
@@ -0,0 +1,163 @@
+import json
+import os
+import time
+from datetime import datetime
+
+from scrapy.utils.project import get_project_settings
+from scrapy.utils.reactor import install_reactor
+
+settings = get_project_settings()
+# 必须在导入twisted.internet.reactor之前安装settings中指定的asyncio reactor
+install_reactor(settings['TWISTED_REACTOR'])
+
+from twisted.internet import reactor, defer, task, threads  # noqa: E402
+from scrapy.crawler import CrawlerRunner  # noqa: E402
+from scrapy.utils.log import configure_logging  # noqa: E402
+from main import SPIDER_TABLES, process_csv_to_mysql  # noqa: E402
+from updateStockKLines import update_stock_klines  # noqa: E402
+from common.db import reflect_all, dispose_engine  # noqa: E402
+
+# 各爬虫的运行周期（秒）
+SPIDER_INTERVALS = {
+    'getStocksData': 60,
+    'getEmotionIndex': 60,
+    'getPositionInfo': 60,
+    'getPredict': 60,
+    'getMainIndex': 60,
+    'getIndexKlines': 60,
+}
+# 日K线每小时爬取并同步一次
+KLINE_INTERVAL = 3600
+# 指标输出周期（秒）
+METRICS_INTERVAL = 300
+METRICS_FILE = 'data/scheduler_metrics.json'
+
+
+class Job:
+    """按固定周期运行的任务，上一次运行未结束时跳过本次运行"""
+
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func  # 返回Deferred或普通值的可调用对象
+        self.running = False
+        self.started_at = None
+        self.run_count = 0
+        self.fail_count = 0
+        self.skip_count = 0
+        self.pending_skips = 0  # 当前运行期间被跳过的次数，即积压
+        self.last_latency = None
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.loop = task.LoopingCall(self.tick)
+
+    def start(self):
+        self.loop.start(self.interval, now=True)
+
+    def tick(self):
+        if self.running:
+            self.skip_count += 1
+            self.pending_skips += 1
+            print(f"[{self.name}] 上一次运行尚未结束（已运行{time.monotonic() - self.started_at:.1f}秒），跳过本次运行")
+            return
+        self.running = True
+        self.started_at = time.monotonic()
+        print(f"[{self.name}] 开始第{self.run_count + self.fail_count + 1}次运行")
+        d = defer.maybeDeferred(self.func)
+        d.addCallbacks(self._on_success, self._on_failure)
+        d.addBoth(self._on_finish)
+
+    def _on_success(self, _):
+        self.run_count += 1
+
+    def _on_failure(self, failure):
+        self.fail_count += 1
+        print(f"[{self.name}] 运行出错: {failure.getErrorMessage()}")
+
+    def _on_finish(self, _):
+        latency = time.monotonic() - self.started_at
+        self.last_latency = latency
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.running = False
+        self.pending_skips = 0
+        print(f"[{self.name}] 运行结束，耗时{latency:.2f}秒")
+
+    def metrics(self):
+        """任务的延迟与积压指标"""
+        finished = self.run_count + self.fail_count
+        return {
+            'interval': self.interval,
+            'running': self.running,
+            'running_for': time.monotonic() - self.started_at if self.running else 0.0,
+            'runs': self.run_count,
+            'failures': self.fail_count,
+            'skipped': self.skip_count,
+            'backlog': self.pending_skips,
+            'last_latency': self.last_latency,
+            'avg_latency': self.total_latency / finished if finished else None,
+            'max_latency': self.max_latency,
+        }
+
+
+class CrawlScheduler:
+    """常驻进程的爬虫调度器，所有任务共享一个reactor，以及common.db中的连接池和表结构缓存"""
+
+    def __init__(self):
+        configure_logging(settings)
+        self.runner = CrawlerRunner(settings)
+        # 进程内共享的连接池和表结构，启动时反射一次
+        reflect_all()
+        self.jobs = []
+
+        for spider_name, interval in SPIDER_INTERVALS.items():
+            self.add_job(spider_name, interval, self._spider_job(spider_name))
+        self.add_job('getStockKline', KLINE_INTERVAL, self._kline_job)
+
+    def add_job(self, name, interval, func):
+        job = Job(name, interval, func)
+        self.jobs.append(job)
+        return job
+
+    def _spider_job(self, spider_name):
+        """爬取数据后只导入该爬虫产出的数据表"""
+        table_names = SPIDER_TABLES[spider_name]
+
+        def run():
+            d = self.runner.crawl(spider_name)
+            # 数据库写入放到线程池中执行，避免阻塞reactor
+            d.addCallback(lambda _: threads.deferToThread(process_csv_to_mysql, table_names))
+            return d
+
+        return run
+
+    def _kline_job(self):
+        d = self.runner.crawl('getStockKline')
+        d.addCallback(lambda _: threads.deferToThread(update_stock_klines))
+        return d
+
+    def metrics(self):
+        return {job.name: job.metrics() for job in self.jobs}
+
+    def report_metrics(self):
+        """输出各任务的指标，并写入METRICS_FILE供外部查看"""
+        metrics = self.metrics()
+        for name, m in metrics.items():
+            avg = f"{m['avg_latency']:.2f}秒" if m['avg_latency'] is not None else '-'
+            print(f"[指标] {name}: 运行{m['runs']}次, 失败{m['failures']}次, 跳过{m['skipped']}次, "
+                  f"积压{m['backlog']}, 平均耗时{avg}, 最大耗时{m['max_latency']:.2f}秒")
+        os.makedirs(os.path.dirname(METRICS_FILE), exist_ok=True)
+        with open(METRICS_FILE, 'w', encoding='utf-8') as fp:
+            json.dump({'time': datetime.now().isoformat(), 'jobs': metrics}, fp, ensure_ascii=False, indent=2)
+
+    def start(self):
+        print("爬虫调度器启动................")
+        for job in self.jobs:
+            job.start()
+        task.LoopingCall(self.report_metrics).start(METRICS_INTERVAL, now=False)
+        reactor.addSystemEventTrigger('before', 'shutdown', dispose_engine)
+        reactor.run()
+
+
+if __name__ == '__main__':
+    CrawlScheduler().start()
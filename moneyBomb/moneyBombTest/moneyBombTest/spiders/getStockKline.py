@@ -2,63 +2,90 @@ import json
 import pandas as pd
 import scrapy
 import os
+import sys
+
+# 将仓库根目录加入模块搜索路径，以便导入公共模块common
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', '..')))
+from common.kline_store import KlineStore, market_of  # noqa: E402
+
+# 全量爬取的起始日期
+FULL_BEG = '20230101'
+# 判断复权价格是否变化的容差
+PRICE_TOLERANCE = 0.005
 
 
 class GetStockKline(scrapy.Spider):
     print("爬取股票K线数据")
     name = "getStockKline"
 
+    base_url = ("https://push2his.eastmoney.com/api/qt/stock/kline/get?"
+                "fields1=f1,f2,f3,f4,f5,f6,f7,f8,f9,f10,f11,f12,f13&"
+                "fields2=f51,f52,f53,f54,f55,f56,f57,f58,f59,f60,f61&"
+                "beg={}&end=20500101&rtntype=6&secid={}.{}&klt=101&fqt=1")
+
     def start_requests(self):
         # 读取stocks_data.csv文件获取股票代码列表
         csv_path = 'data/stocks_data.csv'
         if not os.path.exists(csv_path):
             self.log('stocks_data.csv文件不存在')
             return
-            
+
         df = pd.read_csv(csv_path)
         stock_codes = df['stock_code'].astype(str).tolist()
-        
-        base_url = ("https://push2his.eastmoney.com/api/qt/stock/kline/get?"
-                   "fields1=f1,f2,f3,f4,f5,f6,f7,f8,f9,f10,f11,f12,f13&"
-                   "fields2=f51,f52,f53,f54,f55,f56,f57,f58,f59,f60,f61&"
-                   "beg=20230101&end=20500101&rtntype=6&secid={}.{}&klt=101&fqt=1")
-
-        # 确保data目录存在
-        if not os.path.exists('data'):
-            os.makedirs('data')
 
         # 遍历所有股票代码生成请求
         for stock_code in stock_codes:
             # 补齐6位股票代码
             stock_code = stock_code.zfill(6)
-            
+
             # 根据股票代码判断市场类型
             # 上海市场股票代码以'6'开头，深圳市场股票代码以'0'或'3'开头
-            market_type = '1' if stock_code.startswith('6') else '0'
-            
-            url = base_url.format(market_type, stock_code)
+            market_type = market_of(stock_code)
+
+            # 最后一个交易日的K线在盘中会继续变化，以倒数第二个交易日作为增量爬取的锚点
+            tail = self.store.tail(stock_code, 2)
+            if tail is None or tail.num_rows < 2:
+                yield self.full_request(market_type, stock_code)
+                continue
+
+            anchor = {
+                'date_time': tail.column('date_time')[0].as_py().strftime('%Y-%m-%d'),
+                'open_price': tail.column('open_price')[0].as_py(),
+                'close_price': tail.column('close_price')[0].as_py(),
+            }
+            # 从锚点日期开始增量爬取，锚点数据用于校验复权价格是否变化
             yield scrapy.Request(
-                url=url,
+                url=self.base_url.format(anchor['date_time'].replace('-', ''), market_type, stock_code),
                 callback=self.parse,
-                meta={'stock_code': stock_code}
+                meta={'stock_code': stock_code, 'market_type': market_type, 'anchor': anchor}
             )
 
+    def full_request(self, market_type, stock_code):
+        """全量爬取单只股票的K线数据"""
+        return scrapy.Request(
+            url=self.base_url.format(FULL_BEG, market_type, stock_code),
+            callback=self.parse,
+            meta={'stock_code': stock_code, 'market_type': market_type},
+            dont_filter=True
+        )
+
     def __init__(self, *args, **kwargs):
         super(GetStockKline, self).__init__(*args, **kwargs)
-        self.data_frames = {}  # 用字典存储每个股票的DataFrame
+        self.store = KlineStore()  # K线列式存储
 
     def parse(self, response):
         stock_code = response.meta['stock_code']
-        
+        anchor = response.meta.get('anchor')
+
         try:
             # 解析返回的JSON数据
             json_data = json.loads(response.text)
-            
+
             if 'data' in json_data and json_data['data'] and 'klines' in json_data['data']:
                 stock_data = json_data['data']
                 klines_data = stock_data['klines']
                 klines = []
-                
+
                 for kline in klines_data:
                     # 解析每一条K线数据
                     (
@@ -81,19 +108,33 @@ class GetStockKline(scrapy.Spider):
                         'turnover_rate': float(turnover_rate)
                     })
 
-                if klines:
-                    # 创建DataFrame并保存为CSV文件
-                    df = pd.DataFrame(klines)
-                    file_name = f'data/klines/{stock_data["market"]}_{stock_data["code"]}_klines.csv'
-                    df.to_csv(
-                        file_name,
-                        index=False,
-                        encoding='utf-8-sig',
-                        float_format='%.2f'  # 保留2位小数
-                    )
-                    self.log(f'已保存{stock_code}的K线数据到{file_name}')
+                if anchor is not None:
+                    # 锚点价格变化说明复权因子变了，重新全量爬取该股票
+                    if not self.anchor_matches(anchor, klines):
+                        self.log(f'股票{stock_code}的复权价格发生变化，重新全量爬取')
+                        yield self.full_request(response.meta['market_type'], stock_code)
+                        return
+
+                    # 追加锚点之后的数据，旧的最后一天（盘中数据）会被新数据覆盖
+                    new_klines = [k for k in klines if k['date_time'] > anchor['date_time']]
+                    if new_klines:
+                        self.store.append(stock_code, pd.DataFrame(new_klines))
+                        self.log(f'已追加{stock_code}的{len(new_klines)}条K线数据')
+                elif klines:
+                    # 全量覆盖写入该股票的K线，存储记录重写标记，下次同步时整只股票重新导入数据库
+                    self.store.write(stock_code, pd.DataFrame(klines))
+                    self.log(f'已保存{stock_code}的K线数据到{self.store.path_of(stock_code)}')
             else:
                 self.log(f'股票{stock_code}没有K线数据')
-                
+
         except Exception as e:
             self.log(f'处理股票{stock_code}的数据时出错: {str(e)}')
+
+    @staticmethod
+    def anchor_matches(anchor, klines):
+        """检查返回数据中锚点日期的开盘价和收盘价是否与存储中的一致"""
+        for kline in klines:
+            if kline['date_time'] == anchor['date_time']:
+                return (abs(kline['open_price'] - anchor['open_price']) < PRICE_TOLERANCE and
+                        abs(kline['close_price'] - anchor['close_price']) < PRICE_TOLERANCE)
+        return False
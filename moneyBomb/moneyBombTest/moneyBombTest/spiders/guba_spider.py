@@ -1,6 +1,12 @@
+import os
+import sys
+
 import scrapy
 import pandas as pd
-from scrapy.selector import Selector
+
+# 将仓库根目录加入模块搜索路径，以便导入公共模块common
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', '..')))
+from common.guba_parser import parse_page  # noqa: E402
 
 
 class GubaSpider(scrapy.Spider):
@@ -17,34 +23,31 @@ class GubaSpider(scrapy.Spider):
         """解析股吧页面内容"""
         print(f"正在解析页面: {response.url}")
 
-        # 解析股吧帖子内容
-        selector = Selector(response)
-        list_body = selector.xpath(
-            '//li[contains(@class, "defaultlist")]/table[contains(@class, "default_list")]/tbody/tr[contains(@class, "listitem")]')
+        # 解析股吧帖子内容，帖子和下一页链接在一次解析中取出
+        posts, next_page = parse_page(response.text)
 
         # 如果页面没有解析到内容，打印提示
-        if not list_body:
+        if not posts:
             print(f"未找到帖子内容: {response.url}")
         else:
-            print(f"找到 {len(list_body)} 个帖子")
+            print(f"找到 {len(posts)} 个帖子")
 
         # 存储每页解析的数据
         data = []
-        for item in list_body:
-            post_id = item.css('div.title > a::attr(href)').re_first(r'[0-9]+')
-            if not post_id:
+        for post in posts:
+            if not post.post_id:
                 print("未找到帖子ID，跳过该帖子")
                 continue  # 跳过没有找到ID的帖子
 
             data.append({
-                'id': post_id,
-                'read_count': item.css('div.read::text').get(),
-                'reply': item.css('div.reply::text').get(),
-                'title': item.css('div.title > a::text').get(),
-                'title_url': response.urljoin(item.css('div.title > a::attr(href)').get()),
-                'author': item.css('div.author > a::text').get(),
-                'author_url': response.urljoin(item.css('div.author > a::attr(href)').get()),
-                'update_time': item.xpath('.//div[contains(@class, "update")]/text()').get(),
+                'id': post.post_id,
+                'read_count': post.read,
+                'reply': post.reply,
+                'title': post.title,
+                'title_url': response.urljoin(post.href),
+                'author': post.author,
+                'author_url': response.urljoin(post.author_href) if post.author_href else None,
+                'update_time': post.update_time,
             })
 
         # 将数据添加到 DataFrame 中
@@ -56,7 +59,6 @@ class GubaSpider(scrapy.Spider):
         print(f"目前总共收集到 {len(self.data_frame)} 条帖子")
 
         # 获取下一页的链接并继续爬取
-        next_page = selector.xpath('//a[@class="page-next"]/@href').get()
         if next_page:
             print(f"发现下一页链接: {next_page}")
             yield scrapy.Request(url=response.urljoin(next_page), callback=self.parse)
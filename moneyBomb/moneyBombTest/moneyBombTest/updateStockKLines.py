@@ -1,101 +1,143 @@
-from sqlalchemy import create_engine, Table, MetaData, insert, delete
+from sqlalchemy import delete, select, func, bindparam, and_
 import pandas as pd
+import argparse
 import os
-from datetime import datetime
-
-def update_stock_klines():
-    print("开始更新K线数据...")
-    
-    # MySQL数据库连接配置
-    db_config = {
-        'user': 'root',
-        'password': '123456',
-        'host': '127.0.0.1',
-        'database': 'stocks',
-        'raise_on_warnings': True
-    }
-
-    # 建立MySQL连接
-    engine = create_engine(
-        f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}")
-
-    # 获取数据库元数据
-    metadata = MetaData()
-    metadata.reflect(bind=engine)
-
-    print("清空'stock_kline'表")
-    # 清空stock_kline表
-    stock_kline_table = Table('stock_kline', metadata, autoload_with=engine)
-    with engine.begin() as connection:
-        connection.execute(delete(stock_kline_table))
-    
-    # 读取klines目录下的所有K线数据文件
-    klines_dir = 'data/klines'
-    if not os.path.exists(klines_dir):
-        print(f"K线数据目录 {klines_dir} 不存在")
+import sys
+import time
+
+# 将仓库根目录加入模块搜索路径，以便导入公共模块common
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+from common.bulk_loader import dataframe_to_records, insert_records  # noqa: E402
+from common.db import get_engine, get_table, dispose_engine  # noqa: E402
+from common.kline_store import KlineStore  # noqa: E402
+
+# K线数据表的列
+KLINE_COLUMNS = ['stock_code', 'date_time', 'open_price', 'close_price', 'high_price', 'low_price', 'volume',
+                 'trade_value', 'amplitude', 'up_down_range', 'up_down_price', 'turnover_rate']
+# 累积多少行后写入一次数据库
+FLUSH_ROWS = 50000
+
+
+def get_high_water_marks(connection, stock_kline_table):
+    """查询每只股票已导入的最后一个交易日"""
+    stmt = select(stock_kline_table.c.stock_code, func.max(stock_kline_table.c.date_time)) \
+        .group_by(stock_kline_table.c.stock_code)
+    return {code: pd.Timestamp(last_date) for code, last_date in connection.execute(stmt)}
+
+
+def update_stock_klines(full=False):
+    """
+    更新K线数据
+
+    默认增量同步：每只股票只重新写入最后一个已导入交易日（当日K线可能仍在变化）及之后的数据，
+    存储中标记为历史已重写（复权因子变化）的股票删除全部旧数据后重新导入；
+    full=True时全量重建。两种模式都在一个事务内完成，同步期间表中始终保留旧数据。
+    """
+    print(f"开始{'全量' if full else '增量'}更新K线数据...")
+
+    # 从K线列式存储读取数据
+    store = KlineStore()
+    stock_codes = store.stock_codes()
+    if not stock_codes:
+        print(f"K线数据目录 {store.root} 中没有数据")
         return
-        
-    # 使用���量插入来提高性能
-    batch_size = 1000  # 每批处理的记录数
+
+    # 在读取数据之前取得重写标记，同步期间又被重写的股票下次同步时再重新导入
+    rewritten = store.rewritten()
+    # 本次已经整只重新导入的股票的标记，事务提交后清除
+    synced_markers = {}
+
+    engine = get_engine()
+    stock_kline_table = get_table('stock_kline')
+    start = time.perf_counter()
     total_records = 0
-    
+
     try:
         with engine.begin() as connection:
-            for filename in os.listdir(klines_dir):
-                if filename.endswith('_klines.csv'):
-                    file_path = os.path.join(klines_dir, filename)
-                    print(f"正在处理文件: {filename}")
-                    
-                    try:
-                        # 读取CSV文件，确保stock_code作为字符串读取
-                        df = pd.read_csv(file_path, dtype={'stock_code': str})
-                        
-                        # 将date_time列转换为datetime格式
-                        df['date_time'] = pd.to_datetime(df['date_time'])
-                        
-                        # 批量处理数据
-                        records = df.to_dict('records')
-                        batch = []
-                        
-                        for record in records:
-                            batch.append({
-                                'stock_code': record['stock_code'],
-                                'date_time': record['date_time'].date(),
-                                'open_price': record['open_price'],
-                                'close_price': record['close_price'],
-                                'high_price': record['high_price'],
-                                'low_price': record['low_price'],
-                                'volume': record['volume'],
-                                'trade_value': record['trade_value'],
-                                'amplitude': record['amplitude'],
-                                'up_down_range': record['up_down_range'],
-                                'up_down_price': record['up_down_price'],
-                                'turnover_rate': record['turnover_rate']
-                            })
-                            
-                            # 当batch达到指定大小时执行插入
-                            if len(batch) >= batch_size:
-                                connection.execute(insert(stock_kline_table), batch)
-                                total_records += len(batch)
-                                print(f"已处理 {total_records} 条记录")
-                                batch = []
-                        
-                        # 处理剩余的记录
-                        if batch:
-                            connection.execute(insert(stock_kline_table), batch)
-                            total_records += len(batch)
-                            print(f"已处理 {total_records} 条记录")
-                            
-                    except Exception as e:
-                        print(f"处理文件 {filename} 时出错: {str(e)}")
-                        continue
-                        
-        print(f"K线数据导入完成，共导入 {total_records} 条记录")
-        
+            if full:
+                print("重建'stock_kline'表")
+                connection.execute(delete(stock_kline_table))
+                high_water_marks = {}
+            else:
+                high_water_marks = get_high_water_marks(connection, stock_kline_table)
+                print(f"已有{len(high_water_marks)}只股票的K线数据，{len(rewritten)}只股票的历史已重写")
+
+            frames = []
+            pending_rows = 0
+            # 需要删除旧数据的(股票代码, 起始日期)
+            stale_ranges = []
+            # 需要删除全部旧数据的股票代码
+            stale_codes = []
+
+            def flush():
+                """先删除待替换的旧数据，再批量写入累积的新数据"""
+                nonlocal frames, pending_rows, stale_ranges, stale_codes, total_records
+                if stale_codes:
+                    stmt = delete(stock_kline_table).where(stock_kline_table.c.stock_code == bindparam('code'))
+                    connection.execute(stmt, stale_codes)
+                if stale_ranges:
+                    stmt = delete(stock_kline_table).where(and_(
+                        stock_kline_table.c.stock_code == bindparam('code'),
+                        stock_kline_table.c.date_time >= bindparam('since')))
+                    connection.execute(stmt, stale_ranges)
+                if frames:
+                    new_rows = pd.concat(frames, ignore_index=True)
+                    new_rows['date_time'] = new_rows['date_time'].dt.date
+                    # 存储中的价格为float32，转为float64并舍入以免写入多余的尾数
+                    float_columns = new_rows.select_dtypes('float32').columns
+                    new_rows[float_columns] = new_rows[float_columns].astype('float64').round(4)
+                    records = dataframe_to_records(new_rows, KLINE_COLUMNS)
+                    insert_records(connection, stock_kline_table, records)
+                    total_records += len(records)
+                    print(f"已处理 {total_records} 条记录")
+                frames, pending_rows, stale_ranges, stale_codes = [], 0, [], []
+
+            for stock_code in stock_codes:
+                last_date = high_water_marks.get(stock_code)
+                reload = stock_code in rewritten
+                if reload:
+                    last_date = None
+                try:
+                    # 只读取最后一个已导入交易日及之后的数据
+                    df = store.read_df(stock_code, columns=KLINE_COLUMNS, start=last_date)
+                except Exception as e:
+                    print(f"读取股票 {stock_code} 的K线数据时出错: {str(e)}")
+                    continue
+                if df is None:
+                    continue
+
+                if reload:
+                    synced_markers[stock_code] = rewritten[stock_code]
+                    if not full:
+                        stale_codes.append({'code': stock_code})
+                elif last_date is not None:
+                    stale_ranges.append({'code': stock_code, 'since': last_date.date()})
+                if not df.empty:
+                    frames.append(df)
+                    pending_rows += len(df)
+
+                if pending_rows >= FLUSH_ROWS:
+                    flush()
+            flush()
+
+        for stock_code, marker in synced_markers.items():
+            store.clear_rewritten(stock_code, marker)
+
+        elapsed = time.perf_counter() - start
+        rate = total_records / elapsed if elapsed > 0 else float('inf')
+        print(f"K线数据导入完成，共导入 {total_records} 条记录, 耗时{elapsed:.2f}秒, {rate:.0f}条/秒")
+
     except Exception as e:
+        # 继续抛出，调度器据此记录任务失败
         print(f"更新K线数据时发生错误: {str(e)}")
-    finally:
-        engine.dispose()
+        raise
+
 
 if __name__ == '__main__':
-    update_stock_klines() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='将K线列式存储中的数据同步到stock_kline表')
+    parser.add_argument('--full', action='store_true', help='全量重建stock_kline表')
+    args = parser.parse_args()
+    try:
+        update_stock_klines(full=args.full)
+    finally:
+        dispose_engine()
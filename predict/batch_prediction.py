@@ -0,0 +1,212 @@
+"""
+多股票批量预测
+
+把股票列表分片到进程池中并行预测，每个工作进程固定TensorFlow线程数，
+并在初始化时创建一次LLM服务（日志、回答缓存和K线存储）供该进程预测的所有股票共用；
+每只股票预测完后清除Keras的全局状态，工作进程的内存不会随股票数增长。
+每完成一只股票就写入一行检查点，中断后重新运行会跳过已完成的股票。
+
+用法：
+    python batch_prediction.py --codes 601360 000001
+    python batch_prediction.py --all --workers 4 --tf-threads 2
+    python batch_prediction.py --all --restart   # 忽略检查点重新预测全部股票
+"""
+import argparse
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+# 将仓库根目录加入模块搜索路径，以便导入公共模块common
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.db import get_stock_codes  # noqa: E402
+
+# 检查点文件，每行一个JSON记录
+CHECKPOINT_FILE = os.path.join(os.path.dirname(__file__), 'checkpoints', 'batch_prediction.jsonl')
+
+
+def setup_logger():
+    """配置日志"""
+    log_dir = os.path.join(os.path.dirname(__file__), 'logs')
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+
+    log_file = os.path.join(log_dir, f'batch_prediction_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log')
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        handlers=[
+            logging.FileHandler(log_file, encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+
+    return logging.getLogger(__name__)
+
+
+# ---------- 工作进程 ----------
+
+_worker_logger = None
+_worker_llm_service = None
+
+
+def init_worker(tf_threads):
+    """工作进程初始化：在导入TensorFlow之前固定线程数，避免多个进程争抢CPU"""
+    global _worker_logger, _worker_llm_service
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(tf_threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(tf_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    logging.basicConfig(level=logging.INFO, format=f'%(asctime)s [%(levelname)s] [pid {os.getpid()}] %(message)s')
+    _worker_logger = logging.getLogger(__name__)
+
+    # LLM服务在进程内复用，不再为每只股票新建日志文件、缓存连接和K线存储
+    from llm.llm import LLMPredictionService
+    _worker_llm_service = LLMPredictionService()
+
+
+def predict_stock(stock_code):
+    """在工作进程中预测一只股票，返回结果摘要"""
+    # 工作进程中才导入TensorFlow相关模块
+    import tensorflow as tf
+    from run_prediction import get_kline_data
+    from stock_prediction_service import StockPredictionService
+
+    logger = _worker_logger or logging.getLogger(__name__)
+    start = time.perf_counter()
+    result = {'stock_code': stock_code, 'pid': os.getpid()}
+    try:
+        kline_data = get_kline_data(stock_code, logger)
+        if kline_data is None or kline_data.empty:
+            result.update(status='skipped', reason='没有K线数据', rows=0)
+        else:
+            service = StockPredictionService(kline_data, llm_service=_worker_llm_service)
+            results = service.run_predictions(stock_code)
+            result.update(status='done', rows=len(kline_data), metrics=results['metrics'])
+    except Exception as e:
+        logger.error(f"预测股票{stock_code}时出错: {e}", exc_info=True)
+        result.update(status='failed', reason=str(e))
+    finally:
+        # 释放这只股票的模型和计算图，否则每只股票新建的模型会一直留在Keras的全局状态中
+        service = None
+        tf.keras.backend.clear_session()
+        gc.collect()
+    result['elapsed'] = time.perf_counter() - start
+    return result
+
+
+# ---------- 检查点 ----------
+
+def load_finished(checkpoint_file):
+    """读取检查点中已完成（或无数据跳过）的股票"""
+    finished = set()
+    if not os.path.exists(checkpoint_file):
+        return finished
+    with open(checkpoint_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 进程被中断时最后一行可能没有写完
+                continue
+            if record.get('status') in ('done', 'skipped'):
+                finished.add(record['stock_code'])
+    return finished
+
+
+def append_checkpoint(checkpoint_file, record):
+    with open(checkpoint_file, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False, default=float) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# ---------- 调度 ----------
+
+def run_batch(stock_codes, workers, tf_threads, checkpoint_file=CHECKPOINT_FILE, restart=False, logger=None):
+    """并行预测股票列表，返回每只股票的结果摘要"""
+    logger = logger or logging.getLogger(__name__)
+    os.makedirs(os.path.dirname(checkpoint_file), exist_ok=True)
+    if restart and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+
+    finished = load_finished(checkpoint_file)
+    pending = [code for code in dict.fromkeys(stock_codes) if code not in finished]
+    logger.info(f"共{len(stock_codes)}只股票，检查点中已完成{len(stock_codes) - len(pending)}只，"
+                f"待预测{len(pending)}只，{workers}个进程，每个进程{tf_threads}个TensorFlow线程")
+    if not pending:
+        return []
+
+    results = []
+    start = time.perf_counter()
+    # TensorFlow不支持fork，使用spawn启动工作进程
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=init_worker, initargs=(tf_threads,)) as executor:
+        futures = {executor.submit(predict_stock, code): code for code in pending}
+        for future in as_completed(futures):
+            code = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # 工作进程异常退出
+                result = {'stock_code': code, 'status': 'failed', 'reason': str(e), 'elapsed': 0.0}
+            result['finished_at'] = datetime.now().isoformat()
+            append_checkpoint(checkpoint_file, result)
+            results.append(result)
+
+            elapsed = time.perf_counter() - start
+            rate = len(results) / elapsed * 60 if elapsed > 0 else 0.0
+            rows_rate = result.get('rows', 0) / result['elapsed'] if result['elapsed'] > 0 else 0.0
+            logger.info(f"[{len(results)}/{len(pending)}] 股票{code} {result['status']}，"
+                        f"耗时{result['elapsed']:.1f}秒（{rows_rate:.0f}条K线/秒），"
+                        f"总体{rate:.2f}只/分钟")
+
+    report_throughput(results, time.perf_counter() - start, logger)
+    return results
+
+
+def report_throughput(results, elapsed, logger):
+    """输出总体吞吐量"""
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    stock_seconds = sum(result['elapsed'] for result in results)
+    logger.info(f"批量预测结束：完成{counts.get('done', 0)}只，跳过{counts.get('skipped', 0)}只，"
+                f"失败{counts.get('failed', 0)}只")
+    if results and elapsed > 0:
+        logger.info(f"总耗时{elapsed:.1f}秒，吞吐量{len(results) / elapsed * 60:.2f}只/分钟，"
+                    f"单只平均{stock_seconds / len(results):.1f}秒，并行加速{stock_seconds / elapsed:.2f}倍")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多股票批量预测')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--codes', nargs='+', help='股票代码列表')
+    group.add_argument('--all', action='store_true', help='预测stock_info中的全部股票')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2), help='工作进程数')
+    parser.add_argument('--tf-threads', type=int, default=2, help='每个工作进程的TensorFlow线程数')
+    parser.add_argument('--checkpoint', default=CHECKPOINT_FILE, help='检查点文件')
+    parser.add_argument('--restart', action='store_true', help='忽略检查点，重新预测全部股票')
+    args = parser.parse_args()
+
+    logger = setup_logger()
+    stock_codes = get_stock_codes() if args.all else args.codes
+    if not stock_codes:
+        logger.error("没有获取到股票代码")
+        return
+    run_batch(stock_codes, args.workers, args.tf_threads, args.checkpoint, args.restart, logger)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,11 @@ from sklearn.preprocessing import MinMaxScaler
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Conv1D, MaxPooling1D, Flatten, Dense, Dropout, Activation, Input
 from tensorflow.keras.optimizers import Adam
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from window_dataset import make_windows  # noqa: E402
 
 # 加载CSV数据
 data = pd.read_csv('../lstm/1_601360_klines.csv')
@@ -17,14 +22,11 @@ x0 = data[['close']].values
 scaler = MinMaxScaler(feature_range=(0, 1))
 x0 = scaler.fit_transform(x0)
 
-# 创建数据集
-n = len(x0)
+# 创建数据集，窗口是x0的视图，不复制数据
 p = 30  # 时间步长窗口
-x = np.array([x0[i:i+p] for i in range(n-p+1)])
-y = np.array(x0[p:])
+X, y = make_windows(x0, p)
 
 # 对输入数据进行调整，符合 CNN 的输入要求
-X = x[:-1]
 X = X[:, :, np.newaxis]
 
 # 拆分训练集和测试集
@@ -0,0 +1,267 @@
+"""
+技术指标特征
+
+对按(stock_code, date_time)排序的K线宽表做一次groupby滚动计算，全市场的股票一起算，
+不按股票循环。计算结果按股票缓存为Arrow文件，K线数据没有变化时直接读取缓存。
+
+用法：
+    python features.py --all     # 从K线列式存储读取全市场K线，计算并缓存全部股票的特征
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# 将仓库根目录加入模块搜索路径，以便导入公共模块common
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.kline_store import KlineStore  # noqa: E402
+
+# 默认缓存目录，可以通过环境变量SCAS_FEATURE_CACHE覆盖
+DEFAULT_CACHE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'feature_cache')
+
+# 模型输入的特征列，第0列收盘价是预测目标
+FEATURE_COLUMNS = [
+    'close_price',
+    'log_return',     # 对数收益率
+    'volatility_20',  # 20日收益率波动率
+    'ma5_ratio',      # 收盘价相对5日均线的偏离
+    'ma20_ratio',     # 收盘价相对20日均线的偏离
+    'rsi_14',         # 14日RSI，缩放到0-1
+    'macd',           # MACD(12, 26)，除以收盘价
+    'macd_signal',    # MACD的9日信号线
+    'volume_z_20',    # 成交量相对20日均值的z分数
+    'hl_range',       # (最高价 - 最低价) / 收盘价
+    'turnover_rate',  # 换手率
+]
+# 计算特征需要的K线列
+KLINE_COLUMNS = ['stock_code', 'date_time', 'close_price', 'high_price', 'low_price', 'volume', 'turnover_rate']
+
+
+def _indicators(klines):
+    """计算技术指标，保留EMA和RSI平滑值等中间列，返回按(stock_code, date_time)排序的全部行"""
+    df = klines.copy()
+    if 'stock_code' not in df.columns:
+        df['stock_code'] = ''
+    if 'turnover_rate' not in df.columns:
+        df['turnover_rate'] = 0.0
+    df['date_time'] = pd.to_datetime(df['date_time'])
+    df = df.sort_values(['stock_code', 'date_time'], kind='stable').reset_index(drop=True)
+    for column in ('close_price', 'high_price', 'low_price', 'volume', 'turnover_rate'):
+        df[column] = df[column].astype(np.float64)
+
+    g = df.groupby('stock_code', sort=False)
+
+    def rolling(column, window, func):
+        result = getattr(g[column].rolling(window, min_periods=window), func)()
+        return result.reset_index(level=0, drop=True)
+
+    def ewm(column, **kwargs):
+        return g[column].ewm(adjust=False, **kwargs).mean().reset_index(level=0, drop=True)
+
+    # 收益率与波动率
+    df['log_close'] = np.log(df['close_price'])
+    df['log_return'] = g['log_close'].diff()
+    df['volatility_20'] = rolling('log_return', 20, 'std')
+
+    # 均线偏离
+    df['ma5_ratio'] = df['close_price'] / rolling('close_price', 5, 'mean') - 1
+    df['ma20_ratio'] = df['close_price'] / rolling('close_price', 20, 'mean') - 1
+
+    # RSI，使用Wilder平滑
+    df['price_change'] = g['close_price'].diff()
+    df['gain'] = df['price_change'].clip(lower=0)
+    df['loss'] = (-df['price_change']).clip(lower=0)
+    df['avg_gain'] = avg_gain = ewm('gain', alpha=1 / 14)
+    df['avg_loss'] = avg_loss = ewm('loss', alpha=1 / 14)
+    df['rsi_14'] = (avg_gain / (avg_gain + avg_loss)).fillna(0.5)
+    df.loc[g.cumcount() < 14, 'rsi_14'] = np.nan
+
+    # MACD，除以收盘价后不同价位的股票可比
+    df['ema_12'] = ewm('close_price', span=12)
+    df['ema_26'] = ewm('close_price', span=26)
+    df['macd'] = (df['ema_12'] - df['ema_26']) / df['close_price']
+    df['macd_signal'] = ewm('macd', span=9)
+    df.loc[g.cumcount() < 26, ['macd', 'macd_signal']] = np.nan
+
+    # 成交量z分数
+    volume_std = rolling('volume', 20, 'std')
+    df['volume_z_20'] = ((df['volume'] - rolling('volume', 20, 'mean')) / volume_std.replace(0, np.nan)).fillna(0)
+    df.loc[volume_std.isna(), 'volume_z_20'] = np.nan
+
+    df['hl_range'] = (df['high_price'] - df['low_price']) / df['close_price']
+    return df
+
+
+def compute_features(klines):
+    """
+    计算技术指标特征
+
+    klines为一只或多只股票的K线，至少包含KLINE_COLUMNS中除stock_code外的列；
+    返回按(stock_code, date_time)排序、去掉指标预热期（含NaN）行的DataFrame，
+    列为stock_code、date_time和FEATURE_COLUMNS。
+    """
+    features = _indicators(klines)[['stock_code', 'date_time'] + FEATURE_COLUMNS]
+    features = features.replace([np.inf, -np.inf], np.nan).dropna(subset=FEATURE_COLUMNS)
+    return features.reset_index(drop=True)
+
+
+class FeatureRoller:
+    """
+    滚动预测时由预测的收盘价递推新一天的特征
+
+    收益率、波动率、均线偏离、RSI和MACD按预测的收盘价路径逐日重新计算，公式与compute_features一致；
+    成交量z分数、振幅和换手率无法由收盘价推出，沿用最近一天的值。
+    状态按batch向量化，batch中的每一行是一只股票（或一个情景）。
+    """
+
+    # 反归一化后的收盘价下限，避免取对数时出现非正数
+    MIN_PRICE = 1e-4
+
+    def __init__(self, klines, scalers, columns=FEATURE_COLUMNS):
+        """klines和scalers为一只股票的K线和训练模型时的归一化器，或者它们的列表（与batch的行一一对应）"""
+        if isinstance(klines, pd.DataFrame):
+            klines, scalers = [klines], [scalers]
+        self.columns = list(columns)
+        self.target = self.columns.index('close_price')
+        self.scale = np.stack([scaler.scale_ for scaler in scalers])
+        self.min = np.stack([scaler.min_ for scaler in scalers])
+
+        states = [_indicators(k.assign(stock_code='')) for k in klines]
+        self.closes = np.stack([df['close_price'].to_numpy()[-20:] for df in states])
+        self.returns = np.stack([df['log_return'].to_numpy()[-20:] for df in states])
+        last = pd.DataFrame([df.iloc[-1] for df in states])
+        self.ema_12 = last['ema_12'].to_numpy(dtype=np.float64)
+        self.ema_26 = last['ema_26'].to_numpy(dtype=np.float64)
+        self.macd_signal = last['macd_signal'].to_numpy(dtype=np.float64)
+        self.avg_gain = last['avg_gain'].to_numpy(dtype=np.float64)
+        self.avg_loss = last['avg_loss'].to_numpy(dtype=np.float64)
+
+    def step(self, close):
+        """追加一天的收盘价（原始价格），返回{特征列: (batch,)}"""
+        prev = self.closes[:, -1]
+        log_return = np.log(close) - np.log(prev)
+        self.closes = np.concatenate([self.closes[:, 1:], close[:, np.newaxis]], axis=1)
+        self.returns = np.concatenate([self.returns[:, 1:], log_return[:, np.newaxis]], axis=1)
+
+        change = close - prev
+        self.avg_gain = self.avg_gain + (np.maximum(change, 0) - self.avg_gain) / 14
+        self.avg_loss = self.avg_loss + (np.maximum(-change, 0) - self.avg_loss) / 14
+        total = self.avg_gain + self.avg_loss
+        rsi = np.divide(self.avg_gain, total, out=np.full_like(total, 0.5), where=total > 0)
+
+        self.ema_12 = self.ema_12 + (close - self.ema_12) * (2 / 13)
+        self.ema_26 = self.ema_26 + (close - self.ema_26) * (2 / 27)
+        macd = (self.ema_12 - self.ema_26) / close
+        self.macd_signal = self.macd_signal + (macd - self.macd_signal) * (2 / 10)
+
+        return {
+            'log_return': log_return,
+            'volatility_20': self.returns.std(axis=1, ddof=1),
+            'ma5_ratio': close / self.closes[:, -5:].mean(axis=1) - 1,
+            'ma20_ratio': close / self.closes.mean(axis=1) - 1,
+            'rsi_14': rsi,
+            'macd': macd,
+            'macd_signal': self.macd_signal,
+        }
+
+    def __call__(self, rows, predictions):
+        """
+        供RolloutEngine调用：rows为复制自最近一天、目标列已替换为预测值的归一化特征行(batch, n_features)，
+        predictions为归一化的预测收盘价(batch,)；原地更新可以由收盘价推出的特征列后返回rows
+        """
+        t = self.target
+        close = (predictions.astype(np.float64) - self.min[:, t]) / self.scale[:, t]
+        for name, values in self.step(np.maximum(close, self.MIN_PRICE)).items():
+            if name in self.columns:
+                j = self.columns.index(name)
+                rows[:, j] = values * self.scale[:, j] + self.min[:, j]
+        return rows
+
+
+def source_hash(klines):
+    """K线数据的指纹，用于判断缓存是否过期"""
+    klines = klines.sort_values('date_time', kind='stable')
+    h = hashlib.sha256()
+    for column in ('close_price', 'high_price', 'low_price', 'volume', 'turnover_rate'):
+        if column in klines.columns:
+            h.update(np.ascontiguousarray(klines[column].to_numpy(dtype=np.float64)).tobytes())
+    h.update(pd.to_datetime(klines['date_time']).to_numpy(dtype='datetime64[D]').tobytes())
+    return h.hexdigest()
+
+
+class FeatureCache:
+    """按股票缓存特征矩阵：{root}/{stock_code}.arrow，schema元数据中记录K线指纹"""
+
+    def __init__(self, root=None):
+        self.root = os.path.abspath(root or os.environ.get('SCAS_FEATURE_CACHE', DEFAULT_CACHE_ROOT))
+
+    def path_of(self, stock_code):
+        return os.path.join(self.root, f'{stock_code}.arrow')
+
+    def read(self, stock_code, expected_hash=None):
+        """读取缓存的特征，不存在或指纹不一致时返回None"""
+        path = self.path_of(stock_code)
+        if not os.path.exists(path):
+            return None
+        table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        metadata = table.schema.metadata or {}
+        if expected_hash is not None and metadata.get(b'source_hash', b'').decode() != expected_hash:
+            return None
+        return table.to_pandas(date_as_object=False)
+
+    def write(self, stock_code, features, hash_value):
+        os.makedirs(self.root, exist_ok=True)
+        table = pa.Table.from_pandas(features, preserve_index=False)
+        table = table.replace_schema_metadata({'source_hash': hash_value})
+        tmp_path = os.path.join(self.root, f'.{stock_code}.arrow.tmp')
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, self.path_of(stock_code))
+
+    def get(self, stock_code, klines):
+        """读取一只股票的特征，缓存过期时重新计算并写入缓存"""
+        hash_value = source_hash(klines)
+        features = self.read(stock_code, hash_value)
+        if features is None:
+            features = compute_features(klines.assign(stock_code=str(stock_code)))
+            self.write(stock_code, features, hash_value)
+        return features
+
+    def build_all(self, store=None):
+        """一次计算全市场的特征并按股票写入缓存，返回股票数量"""
+        store = store or KlineStore()
+        start = time.perf_counter()
+        klines = store.scan(columns=KLINE_COLUMNS).to_pandas(date_as_object=False)
+        klines['stock_code'] = klines['stock_code'].astype(str)
+        loaded = time.perf_counter()
+
+        features = compute_features(klines)
+        computed = time.perf_counter()
+
+        klines = klines.sort_values(['stock_code', 'date_time'], kind='stable')
+        feature_groups = dict(tuple(features.groupby('stock_code', sort=False)))
+        count = 0
+        for stock_code, stock_klines in klines.groupby('stock_code', sort=False):
+            stock_features = feature_groups.get(stock_code)
+            if stock_features is None:
+                continue
+            self.write(stock_code, stock_features.reset_index(drop=True), source_hash(stock_klines))
+            count += 1
+        print(f"读取{len(klines)}条K线耗时{loaded - start:.2f}秒，计算特征耗时{computed - loaded:.2f}秒，"
+              f"写入{count}只股票的缓存耗时{time.perf_counter() - computed:.2f}秒")
+        return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='计算并缓存技术指标特征')
+    parser.add_argument('--all', action='store_true', help='计算K线列式存储中全部股票的特征')
+    parser.add_argument('--cache', help='缓存目录，默认读取SCAS_FEATURE_CACHE环境变量')
+    args = parser.parse_args()
+    if args.all:
+        FeatureCache(args.cache).build_all()
@@ -1,14 +1,30 @@
 import pandas as pd
 import numpy as np
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from sklearn.preprocessing import MinMaxScaler
 import logging
 from datetime import datetime, timedelta
 import os
 import json
-import aiohttp
 import asyncio
-import calendar
+import sys
+
+# 将仓库根目录加入模块搜索路径，以便导入公共模块common
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from common.db import get_engine  # noqa: E402
+from common.kline_store import KlineStore  # noqa: E402
+
+# 评论存储在comment-analysis目录中
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'comment-analysis')))
+from comment_store import CommentStore  # noqa: E402
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from ollama_client import OllamaBatchClient, summarize  # noqa: E402
+from stream_parser import PredictionStreamParser, StreamParseError  # noqa: E402
+from response_cache import ResponseCache, make_key  # noqa: E402
+
+# 对齐后的预测结果：日期、价格和模型给出的置信度（模型没有给出时为NaN）
+PREDICTION_DTYPE = np.dtype([('date', 'datetime64[D]'), ('price', np.float64), ('confidence', np.float64)])
 
 class LLMPredictionService:
     def __init__(self):
@@ -20,6 +36,11 @@ class LLMPredictionService:
         self.scaler_price = MinMaxScaler(feature_range=(0, 1))
         self.scaler_sentiment = MinMaxScaler(feature_range=(0, 1))
         self.ollama_url = "http://localhost:11434/api/chat"
+        self.ollama_model = "llama3.2"
+        self.ollama_concurrency = 4  # 批量预测时同时进行的请求数
+        self.ollama_stream = True  # 流式接收回答，边接收边解析
+        self.kline_store = KlineStore()
+        self.response_cache = ResponseCache()  # 相同模型和提示词的回答直接复用解析结果
         
     def setup_logger(self):
         """配置日志"""
@@ -41,21 +62,24 @@ class LLMPredictionService:
         self.logger = logging.getLogger(__name__)
         
     def setup_database(self):
-        """设置数据库连接"""
-        db_config = {
-            'user': 'root',
-            'password': '123456',
-            'host': '127.0.0.1',
-            'database': 'stocks'
-        }
-        
-        self.engine = create_engine(
-            f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}"
-        )
+        """设置数据库连接，使用进程内共享的连接池"""
+        self.engine = get_engine()
 
     def get_kline_data(self, stock_code, start_date=None, end_date=None):
-        """从数据库获取K线数据"""
+        """获取K线数据，优先读取K线列式存储，没有数据时从数据库读取"""
         try:
+            df = self.kline_store.read_df(
+                stock_code,
+                columns=['date_time', 'open_price', 'high_price', 'low_price', 'close_price', 'volume',
+                         'trade_value'],
+                start=start_date,
+                end=end_date
+            )
+            if df is not None:
+                df.set_index('date_time', inplace=True)
+                self.logger.info(f"从K线存储获取股票{stock_code}的K线数据：{len(df)}条记录")
+                return df
+
             query = """
                 SELECT 
                     date_time,
@@ -94,46 +118,16 @@ class LLMPredictionService:
             return None
             
     def get_sentiment_data(self, stock_code):
-        """读取情感分析数据"""
+        """从评论存储读取按日汇总的情感数据，日期使用清洗阶段推断出的评论时间"""
         try:
-            # 读取CSV文件
-            sentiment_file = os.path.join(os.path.dirname(__file__), f'emotionRating_{stock_code}.csv')
-            df = pd.read_csv(sentiment_file)
-            
-            # 转换时间格式
-            def parse_date(date_str):
-                """解析日期字符串，添加当前年份"""
-                try:
-                    # 提取月和日
-                    month, rest = date_str.split('-')
-                    day = rest.split()[0]
-                    
-                    # 获取当前年份
-                    current_year = datetime.now().year - 1
-                    
-                    # 处理2月29日的情况
-                    if month == '02' and day == '29':
-                        if not calendar.isleap(current_year):
-                            day = '28'  # 非闰年改为28日
-                    
-                    # 构建完整日期字符串
-                    full_date_str = f"{current_year}-{month}-{day}"
-                    return pd.to_datetime(full_date_str).date()  # 只保留日期部分
-                    
-                except Exception as e:
-                    self.logger.warning(f"无法解析日期 {date_str}: {e}")
-                    return None
-            
-            # 应用日期解析
-            df['date'] = df['update_time'].apply(parse_date)
-            
-            # 过滤掉无效的日期
-            df = df[df['date'].notna()]
-            
-            # 按日期聚合情感得分
-            daily_sentiment = df.groupby('date').agg({
-                'sentiment': ['mean', 'count']  # 计算平均情感分数和评论数量
-            }).reset_index()
+            store = CommentStore()
+            try:
+                daily_sentiment = store.daily_sentiment(stock_code)
+            finally:
+                store.close()
+            if daily_sentiment.empty:
+                self.logger.error(f"评论存储中没有股票{stock_code}的情感数据")
+                return None
             
             daily_sentiment.columns = ['date', 'sentiment_mean', 'comment_count']
             daily_sentiment['date'] = pd.to_datetime(daily_sentiment['date'])
@@ -141,7 +135,7 @@ class LLMPredictionService:
             
             # 打印一些统计信息
             self.logger.info(f"情感数据统计:")
-            self.logger.info(f"总评论数: {len(df)}")
+            self.logger.info(f"总评论数: {int(daily_sentiment['comment_count'].sum())}")
             self.logger.info(f"日期范围: {daily_sentiment.index.min()} 到 {daily_sentiment.index.max()}")
             self.logger.info(f"每日平均评论数: {daily_sentiment['comment_count'].mean():.2f}")
             
@@ -197,35 +191,58 @@ class LLMPredictionService:
 """
         return prompt
 
-    async def predict_with_ollama(self, messages):
-        """使用ollama进行预测"""
+    def create_ollama_client(self, concurrency=1):
+        """创建Ollama批量客户端，需要在事件循环中使用"""
+        return OllamaBatchClient(self.ollama_url, self.ollama_model, concurrency=concurrency)
+
+    async def predict_with_ollama(self, messages, client=None):
+        """使用ollama进行预测，传入client时复用其会话和连接池"""
+        if client is None:
+            async with self.create_ollama_client() as client:
+                return await self.predict_with_ollama(messages, client)
+
+        result = await client.chat(messages)
+        if not result.ok:
+            self.logger.error(f"调用Ollama API时出错: {result.error}")
+            return None
+        self.logger.info(f"Ollama请求完成: 排队{result.queue_wait:.2f}秒, 耗时{result.elapsed:.2f}秒, "
+                         f"{result.tokens_per_sec:.1f} tokens/秒")
+        return result.response
+
+    async def predict_with_ollama_stream(self, messages, client=None):
+        """
+        以流式模式使用ollama进行预测，边接收边解析，输出格式错误时立即中止
+        
+        返回与解析完整JSON相同结构的字典，失败时返回None
+        """
+        if client is None:
+            async with self.create_ollama_client() as client:
+                return await self.predict_with_ollama_stream(messages, client)
+
+        parser = PredictionStreamParser()
+        result = await client.stream_chat(messages, parser.feed)
+        if isinstance(result.error, StreamParseError):
+            self.logger.error(f"模型输出格式错误，已中止: {result.error}")
+            return None
+        if not result.ok:
+            self.logger.error(f"调用Ollama API时出错: {result.error}")
+            return None
+        self.logger.info(f"Ollama流式请求完成: 排队{result.queue_wait:.2f}秒, 首段内容{result.first_token or 0:.2f}秒, "
+                         f"耗时{result.elapsed:.2f}秒, {result.tokens_per_sec:.1f} tokens/秒, "
+                         f"收到{len(parser.predictions)}条预测")
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    self.ollama_url,
-                    json={
-                        "model": "llama3.2",
-                        "messages": messages,
-                        "stream": False
-                    },
-                    headers={
-                        'Content-Type': 'application/json'
-                    }
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        self.logger.error(f"Ollama API错误响应: {error_text}")
-                        raise Exception(f"Ollama API返回错误: {response.status}")
-                    
-                    result = await response.json()
-                    return result
-                    
-        except Exception as e:
-            self.logger.error(f"调用Ollama API时出错: {e}", exc_info=True)
+            return parser.result()
+        except StreamParseError as e:
+            self.logger.error(f"模型输出格式错误: {e}")
             return None
 
     def parse_prediction_response(self, response):
         """解析预测响应"""
+        result = self.extract_prediction_json(response)
+        return self.align_predictions(result) if result is not None else None
+
+    def extract_prediction_json(self, response):
+        """从非流式响应中提取预测JSON，返回与流式解析器相同结构的字典"""
         try:
             if not response or 'message' not in response:
                 self.logger.error("无效的响应格式")
@@ -254,96 +271,168 @@ class LLMPredictionService:
             json_str = re.sub(r'(\d{4}-\d{2}-\d{2})"', r'\1"', json_str)
             
             try:
-                result = json.loads(json_str)
+                return json.loads(json_str)
             except json.JSONDecodeError as e:
                 self.logger.error(f"JSON解析错误: {e}")
                 self.logger.error(f"JSON内容: {json_str}")
                 return None
             
+        except Exception as e:
+            self.logger.error(f"解析预测响应时出错: {e}", exc_info=True)
+            return None
+
+    def align_predictions(self, result):
+        """
+        把模型给出的预测对齐到未来90天，返回(预测数组, 分析, 影响因素)
+
+        预测数组为PREDICTION_DTYPE的结构化数组，每天一行；模型漏掉的日期沿用前一天的预测，
+        第一条预测之前的日期使用第一条预测
+        """
+        try:
             # 验证预测数据完整性
             if 'predictions' not in result or not result['predictions']:
                 self.logger.error("预测数据为空")
                 return None
-                
-            # 生成90天的预测数据
-            start_date = pd.Timestamp.now()
-            dates = []
-            prices = []
-            
-            # 如果预测数据不足90天，使用最后一天的预测补齐
-            last_price = None
-            for i in range(self.future_days):
-                target_date = start_date + pd.Timedelta(days=i+1)
-                
-                # 查找当天的预测
-                price_found = False
-                for pred in result['predictions']:
-                    pred_date = pd.to_datetime(pred['date'])
-                    if pred_date.date() == target_date.date():
-                        prices.append(pred['price'])
-                        dates.append(target_date)
-                        last_price = pred['price']
-                        price_found = True
-                        break
-                
-                if not price_found and last_price is not None:
-                    # 使用最后一个有效预测
-                    prices.append(last_price)
-                    dates.append(target_date)
-            
-            if len(prices) < self.future_days:
-                self.logger.warning(f"预测数据不足90天，实际天数: {len(prices)}")
-                if len(prices) == 0:
-                    return None
-                
-                # 使用最后一个价格补齐到90天
-                last_price = prices[-1]
-                while len(prices) < self.future_days:
-                    next_date = dates[-1] + pd.Timedelta(days=1)
-                    prices.append(last_price)
-                    dates.append(next_date)
-            
-            return np.array(prices), dates, result.get('analysis', ''), result.get('factors', [])
+
+            raw = pd.DataFrame(result['predictions'])
+            if 'confidence' not in raw.columns:
+                raw['confidence'] = np.nan
+            # 一次解析全部日期，作为索引
+            raw = pd.DataFrame({
+                'price': pd.to_numeric(raw['price'], errors='coerce').to_numpy(),
+                'confidence': pd.to_numeric(raw['confidence'], errors='coerce').to_numpy(),
+            }, index=pd.DatetimeIndex(pd.to_datetime(raw['date'], errors='coerce')).normalize())
+            raw = raw[raw.index.notna() & raw['price'].notna()]
+            # 同一天有多条预测时取第一条
+            raw = raw[~raw.index.duplicated(keep='first')]
+
+            horizon = pd.date_range(pd.Timestamp.now().normalize() + pd.Timedelta(days=1),
+                                    periods=self.future_days, freq='D')
+            aligned = raw.reindex(horizon)
+            matched = int(aligned['price'].notna().sum())
+            if matched == 0:
+                self.logger.error("没有落在未来90天内的预测")
+                return None
+            if matched < self.future_days:
+                self.logger.warning(f"预测数据不足90天，实际天数: {matched}")
+                aligned = aligned.ffill().bfill()
+
+            forecast = np.empty(self.future_days, dtype=PREDICTION_DTYPE)
+            forecast['date'] = horizon.to_numpy(dtype='datetime64[D]')
+            forecast['price'] = aligned['price'].to_numpy(dtype=np.float64)
+            forecast['confidence'] = aligned['confidence'].to_numpy(dtype=np.float64)
+            return forecast, result.get('analysis', ''), result.get('factors', [])
             
         except Exception as e:
-            self.logger.error(f"解析预测响应时出错: {e}", exc_info=True)
+            self.logger.error(f"对齐预测数据时出错: {e}", exc_info=True)
             return None
 
-    async def predict_future(self, stock_code, kline_data, sentiment_data):
-        """预测未来价格"""
+    def build_messages(self, stock_code, kline_data, sentiment_data):
+        """构建对话消息"""
+        prompt = self.prepare_prompt(kline_data, sentiment_data, stock_code)
+        return [
+            {"role": "system", "content": "你是一个专业的股票分析师，精通技术分析和情感分析。"},
+            {"role": "user", "content": prompt}
+        ]
+
+    async def predict_future(self, stock_code, kline_data, sentiment_data, client=None, stream=None):
+        """预测未来价格，返回(预测数组, 分析, 影响因素)，stream默认取self.ollama_stream"""
         try:
-            # 准备提示词
-            prompt = self.prepare_prompt(kline_data, sentiment_data, stock_code)
-            
             # 构建消息
-            messages = [
-                {"role": "system", "content": "你是一个专业的股票分析师，精通技术分析和情感分析。"},
-                {"role": "user", "content": prompt}
-            ]
+            messages = self.build_messages(stock_code, kline_data, sentiment_data)
             
-            # 调用ollama
-            response = await self.predict_with_ollama(messages)
-            if response is None:
-                return None
+            cache_key = make_key(self.ollama_model, messages)
+            parsed = self.response_cache.get(cache_key)
+            cached = parsed is not None
+            if cached:
+                self.logger.info(f"股票{stock_code}命中回答缓存")
+            elif self.ollama_stream if stream is None else stream:
+                # 流式调用ollama，边接收边解析
+                parsed = await self.predict_with_ollama_stream(messages, client)
+            else:
+                # 调用ollama
+                response = await self.predict_with_ollama(messages, client)
+                if response is None:
+                    return None
                 
-            # 解析响应
-            result = self.parse_prediction_response(response)
+                # 解析响应
+                parsed = self.extract_prediction_json(response)
+            if parsed is None:
+                return None
+            result = self.align_predictions(parsed)
             if result is None:
                 return None
+            if not cached:
+                # 只缓存能对齐出有效预测的回答
+                self.response_cache.put(cache_key, parsed, self.ollama_model)
                 
-            predictions, dates, analysis, factors = result
+            forecast, analysis, factors = result
             
             self.logger.info("预测完成")
             self.logger.info(f"分析: {analysis}")
             self.logger.info(f"影响因素: {factors}")
             
-            return predictions, dates, analysis, factors
+            return forecast, analysis, factors
             
         except Exception as e:
             self.logger.error(f"预测未来价格时出错: {e}", exc_info=True)
             return None
 
-    def __del__(self):
-        """清理资源"""
-        if hasattr(self, 'engine'):
-            self.engine.dispose() 
\ No newline at end of file
+    async def predict_many(self, items, concurrency=None, stream=None):
+        """
+        并发预测多只股票，按完成顺序逐个返回(股票代码, 预测结果, 请求统计)
+
+        items为(stock_code, kline_data, sentiment_data)的列表，所有请求共用一个会话和连接池，
+        预测结果与predict_future相同，失败时为None
+        """
+        stream = self.ollama_stream if stream is None else stream
+        requests = []
+        cache_keys = {}
+        for stock_code, kline_data, sentiment_data in items:
+            messages = self.build_messages(stock_code, kline_data, sentiment_data)
+            cache_key = make_key(self.ollama_model, messages)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                # 命中缓存的股票不发送请求
+                try:
+                    parsed = self.align_predictions(cached)
+                except Exception as e:
+                    self.logger.error(f"股票{stock_code}的缓存回答处理失败: {e}", exc_info=True)
+                    parsed = None
+                yield stock_code, parsed, {'key': stock_code, 'ok': True, 'cached': True}
+                continue
+            cache_keys[stock_code] = cache_key
+            requests.append((stock_code, messages))
+        if not requests:
+            self.logger.info(f"全部{len(items)}只股票命中回答缓存")
+            return
+
+        # 流式模式下每只股票一个增量解析器
+        parsers = {}
+
+        def on_content_factory(key):
+            parsers[key] = PredictionStreamParser()
+            return parsers[key].feed
+
+        results = []
+        async with self.create_ollama_client(concurrency or self.ollama_concurrency) as client:
+            async for chat_result in client.run(requests, on_content_factory if stream else None):
+                results.append(chat_result)
+                stats = chat_result.stats()
+                self.logger.info(f"股票{chat_result.key}: {stats}")
+                # 失败的请求也取出解析器，不在批量预测期间一直占用
+                parser = parsers.pop(chat_result.key, None)
+                parsed = None
+                if chat_result.ok:
+                    # 单只股票的回答处理失败只记录日志，不中断其他股票
+                    try:
+                        result = parser.result() if stream else self.extract_prediction_json(chat_result.response)
+                        parsed = self.align_predictions(result) if result is not None else None
+                        if parsed is not None:
+                            self.response_cache.put(cache_keys[chat_result.key], result, self.ollama_model)
+                    except StreamParseError as e:
+                        self.logger.error(f"股票{chat_result.key}的模型输出格式错误: {e}")
+                    except Exception as e:
+                        self.logger.error(f"处理股票{chat_result.key}的预测结果时出错: {e}", exc_info=True)
+                yield chat_result.key, parsed, stats
+        self.logger.info(f"批量预测统计: {summarize(results)}, 回答缓存: {self.response_cache.stats()}")
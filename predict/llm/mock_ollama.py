@@ -0,0 +1,177 @@
+"""
+本地模拟Ollama服务
+
+实现/api/chat接口，返回格式与真实Ollama一致的90天预测JSON，支持stream模式的NDJSON分段输出，
+可以设置响应延迟、失败率和前几个请求固定失败，用于在没有GPU和模型的环境下测试批量客户端
+（test_ollama_client.py）。
+
+用法：
+    python mock_ollama.py --port 11435                 # 单独启动服务
+    python mock_ollama.py --demo 20 --concurrency 4    # 启动服务并用批量客户端发送20个请求
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import pandas as pd
+from aiohttp import web
+
+
+def build_content(days=90, base_price=10.0, seed=None):
+    """生成模型回答的文本内容"""
+    rng = random.Random(seed)
+    start = pd.Timestamp.now().normalize()
+    price = base_price
+    predictions = []
+    for i in range(days):
+        price = max(0.01, price * (1 + rng.gauss(0, 0.01)))
+        predictions.append({
+            'date': (start + pd.Timedelta(days=i + 1)).strftime('%Y-%m-%d'),
+            'price': round(price, 2),
+            'confidence': round(rng.uniform(0.5, 0.9), 2),
+        })
+    result = {
+        'predictions': predictions,
+        'analysis': '模拟分析：价格随机游走',
+        'factors': ['模拟因素1', '模拟因素2', '模拟因素3'],
+    }
+    return '以下是预测结果：\n' + json.dumps(result, ensure_ascii=False, indent=2)
+
+
+class MockOllamaServer:
+    def __init__(self, host='127.0.0.1', port=0, delay=0.05, fail_rate=0.0, days=90, fail_first=0):
+        self.host = host
+        self.port = port
+        self.delay = delay            # 每个请求的处理时间（秒）
+        self.fail_rate = fail_rate    # 返回503的概率
+        self.fail_first = fail_first  # 前几个请求固定返回503，用于测试重试
+        self.days = days
+        self.request_count = 0
+        self.in_flight = 0            # 正在处理的请求数
+        self.max_in_flight = 0        # 同时处理的最大请求数
+        self.runner = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/api/chat"
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/api/chat', self.handle_chat)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        # port=0时由系统分配端口
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle_chat(self, request):
+        self.request_count += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return await self.respond(request, self.request_count)
+        finally:
+            self.in_flight -= 1
+
+    async def respond(self, request, request_number):
+        payload = await request.json()
+        started = time.monotonic_ns()
+        await asyncio.sleep(self.delay)
+        if request_number <= self.fail_first or random.random() < self.fail_rate:
+            return web.Response(status=503, text='model is busy')
+
+        content = build_content(self.days, seed=request_number)
+        eval_count = len(content) // 2  # 粗略估计token数
+        if payload.get('stream', True):
+            return await self.stream_content(request, payload, content, eval_count, started)
+        return web.json_response({
+            'model': payload.get('model'),
+            'created_at': pd.Timestamp.now(tz='UTC').isoformat(),
+            'message': {'role': 'assistant', 'content': content},
+            'done': True,
+            'total_duration': time.monotonic_ns() - started,
+            'eval_count': eval_count,
+            'eval_duration': int(self.delay * 1e9),
+        })
+
+    async def stream_content(self, request, payload, content, eval_count, started, chunk_size=8):
+        """按Ollama的格式逐行输出NDJSON，每行一小段内容"""
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+        for i in range(0, len(content), chunk_size):
+            line = {
+                'model': payload.get('model'),
+                'created_at': pd.Timestamp.now(tz='UTC').isoformat(),
+                'message': {'role': 'assistant', 'content': content[i:i + chunk_size]},
+                'done': False,
+            }
+            await response.write((json.dumps(line, ensure_ascii=False) + '\n').encode('utf-8'))
+        await response.write((json.dumps({
+            'model': payload.get('model'),
+            'created_at': pd.Timestamp.now(tz='UTC').isoformat(),
+            'message': {'role': 'assistant', 'content': ''},
+            'done': True,
+            'total_duration': time.monotonic_ns() - started,
+            'eval_count': eval_count,
+            'eval_duration': int(self.delay * 1e9),
+        }) + '\n').encode('utf-8'))
+        await response.write_eof()
+        return response
+
+
+async def demo(n, concurrency, delay, fail_rate, stream=False):
+    """用批量客户端向模拟服务发送n个请求并输出统计"""
+    from ollama_client import OllamaBatchClient, summarize
+    from stream_parser import PredictionStreamParser
+
+    async with MockOllamaServer(delay=delay, fail_rate=fail_rate) as server:
+        messages = [{'role': 'user', 'content': '预测'}]
+        results = []
+        started = time.monotonic()
+        async with OllamaBatchClient(server.url, concurrency=concurrency, backoff=0.05) as client:
+            # 流式模式下每个请求一个增量解析器
+            factory = (lambda key: PredictionStreamParser().feed) if stream else None
+            async for result in client.run(((f'{i:06d}', messages) for i in range(n)), factory):
+                results.append(result)
+                print(result.stats())
+        elapsed = time.monotonic() - started
+        print(summarize(results))
+        print(f"{n}个请求耗时{elapsed:.2f}秒，串行需要约{n * delay:.2f}秒")
+
+
+async def serve(host, port, delay, fail_rate):
+    async with MockOllamaServer(host, port, delay, fail_rate) as server:
+        print(f"模拟Ollama服务已启动: {server.url}")
+        await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地模拟Ollama服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--delay', type=float, default=0.5, help='每个请求的处理时间（秒）')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='返回503的概率')
+    parser.add_argument('--demo', type=int, metavar='N', help='发送N个请求测试批量客户端')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--stream', action='store_true', help='测试时使用流式模式')
+    args = parser.parse_args()
+
+    if args.demo:
+        asyncio.run(demo(args.demo, args.concurrency, args.delay, args.fail_rate, args.stream))
+    else:
+        asyncio.run(serve(args.host, args.port, args.delay, args.fail_rate))
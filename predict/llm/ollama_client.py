@@ -0,0 +1,240 @@
+"""
+Ollama批量异步客户端
+
+一个ClientSession和连接池复用到底，用信号量限制同时进行的请求数，
+请求失败（连接错误、超时、429/5xx）时按指数退避重试。
+run()是异步迭代器，哪个请求先完成就先返回哪个的结果。
+stream_chat()以流式模式请求，逐段把回答内容交给回调，回调抛出异常即中止请求。
+"""
+import asyncio
+import json
+import random
+import time
+
+import aiohttp
+
+DEFAULT_URL = "http://localhost:11434/api/chat"
+DEFAULT_MODEL = "llama3.2"
+# 这些状态码说明服务端暂时不可用，值得重试
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class OllamaError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"Ollama API返回错误: {status} {message}")
+        self.status = status
+
+
+class ChatResult:
+    """一次请求的结果和耗时统计"""
+
+    def __init__(self, key):
+        self.key = key
+        self.response = None     # Ollama返回的JSON，失败时为None
+        self.error = None        # 最后一次失败的异常
+        self.attempts = 0
+        self.queue_wait = 0.0    # 等待信号量的时间（秒）
+        self.elapsed = 0.0       # 从开始发送到完成的时间（秒），包括重试
+        self.eval_count = 0      # 生成的token数
+        self.first_token = None  # 流式模式下收到第一段内容的时间（秒）
+        self.streamed = False    # 流式模式下是否已经收到内容
+
+    @property
+    def ok(self):
+        return self.response is not None
+
+    @property
+    def tokens_per_sec(self):
+        """生成速度，优先使用Ollama返回的eval_duration（纳秒）"""
+        if not self.response or not self.eval_count:
+            return 0.0
+        eval_duration = self.response.get('eval_duration')
+        seconds = eval_duration / 1e9 if eval_duration else self.elapsed
+        return self.eval_count / seconds if seconds > 0 else 0.0
+
+    def stats(self):
+        return {
+            'key': self.key,
+            'ok': self.ok,
+            'attempts': self.attempts,
+            'queue_wait': round(self.queue_wait, 3),
+            'elapsed': round(self.elapsed, 3),
+            'first_token': round(self.first_token, 3) if self.first_token is not None else None,
+            'eval_count': self.eval_count,
+            'tokens_per_sec': round(self.tokens_per_sec, 1),
+            'error': str(self.error) if self.error else None,
+        }
+
+
+class OllamaBatchClient:
+    """
+    用法：
+        async with OllamaBatchClient(concurrency=4) as client:
+            async for result in client.run([(stock_code, messages), ...]):
+                ...
+    """
+
+    def __init__(self, url=DEFAULT_URL, model=DEFAULT_MODEL, concurrency=4, timeout=300,
+                 max_retries=3, backoff=1.0, options=None):
+        self.url = url
+        self.model = model
+        self.concurrency = concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.options = options
+        self.session = None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        """在当前事件循环中创建会话，连接数与并发数一致，连接保持复用"""
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout,
+                                                 headers={'Content-Type': 'application/json'})
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def build_payload(self, messages, stream=False):
+        payload = {"model": self.model, "messages": messages, "stream": stream}
+        if self.options:
+            payload["options"] = self.options
+        return payload
+
+    async def _post(self, messages):
+        async with self.session.post(self.url, json=self.build_payload(messages)) as response:
+            if response.status != 200:
+                raise OllamaError(response.status, await response.text())
+            return await response.json(content_type=None)
+
+    async def _post_stream(self, messages, on_content, result, started_at):
+        """读取Ollama的NDJSON流，每行是一段回答内容，最后一行done为true并带有统计信息"""
+        async with self.session.post(self.url, json=self.build_payload(messages, stream=True)) as response:
+            if response.status != 200:
+                raise OllamaError(response.status, await response.text())
+            async for line in response.content:
+                line = line.strip()
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if 'error' in chunk:
+                    raise OllamaError(response.status, chunk['error'])
+                content = chunk.get('message', {}).get('content', '')
+                if content:
+                    if result.first_token is None:
+                        result.first_token = time.monotonic() - started_at
+                    result.streamed = True
+                    on_content(content)
+                if chunk.get('done'):
+                    return chunk
+            raise aiohttp.ClientPayloadError('流在done之前结束')
+
+    def retry_delay(self, attempt):
+        """第attempt次失败后的等待时间：指数退避加随机抖动"""
+        return self.backoff * (2 ** (attempt - 1)) * (0.5 + random.random())
+
+    async def chat(self, messages, key=None):
+        """发送一次对话请求，返回ChatResult，失败不抛异常"""
+        await self.open()
+        result = ChatResult(key)
+        queued_at = time.monotonic()
+        async with self.semaphore:
+            started_at = time.monotonic()
+            result.queue_wait = started_at - queued_at
+            while True:
+                result.attempts += 1
+                try:
+                    result.response = await self._post(messages)
+                    result.error = None
+                    break
+                except (aiohttp.ClientError, asyncio.TimeoutError, OllamaError) as e:
+                    result.error = e
+                    retryable = not isinstance(e, OllamaError) or e.status in RETRY_STATUS
+                    if not retryable or result.attempts > self.max_retries:
+                        break
+                    await asyncio.sleep(self.retry_delay(result.attempts))
+            result.elapsed = time.monotonic() - started_at
+        if result.response:
+            result.eval_count = result.response.get('eval_count', 0)
+        return result
+
+    async def stream_chat(self, messages, on_content, key=None):
+        """
+        以流式模式发送对话请求，每收到一段回答内容就调用on_content(text)
+
+        on_content抛出异常时立即关闭连接并中止请求，异常记录在result.error中；
+        已经收到内容后出错不再重试，避免回调收到重复内容。返回ChatResult，response为最后一行统计信息
+        """
+        await self.open()
+        result = ChatResult(key)
+        queued_at = time.monotonic()
+        async with self.semaphore:
+            started_at = time.monotonic()
+            result.queue_wait = started_at - queued_at
+            while True:
+                result.attempts += 1
+                try:
+                    result.response = await self._post_stream(messages, on_content, result, started_at)
+                    result.error = None
+                    break
+                except (aiohttp.ClientError, asyncio.TimeoutError, OllamaError) as e:
+                    result.error = e
+                    retryable = not isinstance(e, OllamaError) or e.status in RETRY_STATUS
+                    if not retryable or result.streamed or result.attempts > self.max_retries:
+                        break
+                    await asyncio.sleep(self.retry_delay(result.attempts))
+                except Exception as e:
+                    # 回调要求中止
+                    result.error = e
+                    break
+            result.elapsed = time.monotonic() - started_at
+        if result.response:
+            result.eval_count = result.response.get('eval_count', 0)
+        return result
+
+    async def run(self, requests, on_content_factory=None):
+        """
+        并发发送一批请求，按完成顺序逐个返回ChatResult
+
+        requests为(key, messages)的可迭代对象，key用于识别结果属于哪个请求（例如股票代码）；
+        传入on_content_factory时使用流式模式，on_content_factory(key)返回该请求的内容回调
+        """
+        if on_content_factory is None:
+            tasks = [asyncio.ensure_future(self.chat(messages, key)) for key, messages in requests]
+        else:
+            tasks = [asyncio.ensure_future(self.stream_chat(messages, on_content_factory(key), key))
+                     for key, messages in requests]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # 调用方提前退出迭代时取消剩余请求
+            for task in tasks:
+                task.cancel()
+
+
+def summarize(results):
+    """汇总一批请求的吞吐量"""
+    done = [r for r in results if r.ok]
+    total_tokens = sum(r.eval_count for r in done)
+    return {
+        'requests': len(results),
+        'succeeded': len(done),
+        'failed': len(results) - len(done),
+        'retries': sum(r.attempts - 1 for r in results),
+        'avg_queue_wait': sum(r.queue_wait for r in results) / len(results) if results else 0.0,
+        'max_queue_wait': max((r.queue_wait for r in results), default=0.0),
+        'avg_tokens_per_sec': sum(r.tokens_per_sec for r in done) / len(done) if done else 0.0,
+        'total_tokens': total_tokens,
+    }
@@ -0,0 +1,101 @@
+"""
+LLM回答缓存
+
+以 模型名 + 全部消息（系统提示词和渲染后的提示词）的SHA-256为键，缓存解析好的预测JSON。
+数据保存在SQLite中，超过TTL的记录视为失效，总大小超过上限时按最近访问时间淘汰。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# 默认缓存文件，可以通过环境变量SCAS_LLM_CACHE覆盖
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'responses.sqlite')
+DEFAULT_TTL = 12 * 3600            # 秒
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def make_key(model, messages):
+    """缓存键：模型名和全部消息内容的哈希"""
+    payload = json.dumps([model, messages], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=None, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path or os.environ.get('SCAS_LLM_CACHE', DEFAULT_PATH)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)")
+        self.conn.commit()
+
+    def get(self, key):
+        """读取缓存的结果，不存在或已过期时返回None"""
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.conn.commit()
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value, model=None):
+        """写入结果，然后按需淘汰"""
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, data, len(data.encode('utf-8')), now, now))
+            self.conn.commit()
+            self._evict(now)
+
+    def _evict(self, now):
+        """删除过期记录，总大小仍超过上限时从最久未访问的记录开始删除"""
+        self.conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            removed = []
+            for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+                if total <= self.max_bytes:
+                    break
+                removed.append((key,))
+                total -= size
+            self.conn.executemany("DELETE FROM responses WHERE key = ?", removed)
+        self.conn.commit()
+
+    def stats(self):
+        with self._lock:
+            count, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {'entries': count, 'bytes': size, 'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,153 @@
+"""
+预测结果的增量JSON解析器
+
+模型的回答是流式到达的文本，格式为（前后可能带有说明文字和//注释）：
+    {"predictions": [{"date": ..., "price": ..., "confidence": ...}, ...], "analysis": ..., "factors": [...]}
+feed()每收到一段文本就向前扫描，predictions数组中的对象一闭合就解析并返回，
+不需要等整个回答结束；格式不对时立即抛出StreamParseError，调用方可以中止请求。
+解析器只保留当前未闭合的预测对象和除预测数组外的其余JSON（很小），不保存整个回答。
+"""
+import json
+import re
+
+# 第一个'{'之前允许的说明文字长度，超过说明模型没有按要求输出JSON
+MAX_PREAMBLE = 4096
+# 单个预测对象的最大长度
+MAX_OBJECT = 1024
+
+_PREDICTIONS_KEY = re.compile(r'"predictions"\s*:\s*$')
+
+
+class StreamParseError(Exception):
+    pass
+
+
+class PredictionStreamParser:
+    def __init__(self, max_preamble=MAX_PREAMBLE):
+        self.max_preamble = max_preamble
+        self.predictions = []
+        self.preamble = 0
+        self.started = False      # 是否已遇到顶层'{'
+        self.finished = False     # 顶层对象是否已闭合
+        self.stack = []           # 未闭合的'{'和'['
+        self.in_string = False
+        self.escape = False
+        self.slash = False        # 上一个字符是字符串外的'/'
+        self.in_comment = False   # 在//注释中
+        self.skeleton = []        # 除预测对象外的JSON文本
+        self.predictions_depth = None  # predictions数组所在的栈深度
+        self.current = None       # 正在读取的预测对象文本
+
+    def feed(self, text):
+        """输入一段文本，返回这段文本中新闭合的预测对象列表"""
+        completed = []
+        for ch in text:
+            if self.finished:
+                break
+            if not self.started:
+                if ch == '{':
+                    self.started = True
+                else:
+                    self.preamble += 1
+                    if self.preamble > self.max_preamble:
+                        raise StreamParseError(f"超过{self.max_preamble}个字符仍未找到JSON内容")
+                    continue
+            prediction = self._consume(ch)
+            if prediction is not None:
+                completed.append(prediction)
+        self.predictions.extend(completed)
+        return completed
+
+    def _emit(self, ch):
+        if self.current is not None:
+            self.current.append(ch)
+            if len(self.current) > MAX_OBJECT:
+                raise StreamParseError("预测对象过长")
+        elif not (self.predictions_depth is not None and len(self.stack) == self.predictions_depth
+                  and (ch == ',' or ch.isspace())):
+            # 预测数组内对象之间的逗号不写入skeleton
+            self.skeleton.append(ch)
+
+    def _consume(self, ch):
+        # 注释
+        if self.in_comment:
+            if ch == '\n':
+                self.in_comment = False
+                self._emit(ch)
+            return None
+        if self.slash:
+            self.slash = False
+            if ch == '/':
+                self.in_comment = True
+                return None
+            self._emit('/')
+
+        # 字符串
+        if self.in_string:
+            self._emit(ch)
+            if self.escape:
+                self.escape = False
+            elif ch == '\\':
+                self.escape = True
+            elif ch == '"':
+                self.in_string = False
+            return None
+
+        if ch == '"':
+            self.in_string = True
+        elif ch == '/':
+            self.slash = True
+            return None
+        elif ch in '{[':
+            if (ch == '[' and self.predictions_depth is None and len(self.stack) == 1
+                    and _PREDICTIONS_KEY.search(''.join(self.skeleton[-64:]))):
+                self._emit(ch)
+                self.stack.append(ch)
+                self.predictions_depth = len(self.stack)
+                return None
+            if ch == '{' and self.predictions_depth is not None and len(self.stack) == self.predictions_depth:
+                self.current = []
+            self.stack.append(ch)
+        elif ch in '}]':
+            if not self.stack or self.stack[-1] != ('{' if ch == '}' else '['):
+                raise StreamParseError(f"括号不匹配: {ch}")
+            self.stack.pop()
+            if self.current is not None and len(self.stack) == self.predictions_depth:
+                self.current.append(ch)
+                text, self.current = ''.join(self.current), None
+                return self._parse_prediction(text)
+            if ch == ']' and self.predictions_depth is not None and len(self.stack) == self.predictions_depth - 1:
+                # predictions数组结束
+                self.predictions_depth = -1
+            if not self.stack:
+                self.finished = True
+        self._emit(ch)
+        return None
+
+    @staticmethod
+    def _parse_prediction(text):
+        try:
+            prediction = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise StreamParseError(f"预测对象不是合法的JSON: {text[:100]} ({e})")
+        if not isinstance(prediction, dict) or 'date' not in prediction or 'price' not in prediction:
+            raise StreamParseError(f"预测对象缺少date或price: {text[:100]}")
+        if not isinstance(prediction['price'], (int, float)):
+            raise StreamParseError(f"预测价格不是数字: {prediction['price']}")
+        return prediction
+
+    def result(self):
+        """回答结束后返回完整结果，格式与非流式解析得到的JSON相同"""
+        if not self.started:
+            raise StreamParseError("未找到JSON内容")
+        skeleton = {}
+        if self.finished:
+            try:
+                skeleton = json.loads(''.join(self.skeleton))
+            except json.JSONDecodeError:
+                skeleton = {}
+        return {
+            'predictions': self.predictions,
+            'analysis': skeleton.get('analysis', '') if isinstance(skeleton, dict) else '',
+            'factors': skeleton.get('factors', []) if isinstance(skeleton, dict) else [],
+        }
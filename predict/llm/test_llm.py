@@ -34,10 +34,10 @@ async def test_model():
         print("预测失败")
         return
         
-    predictions, dates, analysis, factors = result
+    forecast, analysis, factors = result
     
     # 可视化预测结果
-    plot_predictions(kline_data, predictions, dates, analysis, factors)
+    plot_predictions(kline_data, forecast['price'], pd.to_datetime(forecast['date']), analysis, factors)
     
 def plot_predictions(kline_data, predictions, pred_dates, analysis, factors):
     """可视化历史数据和预测结果"""
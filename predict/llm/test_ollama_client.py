@@ -0,0 +1,152 @@
+"""
+批量客户端和流式解析器的测试，使用mock_ollama.py中的本地模拟服务，不需要真实的Ollama
+
+用法：
+    python -m unittest test_ollama_client.py
+"""
+import json
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from mock_ollama import MockOllamaServer, build_content  # noqa: E402
+from ollama_client import OllamaBatchClient, OllamaError, summarize  # noqa: E402
+from stream_parser import PredictionStreamParser, StreamParseError  # noqa: E402
+
+MESSAGES = [{'role': 'user', 'content': '预测'}]
+
+
+def expected_result(seed, days=90):
+    """模拟服务第seed个请求的回答中的JSON"""
+    return json.loads(build_content(days, seed=seed).split('\n', 1)[1])
+
+
+class OllamaBatchClientTest(unittest.IsolatedAsyncioTestCase):
+    async def test_chat_returns_full_answer(self):
+        async with MockOllamaServer(delay=0) as server:
+            async with OllamaBatchClient(server.url) as client:
+                result = await client.chat(MESSAGES, key='601360')
+        self.assertTrue(result.ok)
+        self.assertEqual(result.key, '601360')
+        self.assertEqual(result.attempts, 1)
+        self.assertGreater(result.eval_count, 0)
+        content = result.response['message']['content']
+        self.assertEqual(json.loads(content.split('\n', 1)[1]), expected_result(1))
+
+    async def test_run_bounds_concurrency(self):
+        async with MockOllamaServer(delay=0.1) as server:
+            async with OllamaBatchClient(server.url, concurrency=4) as client:
+                results = [r async for r in client.run((f'{i:06d}', MESSAGES) for i in range(12))]
+        self.assertEqual(sorted(r.key for r in results), [f'{i:06d}' for i in range(12)])
+        self.assertTrue(all(r.ok for r in results))
+        # 模拟服务观察到的同时处理的请求数：请求确实并发发出，且不超过并发上限
+        self.assertEqual(server.max_in_flight, 4)
+        self.assertEqual(server.in_flight, 0)
+        self.assertEqual(summarize(results)['succeeded'], 12)
+
+    async def test_retries_busy_server(self):
+        async with MockOllamaServer(delay=0, fail_first=2) as server:
+            async with OllamaBatchClient(server.url, max_retries=3, backoff=0.01) as client:
+                result = await client.chat(MESSAGES)
+        self.assertTrue(result.ok)
+        self.assertEqual(result.attempts, 3)
+        self.assertIsNone(result.error)
+        self.assertEqual(server.request_count, 3)
+
+    async def test_gives_up_after_max_retries(self):
+        async with MockOllamaServer(delay=0, fail_first=10) as server:
+            async with OllamaBatchClient(server.url, max_retries=1, backoff=0.01) as client:
+                result = await client.chat(MESSAGES)
+        self.assertFalse(result.ok)
+        self.assertEqual(result.attempts, 2)
+        self.assertIsInstance(result.error, OllamaError)
+        self.assertEqual(result.error.status, 503)
+        self.assertEqual(summarize([result])['retries'], 1)
+
+    async def test_stream_parses_predictions_incrementally(self):
+        parser = PredictionStreamParser()
+        # 每次回调时已经解析出的预测数
+        progress = []
+
+        def on_content(text):
+            parser.feed(text)
+            progress.append(len(parser.predictions))
+
+        async with MockOllamaServer(delay=0) as server:
+            async with OllamaBatchClient(server.url) as client:
+                result = await client.stream_chat(MESSAGES, on_content)
+
+        self.assertTrue(result.ok)
+        self.assertTrue(result.response['done'])
+        self.assertIsNotNone(result.first_token)
+        expected = expected_result(1)
+        self.assertEqual(parser.result(), expected)
+        # 预测对象在回答结束之前就陆续解析出来
+        self.assertGreater(len(progress), len(expected['predictions']))
+        self.assertLess(progress.index(1), len(progress) // 2)
+
+    async def test_stream_aborts_when_callback_raises(self):
+        def on_content(text):
+            raise StreamParseError('格式错误')
+
+        async with MockOllamaServer(delay=0) as server:
+            async with OllamaBatchClient(server.url, max_retries=3, backoff=0.01) as client:
+                result = await client.stream_chat(MESSAGES, on_content)
+        self.assertFalse(result.ok)
+        self.assertEqual(result.attempts, 1)
+        self.assertIsInstance(result.error, StreamParseError)
+        self.assertEqual(server.request_count, 1)
+
+    async def test_stream_retries_before_first_content(self):
+        parser = PredictionStreamParser()
+        async with MockOllamaServer(delay=0, fail_first=1) as server:
+            async with OllamaBatchClient(server.url, max_retries=2, backoff=0.01) as client:
+                result = await client.stream_chat(MESSAGES, parser.feed)
+        self.assertTrue(result.ok)
+        self.assertEqual(result.attempts, 2)
+        self.assertEqual(parser.result(), expected_result(2))
+
+
+class PredictionStreamParserTest(unittest.TestCase):
+    TEXT = ('以下是预测：\n{"predictions": [\n'
+            '  {"date": "2025-01-02", "price": 10.5, "confidence": 0.8}, // 第一天\n'
+            '  {"date": "2025-01-03", "price": 10.6, "confidence": 0.7}\n'
+            '], "analysis": "价格\\"上涨\\"", "factors": ["a", "b"]}\n说明文字')
+
+    def test_split_anywhere_gives_same_result(self):
+        whole = PredictionStreamParser()
+        whole.feed(self.TEXT)
+        for size in (1, 2, 7, 50):
+            parser = PredictionStreamParser()
+            for i in range(0, len(self.TEXT), size):
+                parser.feed(self.TEXT[i:i + size])
+            self.assertEqual(parser.result(), whole.result())
+        self.assertEqual(whole.result(), {
+            'predictions': [
+                {'date': '2025-01-02', 'price': 10.5, 'confidence': 0.8},
+                {'date': '2025-01-03', 'price': 10.6, 'confidence': 0.7},
+            ],
+            'analysis': '价格"上涨"',
+            'factors': ['a', 'b'],
+        })
+
+    def test_prediction_returned_when_object_closes(self):
+        parser = PredictionStreamParser()
+        head, tail = self.TEXT.split('// 第一天')
+        self.assertEqual(parser.feed(head), [{'date': '2025-01-02', 'price': 10.5, 'confidence': 0.8}])
+        self.assertEqual(len(parser.feed(tail)), 1)
+
+    def test_rejects_bad_prediction(self):
+        parser = PredictionStreamParser()
+        with self.assertRaises(StreamParseError):
+            parser.feed('{"predictions": [{"date": "2025-01-02", "price": "高"}]}')
+
+    def test_rejects_long_preamble(self):
+        parser = PredictionStreamParser(max_preamble=10)
+        with self.assertRaises(StreamParseError):
+            parser.feed('这不是JSON格式的回答，没有任何括号')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+模型仓库
+
+按 股票代码/模型类型 保存训练好的模型、拟合好的MinMaxScaler和训练元数据：
+    {root}/{stock_code}/{model_type}/model.keras
+    {root}/{stock_code}/{model_type}/scaler.joblib
+    {root}/{stock_code}/{model_type}/metadata.json
+metadata.json最后写入，存在即表示这一组文件完整。
+"""
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+
+import joblib
+import numpy as np
+import tensorflow as tf
+
+# 默认模型目录，可以通过环境变量SCAS_MODEL_REGISTRY覆盖
+DEFAULT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+
+
+def data_hash(values):
+    """训练数据的指纹，数据完全相同时才相同"""
+    array = np.ascontiguousarray(np.asarray(values, dtype=np.float64).ravel())
+    return hashlib.sha256(array.tobytes()).hexdigest()
+
+
+class ModelRegistry:
+    def __init__(self, root=None):
+        self.root = os.path.abspath(root or os.environ.get('SCAS_MODEL_REGISTRY', DEFAULT_ROOT))
+
+    def path_of(self, stock_code, model_type):
+        return os.path.join(self.root, str(stock_code), model_type)
+
+    def load_metadata(self, stock_code, model_type):
+        """读取训练元数据，没有保存过时返回None"""
+        path = os.path.join(self.path_of(stock_code, model_type), 'metadata.json')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def load(self, stock_code, model_type):
+        """读取(模型, scaler, 元数据)，没有保存过或文件损坏时返回None"""
+        metadata = self.load_metadata(stock_code, model_type)
+        if metadata is None:
+            return None
+        path = self.path_of(stock_code, model_type)
+        try:
+            model = tf.keras.models.load_model(os.path.join(path, 'model.keras'))
+            scaler = joblib.load(os.path.join(path, 'scaler.joblib'))
+        except Exception as e:
+            print(f"读取模型{stock_code}/{model_type}失败: {e}")
+            return None
+        return model, scaler, metadata
+
+    def save(self, stock_code, model_type, model, scaler, metadata):
+        """保存模型、scaler和元数据，先写临时目录再整体替换"""
+        path = self.path_of(stock_code, model_type)
+        tmp_path = path + '.tmp'
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        model.save(os.path.join(tmp_path, 'model.keras'))
+        joblib.dump(scaler, os.path.join(tmp_path, 'scaler.joblib'))
+        metadata = dict(metadata, saved_at=datetime.now().isoformat())
+        with open(os.path.join(tmp_path, 'metadata.json'), 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
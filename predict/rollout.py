@@ -0,0 +1,71 @@
+import numpy as np
+import tensorflow as tf
+
+
+class RolloutEngine:
+    """
+    自回归滚动预测引擎
+
+    把最近time_steps天的序列作为输入，逐日预测并把预测值追加到序列末尾，重复steps次。
+    多只股票（或多个情景）组成一个batch一起滚动，每一步只调用一次编译好的模型，
+    预测1000只股票90天只需要90次批量调用。
+    多特征输入时模型只预测target_column（收盘价），新一天的其他特征由调用方传入的next_features
+    （例如features.FeatureRoller）根据预测值重新计算，不能直接沿用最近一天的值，
+    否则从第2步起模型看到的收益率、RSI、MACD等与预测的价格路径相矛盾。
+    """
+
+    def __init__(self, model, time_steps, n_features=1, target_column=0):
+        self.model = model
+        self.time_steps = time_steps
+        self.n_features = n_features
+        self.target_column = target_column
+        # 固定输入签名，batch大小变化时不会重新trace
+        self._step = tf.function(
+            self._call_model,
+            input_signature=[tf.TensorSpec([None, time_steps, n_features], tf.float32)]
+        )
+
+    def _call_model(self, window):
+        # 直接调用模型，避免model.predict每次调用的固定开销
+        return self.model(window, training=False)
+
+    def rollout(self, last_sequences, steps, next_features=None):
+        """
+        批量滚动预测
+
+        last_sequences: (batch, time_steps, n_features) 或单只股票的 (time_steps, n_features)
+        next_features: next_features(rows, predictions)返回新一天的特征行(batch, n_features)，
+                       rows复制自最近一天且目标列已替换为预测值；n_features > 1时必须提供
+        返回 (batch, steps) 的预测值（与输入同一归一化尺度），单只股票输入时返回 (steps,)
+        """
+        if self.n_features > 1 and next_features is None:
+            raise ValueError("多特征模型的滚动预测需要next_features根据预测值重新计算其他特征")
+        sequences = np.asarray(last_sequences, dtype=np.float32)
+        single = sequences.ndim == 2
+        if single:
+            sequences = sequences[np.newaxis]
+        batch = sequences.shape[0]
+        sequences = sequences.reshape(batch, self.time_steps, self.n_features)
+        t = self.time_steps
+
+        # 镜像环形缓冲区：每个值同时写在head和head+t两个位置，
+        # buffer[:, head:head + t]始终是按时间顺序排列的当前窗口，读取时不需要np.roll或拷贝
+        buffer = np.empty((batch, 2 * t, self.n_features), dtype=np.float32)
+        buffer[:, :t] = sequences
+        buffer[:, t:] = sequences
+        predictions = np.empty((batch, steps), dtype=np.float32)
+
+        head = 0
+        for i in range(steps):
+            next_pred = self._step(buffer[:, head:head + t]).numpy().reshape(batch)
+            predictions[:, i] = next_pred
+            # 新的一天：目标列替换为预测值，其他特征由next_features重新计算，覆盖窗口中最早的一天
+            new_row = buffer[:, head + t - 1].copy()
+            new_row[:, self.target_column] = next_pred
+            if next_features is not None:
+                new_row = next_features(new_row, next_pred)
+            buffer[:, head] = new_row
+            buffer[:, head + t] = new_row
+            head = (head + 1) % t
+
+        return predictions[0] if single else predictions
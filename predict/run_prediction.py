@@ -1,11 +1,17 @@
 from stock_prediction_service import StockPredictionService
 import json
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 import pandas as pd
 import os
+import sys
 import logging
 from datetime import datetime
 
+# 将仓库根目录加入模块搜索路径，以便导入公共模块common
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.db import get_engine, dispose_engine  # noqa: E402
+from common.kline_store import KlineStore  # noqa: E402
+
 def setup_logger():
     """配置日志"""
     log_dir = os.path.join(os.path.dirname(__file__), 'logs')
@@ -25,19 +31,18 @@ def setup_logger():
     
     return logging.getLogger(__name__)
 
-def get_kline_data(logger):
-    """从数据库获取601360的K线数据"""
-    stock_code = '601360'
-    db_config = {
-        'user': 'root',
-        'password': '123456',
-        'host': '127.0.0.1',
-        'database': 'stocks'
-    }
-    
-    engine = create_engine(
-        f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}")
-    
+# K线列
+KLINE_COLUMNS = ['date_time', 'open_price', 'high_price', 'low_price', 'close_price', 'volume', 'trade_value',
+                 'turnover_rate']
+
+def get_kline_data(stock_code, logger):
+    """获取股票的K线数据，优先读取K线列式存储，没有数据时从数据库读取"""
+    df = KlineStore().read_df(stock_code, columns=KLINE_COLUMNS)
+    if df is not None:
+        df = df.rename(columns={'trade_value': 'amount'})
+        logger.info(f"从K线存储获取股票{stock_code}的K线数据：{len(df)}条记录")
+        return df
+
     try:
         query = text("""
             SELECT 
@@ -47,43 +52,38 @@ def get_kline_data(logger):
                 low_price,
                 close_price,
                 volume,
-                trade_value as amount
+                trade_value as amount,
+                turnover_rate
             FROM stock_kline 
-            WHERE stock_code = '601360'
+            WHERE stock_code = :code
             ORDER BY date_time
         """)
         
-        df = pd.read_sql(query, engine)
-        
-        # 保存为CSV文件供模型使用
-        csv_path = 'cnn/601360_klines.csv'
-        os.makedirs('cnn', exist_ok=True)
-        df.to_csv(csv_path, index=False)
+        # 预测需要完整的K线序列，直接一次读取，分块读取再拼接只会多一份拷贝
+        df = pd.read_sql(query, get_engine(), params={'code': stock_code})
         
-        logger.info(f"成功获取股票601360的K线数据：{len(df)}条记录")
-        return csv_path
+        logger.info(f"成功获取股票{stock_code}的K线数据：{len(df)}条记录")
+        return df
         
     except Exception as e:
         logger.error(f"获取K线数据时出错: {e}", exc_info=True)
         return None
-    finally:
-        engine.dispose()
 
-def main():
+def main(stock_code='601360'):
     # 初始化日志
     logger = setup_logger()
     logger.info("开始运行股票预测程序")
     
     # 获取K线数据
-    csv_path = get_kline_data(logger)
+    kline_data = get_kline_data(stock_code, logger)
     
-    if not csv_path:
+    if kline_data is None or kline_data.empty:
         logger.error("无法获取K线数据，程序退出")
         return
         
     # 初始化预测服务并运行预测
-    service = StockPredictionService(csv_path)
-    results = service.run_predictions('601360')
+    service = StockPredictionService(kline_data)
+    results = service.run_predictions(stock_code)
     
     # 打印结果
     logger.info("\n预测结果:")
@@ -111,4 +111,5 @@ def main():
         logger.warning("没有有效的模型评估结果")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
+    dispose_engine() 
\ No newline at end of file
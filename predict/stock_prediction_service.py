@@ -6,14 +6,29 @@ import tensorflow as tf
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import LSTM, Dense, Dropout, Conv1D, MaxPooling1D, Flatten
 import matplotlib.pyplot as plt
-from sqlalchemy import create_engine, Table, MetaData, insert, text
+from sqlalchemy import delete
 from datetime import datetime, timedelta
+import os
+import sys
 from llm.llm import LLMPredictionService  # 导入LLM服务
+from rollout import RolloutEngine
+from model_registry import ModelRegistry, data_hash
+from window_dataset import make_windows, WindowSequence
+from features import FeatureCache, FeatureRoller, FEATURE_COLUMNS
+
+# 将仓库根目录加入模块搜索路径，以便导入公共模块common
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.bulk_loader import insert_records  # noqa: E402
+from common.db import get_engine, get_table  # noqa: E402
+
+# 从头训练和增量微调的轮数
+TRAIN_EPOCHS = 50
+FINE_TUNE_EPOCHS = 5
 
 class StockPredictionService:
-    def __init__(self, data_path):
-        # 加载数据
-        self.data = pd.read_csv(data_path)
+    def __init__(self, data, llm_service=None):
+        # 加载数据，data可以是K线DataFrame或CSV文件路径
+        self.data = data if isinstance(data, pd.DataFrame) else pd.read_csv(data)
         
         # 适配新的字段名称
         if 'close_price' in self.data.columns:
@@ -29,33 +44,35 @@ class StockPredictionService:
         self.time_steps = 20
         self.future_days = 90
         
-        # 数据库配置
-        self.db_config = {
-            'user': 'root',
-            'password': '123456',
-            'host': '127.0.0.1',
-            'database': 'stocks'
-        }
+        # 进程内共享的数据库连接池
+        self.engine = get_engine()
+        
+        # 初始化LLM服务，批量预测时由工作进程传入共享的服务
+        self.llm_service = llm_service or LLMPredictionService()
+        
+        # 每个模型一个滚动预测引擎，模型调用只编译一次；每只股票预测完后清空
+        self._rollout_engines = {}
         
-        # 创建数据库连接
-        self.engine = create_engine(
-            f"mysql+mysqlconnector://{self.db_config['user']}:{self.db_config['password']}@{self.db_config['host']}/{self.db_config['database']}"
-        )
+        # 训练好的模型按股票和模型类型保存，下次运行时热启动
+        self.registry = ModelRegistry()
         
-        # 初始化LLM服务
-        self.llm_service = LLMPredictionService()
+        # 模型输入特征，第0列为预测目标收盘价；K线列不全时只使用收盘价
+        self.feature_cache = FeatureCache()
+        if {'close_price', 'high_price', 'low_price', 'volume'}.issubset(self.data.columns):
+            self.feature_columns = FEATURE_COLUMNS
+        else:
+            self.feature_columns = ['close_price']
+        self.features = self.close_prices
 
             
     def prepare_data(self, data, time_steps):
-        X, y = [], []
-        for i in range(len(data) - time_steps):
-            X.append(data[i:(i + time_steps)])
-            y.append(data[i + time_steps])
-        return np.array(X), np.array(y)
+        """构造训练窗口，返回的X和y是data的视图，不复制数据"""
+        return make_windows(data, time_steps)
     
     def build_cnn_model(self):
         model = Sequential([
-            Conv1D(filters=64, kernel_size=3, activation='relu', input_shape=(self.time_steps, 1)),
+            Conv1D(filters=64, kernel_size=3, activation='relu',
+                   input_shape=(self.time_steps, len(self.feature_columns))),
             MaxPooling1D(pool_size=2),
             Conv1D(filters=32, kernel_size=3, activation='relu'),
             MaxPooling1D(pool_size=2),
@@ -69,7 +86,7 @@ class StockPredictionService:
     
     def build_lstm_model(self):
         model = Sequential([
-            LSTM(50, return_sequences=True, input_shape=(self.time_steps, 1)),
+            LSTM(50, return_sequences=True, input_shape=(self.time_steps, len(self.feature_columns))),
             LSTM(50),
             Dense(25),
             Dropout(0.2),
@@ -90,22 +107,33 @@ class StockPredictionService:
         
         return {'mse': mse, 'mae': mae, 'r2': r2}
     
-    def predict_future(self, model, last_sequence):
-        """预测未来90天的股价"""
-        future_predictions = []
-        current_sequence = last_sequence.copy()
+    def get_rollout_engine(self, model):
+        """获取模型对应的滚动预测引擎"""
+        engine = self._rollout_engines.get(id(model))
+        # 模型被回收后id可能被新模型复用，只返回属于同一个模型的引擎
+        if engine is None or engine.model is not model:
+            engine = RolloutEngine(model, self.time_steps, n_features=model.input_shape[-1])
+            self._rollout_engines[id(model)] = engine
+        return engine
+    
+    def predict_future_batch(self, model, last_sequences, next_features=None):
+        """
+        批量预测多只股票（或多个情景）未来90天的归一化股价，返回(batch, future_days)
         
-        for _ in range(self.future_days):
-            # 预测下一天
-            next_pred = model.predict(current_sequence.reshape(1, self.time_steps, 1))
-            future_predictions.append(next_pred[0, 0])
-            
-            # 更新序列，移除最早的一天，添加新预测的一天
-            current_sequence = np.roll(current_sequence, -1)
-            current_sequence[-1] = next_pred
-            
-        # 反归一化预测结果
-        return self.scaler.inverse_transform(np.array(future_predictions).reshape(-1, 1))
+        多特征模型需要传入next_features（features.FeatureRoller），逐日根据预测的收盘价重新计算其他特征
+        """
+        return self.get_rollout_engine(model).rollout(last_sequences, self.future_days, next_features)
+    
+    def predict_future(self, model, last_sequence, scaler=None):
+        """预测未来90天的股价，scaler为训练该模型时使用的归一化器，默认为self.scaler"""
+        scaler = scaler or self.scaler
+        next_features = None
+        if model.input_shape[-1] > 1:
+            next_features = FeatureRoller(self.data, scaler, self.feature_columns)
+        future_predictions = self.predict_future_batch(model, last_sequence[np.newaxis], next_features)[0]
+        
+        # 反归一化预测结果，只还原第0列收盘价
+        return ((future_predictions - scaler.min_[0]) / scaler.scale_[0]).reshape(-1, 1)
     
     def calculate_llm_confidence(self, predictions, recent_actual, sentiment_data=None):
         """计算LLM预测的置信度"""
@@ -153,70 +181,164 @@ class StockPredictionService:
             print(f"计算LLM置信度时出错: {e}")
             return 0.5
 
-    def save_predictions_to_db(self, predictions, model_name, stock_code, accuracy=None):
-        """保存预测结果到数据库"""
-        metadata = MetaData()
-        predictions_table = Table('predictions', metadata, autoload_with=self.engine)
+    def get_confidence_level(self, predictions, model_name, accuracy=None):
+        """计算预测结果的置信度"""
+        if accuracy is None:
+            return 0.5  # 默认置信度
+        if model_name == "LLM":
+            # 使用改进的LLM置信度计算方法
+            recent_actual = self.close_prices[-90:]
+            return self.calculate_llm_confidence(predictions, recent_actual)
+        # 其他模型使用R2分数,但需要处理负值
+        return max(0.1, min(0.99, (accuracy + 1) / 2))  # 将R2转换到0.1-0.99范围
+    
+    def build_prediction_records(self, predictions, model_name, stock_code, accuracy, now):
+        """构造一个模型的全部预测记录，预测日期为now之后的第1..n天"""
+        prices = np.asarray(predictions, dtype=np.float64).reshape(-1)
+        dates = (now.normalize() + pd.to_timedelta(np.arange(1, len(prices) + 1), unit='D')).date
+        confidence_level = float(self.get_confidence_level(predictions, model_name, accuracy))
+        accuracy = None if accuracy is None else float(accuracy)
+        created_at = now.to_pydatetime()
+        return [
+            {
+                'stock_code': stock_code,
+                'model_name': model_name,
+                'prediction_date': prediction_date,
+                'predicted_price': price,
+                'accuracy': accuracy,
+                'confidence_level': confidence_level,
+                'created_at': created_at
+            }
+            for prediction_date, price in zip(dates, prices.tolist())
+        ]
+    
+    def save_all_predictions_to_db(self, stock_code, model_predictions):
+        """
+        在一个事务中保存一只股票所有模型的预测结果
+        
+        model_predictions为[(predictions, model_name, accuracy), ...]，
+        先一次删除这些模型的旧预测，再用多行INSERT批量写入
+        """
+        predictions_table = get_table('predictions')
+        now = pd.Timestamp.now()
+        
+        records = []
+        for predictions, model_name, accuracy in model_predictions:
+            records.extend(self.build_prediction_records(predictions, model_name, stock_code, accuracy, now))
+        model_names = [model_name for _, model_name, _ in model_predictions]
         
         with self.engine.begin() as connection:
-            # 删除该股票该模型的旧预测数据
+            # 删除该股票这些模型的旧预测数据
             connection.execute(
-                text("DELETE FROM predictions WHERE stock_code = :code AND model_name = :model"),
-                {"code": stock_code, "model": model_name}
+                delete(predictions_table).where(
+                    predictions_table.c.stock_code == stock_code,
+                    predictions_table.c.model_name.in_(model_names)
+                )
             )
-            
-            # 计算置信度
-            if accuracy is not None:
-                if model_name == "LLM":
-                    # 使用改进的LLM置信度计算方法
-                    recent_actual = self.close_prices[-90:]
-                    confidence_level = self.calculate_llm_confidence(predictions, recent_actual)
-                else:
-                    # 其他模型使用R2分数,但需要处理负值
-                    confidence_level = max(0.1, min(0.99, (accuracy + 1) / 2))  # 将R2转换到0.1-0.99范围
-            else:
-                confidence_level = 0.5  # 默认置信度
-                
             # 插入新的预测数据
-            for i, price in enumerate(predictions):
-                prediction_date = pd.Timestamp.now() + pd.Timedelta(days=i+1)
-                stmt = insert(predictions_table).values(
-                    stock_code=stock_code,
-                    model_name=model_name,
-                    prediction_date=prediction_date.date(),
-                    predicted_price=float(price[0]),
-                    accuracy=accuracy,
-                    confidence_level=confidence_level,
-                    created_at=pd.Timestamp.now()
-                )
-                connection.execute(stmt)
+            insert_records(connection, predictions_table, records)
+    
+    def save_predictions_to_db(self, predictions, model_name, stock_code, accuracy=None):
+        """保存一个模型的预测结果到数据库"""
+        self.save_all_predictions_to_db(stock_code, [(predictions, model_name, accuracy)])
+    
+    def train_or_load(self, stock_code, model_type, build_model):
+        """
+        训练模型或从模型仓库热启动
+        
+        - 训练数据与上次完全相同：直接使用保存的模型，不再训练
+        - 上次的训练数据是本次数据的前缀（只追加了新交易日）：沿用保存的scaler，
+          加载保存的权重后只用新划入训练集的窗口微调FINE_TUNE_EPOCHS轮
+        - 其他情况（首次运行、复权导致历史价格变化等）：重新拟合scaler并从头训练
+        返回(模型, scaler, 归一化后的特征矩阵)
+        """
+        n_rows = len(self.features)
+        current_hash = data_hash(self.features)
+        saved = self.registry.load(stock_code, model_type)
+        
+        mode = 'full'
+        if saved is not None:
+            model, scaler, metadata = saved
+            old_rows = metadata.get('n_rows', 0)
+            if (metadata.get('time_steps') != self.time_steps or old_rows > n_rows
+                    or metadata.get('features', ['close_price']) != list(self.feature_columns)):
+                mode = 'full'
+            elif metadata.get('data_hash') == current_hash:
+                mode = 'unchanged'
+            elif data_hash(self.features[:old_rows]) == metadata.get('data_hash'):
+                mode = 'fine_tune'
+        
+        if mode == 'full':
+            scaler = MinMaxScaler(feature_range=(0, 1))
+            scaled_data = scaler.fit_transform(self.features)
+        else:
+            scaled_data = scaler.transform(self.features)
+        
+        X, y = self.prepare_data(scaled_data, self.time_steps)
+        split = int(len(X) * 0.8)
+        
+        if mode == 'full':
+            model = build_model()
+            model.fit(WindowSequence((X[:split], y[:split]), batch_size=32), epochs=TRAIN_EPOCHS, verbose=0)
+            epochs = TRAIN_EPOCHS
+        elif mode == 'fine_tune':
+            # 训练集始终是前80%的窗口，只用这次新划入训练集的窗口微调
+            old_split = int(max(old_rows - self.time_steps, 0) * 0.8)
+            epochs = FINE_TUNE_EPOCHS if split > old_split else 0
+            if epochs:
+                model.fit(WindowSequence((X[old_split:split], y[old_split:split]), batch_size=32),
+                          epochs=epochs, verbose=0)
+        else:
+            epochs = 0
+        print(f"{model_type.upper()}模型: {mode}，训练{epochs}轮")
+        
+        if mode != 'unchanged':
+            self.registry.save(stock_code, model_type, model, scaler, {
+                'stock_code': stock_code,
+                'model_type': model_type,
+                'data_hash': current_hash,
+                'n_rows': n_rows,
+                'time_steps': self.time_steps,
+                'features': list(self.feature_columns),
+                'mode': mode,
+                'epochs': epochs,
+                'trained_at': datetime.now().isoformat()
+            })
+        return model, scaler, scaled_data
+    
+    def load_features(self, stock_code):
+        """读取（或计算并缓存）该股票的技术指标特征矩阵"""
+        if len(self.feature_columns) > 1:
+            frame = self.feature_cache.get(stock_code, self.data)
+            self.features = frame[self.feature_columns].to_numpy(dtype=np.float64)
+        else:
+            self.features = self.close_prices
+        return self.features
     
     def run_predictions(self, stock_code):
         """运行所有预测模型"""
-        # 运行CNN和LSTM预测
-        X, y = self.prepare_data(self.scaled_data, self.time_steps)
-        split = int(len(X) * 0.8)
-        X_train, X_test = X[:split], X[split:]
-        y_train, y_test = y[:split], y[split:]
+        self.load_features(stock_code)
         
-        # 训练和评估 CNN 模型
-        cnn_model = self.build_cnn_model()
-        cnn_model.fit(X_train, y_train, epochs=50, batch_size=32, verbose=0)
-        cnn_pred = cnn_model.predict(X_test)
-        cnn_metrics = self.evaluate_model(y_test, cnn_pred, "CNN")
+        # 运行CNN和LSTM预测，模型从仓库热启动或重新训练
+        cnn_model, cnn_scaler, cnn_scaled = self.train_or_load(stock_code, 'cnn', self.build_cnn_model)
+        lstm_model, lstm_scaler, lstm_scaled = self.train_or_load(stock_code, 'lstm', self.build_lstm_model)
         
-        # 训练和评估 LSTM 模型
-        lstm_model = self.build_lstm_model()
-        lstm_model.fit(X_train, y_train, epochs=50, batch_size=32, verbose=0)
-        lstm_pred = lstm_model.predict(X_test)
-        lstm_metrics = self.evaluate_model(y_test, lstm_pred, "LSTM")
+        # 在最后20%的窗口上评估
+        X_cnn, y_cnn = self.prepare_data(cnn_scaled, self.time_steps)
+        split = int(len(X_cnn) * 0.8)
+        cnn_pred = cnn_model.predict(X_cnn[split:])
+        cnn_metrics = self.evaluate_model(y_cnn[split:], cnn_pred, "CNN")
         
-        # 获取最后的序列用于预测未来
-        last_sequence = self.scaled_data[-self.time_steps:]
+        X_lstm, y_lstm = self.prepare_data(lstm_scaled, self.time_steps)
+        lstm_pred = lstm_model.predict(X_lstm[split:])
+        lstm_metrics = self.evaluate_model(y_lstm[split:], lstm_pred, "LSTM")
         
-        # 预测未来90天
-        cnn_future = self.predict_future(cnn_model, last_sequence)
-        lstm_future = self.predict_future(lstm_model, last_sequence)
+        # 预测未来90天，之后释放引擎中的模型引用和编译好的函数
+        try:
+            cnn_future = self.predict_future(cnn_model, cnn_scaled[-self.time_steps:], cnn_scaler)
+            lstm_future = self.predict_future(lstm_model, lstm_scaled[-self.time_steps:], lstm_scaler)
+        finally:
+            self._rollout_engines.clear()
         
         # 运行LLM预测
         llm_future = None
@@ -240,7 +362,8 @@ class StockPredictionService:
                 )
                 
                 if llm_result is not None:
-                    predictions, dates, analysis, factors = llm_result
+                    forecast, analysis, factors = llm_result
+                    predictions = forecast['price']
                     llm_future = predictions.reshape(-1, 1)
                     
                     # 计算评估指标
@@ -258,15 +381,19 @@ class StockPredictionService:
                     print("\nLLM分析结果:")
                     print(f"分析: {analysis}")
                     print(f"影响因素: {factors}")
+                    print(f"模型给出的平均置信度: {np.nanmean(forecast['confidence']):.2f}")
                     
         except Exception as e:
             print(f"LLM预测出错: {e}")
         
-        # 保存预测结果到数据库
-        self.save_predictions_to_db(cnn_future, "CNN", stock_code, cnn_metrics['r2'])
-        self.save_predictions_to_db(lstm_future, "LSTM", stock_code, lstm_metrics['r2'])
+        # 在一个事务中保存所有模型的预测结果
+        model_predictions = [
+            (cnn_future, "CNN", cnn_metrics['r2']),
+            (lstm_future, "LSTM", lstm_metrics['r2'])
+        ]
         if llm_future is not None:
-            self.save_predictions_to_db(llm_future, "LLM", stock_code, llm_metrics['r2'])
+            model_predictions.append((llm_future, "LLM", llm_metrics['r2']))
+        self.save_all_predictions_to_db(stock_code, model_predictions)
         
         return {
             'metrics': {
@@ -280,8 +407,3 @@ class StockPredictionService:
                 'llm': llm_future.tolist() if llm_future is not None else None
             }
         }
-        
-    def __del__(self):
-        """清理资源"""
-        if hasattr(self, 'engine'):
-            self.engine.dispose() 
\ No newline at end of file
@@ -0,0 +1,86 @@
+"""
+滑动窗口数据集
+
+用numpy.lib.stride_tricks.sliding_window_view构造训练窗口，X和y都是原数组的视图，
+不会把序列复制time_steps份；原数组可以是np.memmap，窗口在取批次时才真正读入内存。
+WindowSequence按批次把窗口交给model.fit，每次只复制一个批次。
+"""
+import math
+
+import numpy as np
+import tensorflow as tf
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def make_windows(data, time_steps, target_column=0):
+    """
+    构造(X, y)窗口视图
+
+    data: (n,) 或 (n, n_features)，例如收盘价或OHLCV
+    返回 X: (n - time_steps, time_steps, n_features)，第i个窗口为data[i:i + time_steps]
+         y: (n - time_steps, 1)，第i个目标为data[i + time_steps, target_column]
+    """
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = data[:, np.newaxis]
+    n = len(data)
+    if n <= time_steps:
+        return (np.empty((0, time_steps, data.shape[1]), dtype=data.dtype),
+                np.empty((0, 1), dtype=data.dtype))
+
+    # (n - time_steps + 1, n_features, time_steps) -> (n - time_steps + 1, time_steps, n_features)
+    windows = sliding_window_view(data, time_steps, axis=0).swapaxes(1, 2)
+    # 最后一个窗口之后没有目标值
+    X = windows[:-1]
+    y = data[time_steps:, target_column:target_column + 1]
+    return X, y
+
+
+class WindowSequence(tf.keras.utils.Sequence):
+    """
+    按批次读取窗口的数据集，可直接传给model.fit
+
+    parts为一个(X, y)或多个(X, y)组成的列表（例如多只股票的窗口），
+    窗口不会跨越不同的部分；shuffle=True时每轮打乱窗口顺序。
+    """
+
+    def __init__(self, parts, batch_size=32, shuffle=True, seed=None, **kwargs):
+        super().__init__(**kwargs)
+        if isinstance(parts, tuple):
+            parts = [parts]
+        self.parts = [(X, y) for X, y in parts if len(X) > 0]
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+
+        # 全局窗口编号 -> (部分编号, 部分内编号)
+        sizes = np.array([len(X) for X, _ in self.parts], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)])
+        self.size = int(self.offsets[-1])
+        self.order = np.arange(self.size)
+        if self.shuffle:
+            self.rng.shuffle(self.order)
+
+    def __len__(self):
+        return math.ceil(self.size / self.batch_size)
+
+    def __getitem__(self, index):
+        ids = self.order[index * self.batch_size:(index + 1) * self.batch_size]
+        if len(self.parts) == 1:
+            X, y = self.parts[0]
+            # 花式索引只复制这个批次
+            return X[ids].astype(np.float32), y[ids].astype(np.float32)
+
+        part_ids = np.searchsorted(self.offsets, ids, side='right') - 1
+        X_batch, y_batch = [], []
+        for part in np.unique(part_ids):
+            local = ids[part_ids == part] - self.offsets[part]
+            X, y = self.parts[part]
+            X_batch.append(X[local])
+            y_batch.append(y[local])
+        return (np.concatenate(X_batch).astype(np.float32),
+                np.concatenate(y_batch).astype(np.float32))
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.rng.shuffle(self.order)